@@ -3,19 +3,26 @@ API endpoints for period status management and notifications
 Mos-GSM Salary Service
 """
 
-from fastapi import APIRouter, Request, HTTPException
-from fastapi.responses import JSONResponse
+import asyncio
+import hashlib
+import time
+
+from fastapi import APIRouter, Request, Response, Depends
+from fastapi.responses import StreamingResponse
 from typing import List
 
 from database import (
     database, PeriodStatus, 
-    get_period_status, update_period_status, is_latest_period,
-    save_notification, get_period_notifications, get_audit_log
+    update_period_status,
+    save_notifications_bulk, get_period_notifications, get_audit_log, iter_audit_log
 )
-from auth import get_current_user
+from config import logger
+from json_response import ORJSONResponse, orjson_dumps
+from auth import require_auth, require_admin, BITRIX_DOMAIN
 from permissions import (
     check_send_permission, check_send_to_accountant_permission,
-    check_unlock_permission, get_user_permissions, log_user_action
+    check_unlock_permission, get_user_permissions, get_user_permissions_bulk, log_user_action,
+    invalidate_period_permissions, get_period_cached
 )
 
 router = APIRouter(prefix="/api", tags=["status"])
@@ -26,53 +33,60 @@ router = APIRouter(prefix="/api", tags=["status"])
 @router.get("/permissions")
 async def api_get_permissions(request: Request, period_id: int = None):
     """Get current user's permissions, optionally for a specific period"""
+    permissions = await get_user_permissions(request, period_id)
+    return ORJSONResponse({"success": True, "permissions": permissions})
+
+
+@router.get("/permissions/bulk")
+async def api_get_permissions_bulk(request: Request, period_ids: str = ""):
+    """Get current user's permissions for several periods (period_ids=1,2,3)"""
     try:
-        permissions = await get_user_permissions(request, period_id)
-        return JSONResponse({"success": True, "permissions": permissions})
-    except Exception as e:
-        return JSONResponse({"success": False, "error": str(e)})
+        ids = [int(x) for x in period_ids.split(",") if x.strip()]
+    except ValueError:
+        return ORJSONResponse({"success": False, "error": "Некорректный список периодов"}, status_code=400)
+    
+    permissions = await get_user_permissions_bulk(request, ids)
+    return ORJSONResponse({"success": True, "permissions": permissions})
 
 
 @router.get("/period/{period_id}/permissions")
 async def api_get_period_permissions(request: Request, period_id: int):
     """Get current user's permissions for a specific period"""
-    try:
-        permissions = await get_user_permissions(request, period_id)
-        return JSONResponse({"success": True, "permissions": permissions})
-    except Exception as e:
-        return JSONResponse({"success": False, "error": str(e)})
+    permissions = await get_user_permissions(request, period_id)
+    return ORJSONResponse({"success": True, "permissions": permissions})
 
 
 # ============== STATUS API ==============
 
 @router.get("/period/{period_id}/status")
 async def api_get_period_status(request: Request, period_id: int):
-    """Get period status and info"""
-    try:
-        period = await get_period_status(period_id)
-        if not period:
-            return JSONResponse({"success": False, "error": "Период не найден"}, status_code=404)
-        
-        is_latest = await is_latest_period(period_id)
-        
-        return JSONResponse({
-            "success": True,
-            "period": {
-                "id": period["id"],
-                "name": period["name"],
-                "status": period["status"],
-                "status_label": {
-                    PeriodStatus.DRAFT: "Черновик",
-                    PeriodStatus.SENT: "Отправлено монтажникам",
-                    PeriodStatus.PAID: "Оплачено",
-                }.get(period["status"], period["status"]),
-                "sent_at": str(period["sent_at"]) if period.get("sent_at") else None,
-                "paid_at": str(period["paid_at"]) if period.get("paid_at") else None,
-                "is_latest": is_latest,
-            }
-        })
-    except Exception as e:
-        return JSONResponse({"success": False, "error": str(e)})
+    """
+    Get period status and info.
+    Supports conditional requests (ETag / If-None-Match) for frontend polling.
+    """
+    period = await get_period_cached(request, period_id)
+    if not period:
+        return ORJSONResponse({"success": False, "error": "Период не найден"}, status_code=404)
+    
+    etag_source = f"{period['id']}:{period['name']}:{period['status']}:{period.get('sent_at')}:{period.get('paid_at')}:{period['is_latest']}"
+    etag = f'"{hashlib.md5(etag_source.encode()).hexdigest()}"'
+    cache_headers = {"ETag": etag, "Cache-Control": "private, max-age=5"}
+    
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cache_headers)
+    
+    return ORJSONResponse({
+        "success": True,
+        "period": {
+            "id": period["id"],
+            "name": period["name"],
+            "status": period["status"],
+            "status_label": period["status_label"],
+            "sent_at": period.get("sent_at"),
+            "paid_at": period.get("paid_at"),
+            "is_latest": period["is_latest"],
+        }
+    }, headers=cache_headers)
 
 
 @router.post("/period/{period_id}/send-to-workers")
@@ -81,42 +95,46 @@ async def api_send_to_workers(request: Request, period_id: int):
     Send reports to workers via Bitrix24 chat.
     Changes status to SENT.
     """
-    try:
-        # Check permission
-        user = await check_send_permission(request, period_id)
-        
-        # Get request body
-        body = await request.json()
-        worker_ids = body.get("worker_ids", [])  # List of Bitrix24 user IDs to send to
-        
-        if not worker_ids:
-            return JSONResponse({"success": False, "error": "Не выбраны монтажники"})
-        
-        # Get period details
-        period = await get_period_status(period_id)
-        if not period:
-            return JSONResponse({"success": False, "error": "Период не найден"}, status_code=404)
-        
-        sent_count = 0
-        errors = []
-        
-        for worker_info in worker_ids:
-            worker_name = worker_info.get("name", "")
-            bitrix_user_id = worker_info.get("bitrix_id")
-            
-            try:
-                # Save notification record
-                await save_notification(
-                    period_id=period_id,
-                    worker=worker_name,
-                    bitrix_user_id=bitrix_user_id,
-                    notification_type="chat",
-                    sent_by=user.get("id")
-                )
-                sent_count += 1
-                
-            except Exception as e:
-                errors.append(f"{worker_name}: {str(e)}")
+    # Check permission
+    user = await check_send_permission(request, period_id)
+    
+    # Period was already loaded by the permission check
+    period = await get_period_cached(request, period_id)
+    
+    # Get request body
+    body = await request.json()
+    worker_ids = body.get("worker_ids", [])  # List of Bitrix24 user IDs to send to
+    
+    if not worker_ids:
+        return ORJSONResponse({"success": False, "error": "Не выбраны монтажники"})
+    
+    # Drop duplicate recipients (double-click / replayed request);
+    # workers without Bitrix24 ID are keyed by name
+    requested_count = len(worker_ids)
+    worker_ids = list({
+        (w.get("bitrix_id") or w.get("name", "")): w for w in worker_ids
+    }.values())
+    duplicates_skipped = requested_count - len(worker_ids)
+    
+    if not period:
+        return ORJSONResponse({"success": False, "error": "Период не найден"}, status_code=404)
+    
+    sent_by = user.get("id")
+    rows = [
+        {
+            "period_id": period_id,
+            "worker": worker_info.get("name", ""),
+            "bitrix_user_id": worker_info.get("bitrix_id"),
+            "notification_type": "chat",
+            "sent_by": sent_by,
+        }
+        for worker_info in worker_ids
+    ]
+    
+    # Save all notification records, status change and audit entry atomically.
+    # A failed insert rolls back everything and goes to the app-level error handler
+    async with database.transaction():
+        sent_count = await save_notifications_bulk(rows)
         
         # Update period status to SENT
         if sent_count > 0:
@@ -128,20 +146,17 @@ async def api_send_to_workers(request: Request, period_id: int):
             entity_type="period",
             entity_id=period_id,
             period_id=period_id,
-            details={"sent_count": sent_count, "errors": errors}
+            details={"sent_count": sent_count, "duplicates_skipped": duplicates_skipped}
         )
-        
-        return JSONResponse({
-            "success": True,
-            "sent_count": sent_count,
-            "errors": errors,
-            "new_status": PeriodStatus.SENT
-        })
-        
-    except HTTPException as e:
-        return JSONResponse({"success": False, "error": e.detail}, status_code=e.status_code)
-    except Exception as e:
-        return JSONResponse({"success": False, "error": str(e)})
+    
+    if sent_count > 0:
+        invalidate_period_permissions(period_id)
+    
+    return ORJSONResponse({
+        "success": True,
+        "sent_count": sent_count,
+        "new_status": PeriodStatus.SENT
+    })
 
 
 @router.post("/period/{period_id}/send-to-accountant")
@@ -150,51 +165,48 @@ async def api_send_to_accountant(request: Request, period_id: int):
     Send payment request to accountant via Bitrix24 chat.
     Changes status to PAID - no more editing allowed (except admin unlock).
     """
-    try:
-        # Check permission
-        user = await check_send_to_accountant_permission(request, period_id)
-        
-        # Get request body
-        body = await request.json()
-        accountant_bitrix_id = body.get("accountant_bitrix_id")
-        payment_details = body.get("payment_details", [])
-        # payment_details = [{"worker": "Иванов Иван", "amount": 50000, "bank": "Т-Банк"}, ...]
-        
-        if not accountant_bitrix_id:
-            return JSONResponse({"success": False, "error": "Не указан бухгалтер"})
-        
-        # Get period details
-        period = await get_period_status(period_id)
-        if not period:
-            return JSONResponse({"success": False, "error": "Период не найден"}, status_code=404)
-        
-        # Build message for accountant
-        message_lines = [f"💰 Запрос на оплату зарплаты за период {period['name']}:"]
-        message_lines.append("")
-        
-        total_amount = 0
-        for detail in payment_details:
-            worker = detail.get("worker", "")
-            amount = detail.get("amount", 0)
-            bank = detail.get("bank", "")
-            total_amount += amount
-            message_lines.append(f"• {worker}: {amount:,.0f} ₽ ({bank})")
-        
-        message_lines.append("")
-        message_lines.append(f"Итого к оплате: {total_amount:,.0f} ₽")
-        message_lines.append("")
-        message_lines.append(f"Отправил: {user.get('name', 'Неизвестно')}")
-        
-        message = "\n".join(message_lines)
-        
-        # STUB: Bitrix24 messaging integration not yet implemented
-        # When ready, uncomment and implement:
-        # await send_bitrix_message(access_token, accountant_bitrix_id, message)
-        
-        # Update period status to PAID
+    # Check permission
+    user = await check_send_to_accountant_permission(request, period_id)
+    
+    # Get request body
+    body = await request.json()
+    accountant_bitrix_id = body.get("accountant_bitrix_id")
+    payment_details = body.get("payment_details", [])
+    # payment_details = [{"worker": "Иванов Иван", "amount": 50000, "bank": "Т-Банк"}, ...]
+    
+    if not accountant_bitrix_id:
+        return ORJSONResponse({"success": False, "error": "Не указан бухгалтер"})
+    
+    # Get period details
+    period = await get_period_cached(request, period_id)
+    if not period:
+        return ORJSONResponse({"success": False, "error": "Период не найден"}, status_code=404)
+    
+    # Build message for accountant
+    # Normalize once: (worker, amount, bank) per row
+    payments = [
+        (detail.get("worker", ""), detail.get("amount", 0), detail.get("bank", ""))
+        for detail in payment_details
+    ]
+    total_amount = sum(amount for _, amount, _ in payments)
+    payment_lines = "\n".join(
+        f"• {worker}: {amount:,.0f} ₽ ({bank})" for worker, amount, bank in payments
+    )
+    message = (
+        f"💰 Запрос на оплату зарплаты за период {period['name']}:\n\n"
+        f"{payment_lines}\n\n"
+        f"Итого к оплате: {total_amount:,.0f} ₽\n\n"
+        f"Отправил: {user.get('name', 'Неизвестно')}"
+    )
+    
+    # STUB: Bitrix24 messaging integration not yet implemented
+    # When ready, uncomment and implement:
+    # await send_bitrix_message(access_token, accountant_bitrix_id, message)
+    
+    # Update period status to PAID and log action atomically
+    async with database.transaction():
         await update_period_status(period_id, PeriodStatus.PAID, user)
         
-        # Log action
         await log_user_action(
             request, "send_to_accountant",
             entity_type="period",
@@ -206,17 +218,13 @@ async def api_send_to_accountant(request: Request, period_id: int):
                 "workers_count": len(payment_details)
             }
         )
-        
-        return JSONResponse({
-            "success": True,
-            "message": "Запрос отправлен бухгалтеру",
-            "new_status": PeriodStatus.PAID
-        })
-        
-    except HTTPException as e:
-        return JSONResponse({"success": False, "error": e.detail}, status_code=e.status_code)
-    except Exception as e:
-        return JSONResponse({"success": False, "error": str(e)})
+    invalidate_period_permissions(period_id)
+    
+    return ORJSONResponse({
+        "success": True,
+        "message": "Запрос отправлен бухгалтеру",
+        "new_status": PeriodStatus.PAID
+    })
 
 
 @router.post("/period/{period_id}/unlock")
@@ -225,22 +233,21 @@ async def api_unlock_period(request: Request, period_id: int):
     Unlock a PAID period for editing (admin only).
     Changes status back to SENT.
     """
-    try:
-        # Check permission (admin only)
-        user = await check_unlock_permission(request)
-        
-        # Get period
-        period = await get_period_status(period_id)
-        if not period:
-            return JSONResponse({"success": False, "error": "Период не найден"}, status_code=404)
-        
-        if period["status"] != PeriodStatus.PAID:
-            return JSONResponse({"success": False, "error": "Период не заблокирован"})
-        
-        # Update status back to SENT
+    # Check permission (admin only)
+    user = await check_unlock_permission(request)
+    
+    # Get period
+    period = await get_period_cached(request, period_id)
+    if not period:
+        return ORJSONResponse({"success": False, "error": "Период не найден"}, status_code=404)
+    
+    if period["status"] != PeriodStatus.PAID:
+        return ORJSONResponse({"success": False, "error": "Период не заблокирован"})
+    
+    # Update status back to SENT and log action atomically
+    async with database.transaction():
         await update_period_status(period_id, PeriodStatus.SENT, user)
         
-        # Log action
         await log_user_action(
             request, "unlock_period",
             entity_type="period",
@@ -248,150 +255,167 @@ async def api_unlock_period(request: Request, period_id: int):
             period_id=period_id,
             details={"previous_status": PeriodStatus.PAID}
         )
-        
-        return JSONResponse({
-            "success": True,
-            "message": "Период разблокирован для редактирования",
-            "new_status": PeriodStatus.SENT
-        })
-        
-    except HTTPException as e:
-        return JSONResponse({"success": False, "error": e.detail}, status_code=e.status_code)
-    except Exception as e:
-        return JSONResponse({"success": False, "error": str(e)})
+    invalidate_period_permissions(period_id)
+    
+    return ORJSONResponse({
+        "success": True,
+        "message": "Период разблокирован для редактирования",
+        "new_status": PeriodStatus.SENT
+    })
 
 
 # ============== AUDIT LOG API ==============
 
 @router.get("/period/{period_id}/audit-log")
-async def api_get_period_audit_log(request: Request, period_id: int):
+async def api_get_period_audit_log(period_id: int, user: dict = Depends(require_auth)):
     """Get audit log for a period"""
-    try:
-        user = get_current_user(request)
-        if not user:
-            return JSONResponse({"success": False, "error": "Необходима авторизация"}, status_code=401)
-        
-        logs = await get_audit_log(period_id=period_id, limit=100)
-        
-        # Format for display
-        formatted_logs = []
-        for log in logs:
-            formatted_logs.append({
-                "id": log["id"],
-                "user_name": log["user_name"],
-                "user_role": log["user_role"],
-                "action": log["action"],
-                "action_label": {
-                    "upload_files": "Загрузил файлы",
-                    "edit_calculation": "Изменил расчёт",
-                    "delete_row": "Удалил строку",
-                    "send_to_workers": "Отправил монтажникам",
-                    "send_to_accountant": "Отправил бухгалтеру",
-                    "unlock_period": "Разблокировал период",
-                    "status_change_to_draft": "Статус: Черновик",
-                    "status_change_to_sent": "Статус: Отправлено",
-                    "status_change_to_paid": "Статус: Оплачено",
-                }.get(log["action"], log["action"]),
-                "details": log["details"],
-                "created_at": str(log["created_at"]),
-                "period_status": log["period_status"],
-            })
-        
-        return JSONResponse({"success": True, "logs": formatted_logs})
-        
-    except Exception as e:
-        return JSONResponse({"success": False, "error": str(e)})
+    logs = await get_audit_log(period_id=period_id, limit=100)
+    
+    # Summary columns only (no IP / user id); action_label is resolved in SQL,
+    # datetimes are serialized by orjson
+    return ORJSONResponse({"success": True, "logs": logs})
 
 
 @router.get("/audit-log")
-async def api_get_global_audit_log(request: Request, limit: int = 100):
+async def api_get_global_audit_log(limit: int = 100, user: dict = Depends(require_admin)):
     """Get global audit log (admin only)"""
-    try:
-        user = get_current_user(request)
-        if not user:
-            return JSONResponse({"success": False, "error": "Необходима авторизация"}, status_code=401)
-        
-        if user.get("role") != "admin":
-            return JSONResponse({"success": False, "error": "Только для администратора"}, status_code=403)
-        
-        logs = await get_audit_log(limit=limit)
-        
-        return JSONResponse({"success": True, "logs": logs})
-        
-    except Exception as e:
-        return JSONResponse({"success": False, "error": str(e)})
+    # Stream rows as they come from the cursor - limit can be large
+    return StreamingResponse(
+        _stream_logs_json(iter_audit_log(limit=limit, full=True)),
+        media_type="application/json",
+    )
+
+
+async def _stream_logs_json(rows):
+    """Yield {"success": true, "logs": [...]} as JSON chunks, one row at a time"""
+    yield b'{"success":true,"logs":['
+    first = True
+    async for row in rows:
+        if not first:
+            yield b","
+        yield orjson_dumps(row)
+        first = False
+    yield b"]}"
 
 
 # ============== NOTIFICATIONS HISTORY ==============
 
 @router.get("/period/{period_id}/notifications")
-async def api_get_period_notifications(request: Request, period_id: int):
+async def api_get_period_notifications(period_id: int, user: dict = Depends(require_auth)):
     """Get notification history for a period"""
+    notifications = await get_period_notifications(period_id)
+    
+    return ORJSONResponse({"success": True, "notifications": notifications})
+
+
+# ============== BITRIX24 LISTS CACHE ==============
+# Stale-while-revalidate cache for Bitrix24 directory lists (workers, accountants).
+# - younger than BITRIX_LIST_SOFT_TTL: served as is
+# - between soft and hard TTL: served stale, refreshed in background
+# - older than BITRIX_LIST_HARD_TTL: refetched before responding
+# If Bitrix24 is unreachable, the last good list is returned instead of an error.
+BITRIX_LIST_SOFT_TTL = 300  # seconds
+BITRIX_LIST_HARD_TTL = 3600  # seconds
+
+_bitrix_list_cache = {}  # (kind, domain) -> {"body": list, "generated_at": float}
+_bitrix_list_refresh_tasks = {}  # (kind, domain) -> asyncio.Task
+
+
+async def _fetch_bitrix_workers(user: dict) -> list:
+    """Fetch workers list from Bitrix24"""
+    # STUB: Bitrix24 workers list integration not implemented
+    # Implementation would use: user's access_token to call Bitrix24 REST API
+    # Endpoint: https://{domain}/rest/user.get with department filter
+    
+    # Example of what real data would look like:
+    # return [
+    #     {"bitrix_id": 10, "name": "Ветренко Дмитрий", "position": "Монтажник"},
+    #     {"bitrix_id": 11, "name": "Викулин Андрей", "position": "Монтажник"},
+    # ]
+    return []
+
+
+async def _fetch_bitrix_accountants(user: dict) -> list:
+    """Fetch accountants list from Bitrix24"""
+    # STUB: Bitrix24 accountants list integration not implemented
+    # Implementation would filter by department (e.g., "Бухгалтерия")
+    return []
+
+
+_BITRIX_LIST_FETCHERS = {
+    "workers": _fetch_bitrix_workers,
+    "accountants": _fetch_bitrix_accountants,
+}
+
+
+async def _refresh_bitrix_list(kind: str, user: dict) -> list:
+    """Fetch list from Bitrix24 and store it in cache"""
+    body = await _BITRIX_LIST_FETCHERS[kind](user)
+    _bitrix_list_cache[(kind, BITRIX_DOMAIN)] = {
+        "body": body,
+        "generated_at": time.monotonic(),
+    }
+    return body
+
+
+async def _background_refresh_bitrix_list(kind: str, user: dict):
+    """Refresh cached list without failing the request that triggered it"""
     try:
-        user = get_current_user(request)
-        if not user:
-            return JSONResponse({"success": False, "error": "Необходима авторизация"}, status_code=401)
-        
-        notifications = await get_period_notifications(period_id)
-        
-        return JSONResponse({"success": True, "notifications": notifications})
-        
+        await _refresh_bitrix_list(kind, user)
+    except Exception as e:
+        logger.warning(f"⚠️ Bitrix24 {kind} refresh failed, keeping cached list: {e}")
+    finally:
+        _bitrix_list_refresh_tasks.pop((kind, BITRIX_DOMAIN), None)
+
+
+async def get_bitrix_list(kind: str, user: dict) -> list:
+    """Get Bitrix24 list ("workers" or "accountants") using stale-while-revalidate cache"""
+    key = (kind, BITRIX_DOMAIN)
+    entry = _bitrix_list_cache.get(key)
+    
+    if entry:
+        age = time.monotonic() - entry["generated_at"]
+        if age < BITRIX_LIST_SOFT_TTL:
+            return entry["body"]
+        if age < BITRIX_LIST_HARD_TTL:
+            if key not in _bitrix_list_refresh_tasks:
+                _bitrix_list_refresh_tasks[key] = asyncio.create_task(
+                    _background_refresh_bitrix_list(kind, user)
+                )
+            return entry["body"]
+    
+    try:
+        return await _refresh_bitrix_list(kind, user)
     except Exception as e:
-        return JSONResponse({"success": False, "error": str(e)})
+        if entry:
+            logger.warning(f"⚠️ Bitrix24 {kind} unavailable, serving last known list: {e}")
+            return entry["body"]
+        raise
 
 
 # ============== BITRIX24 WORKERS LIST ==============
 
 @router.get("/bitrix/workers")
-async def api_get_bitrix_workers(request: Request):
+async def api_get_bitrix_workers(user: dict = Depends(require_auth)):
     """
     Get list of workers from Bitrix24.
     
     NOTE: This is a stub endpoint. Bitrix24 API integration is not yet implemented.
     Returns empty list until integration is complete.
     """
-    try:
-        user = get_current_user(request)
-        if not user:
-            return JSONResponse({"success": False, "error": "Необходима авторизация"}, status_code=401)
-        
-        # STUB: Bitrix24 workers list integration not implemented
-        # Implementation would use: user's access_token to call Bitrix24 REST API
-        # Endpoint: https://{domain}/rest/user.get with department filter
-        
-        workers = []
-        
-        # Example of what real data would look like:
-        # workers = [
-        #     {"bitrix_id": 10, "name": "Ветренко Дмитрий", "position": "Монтажник"},
-        #     {"bitrix_id": 11, "name": "Викулин Андрей", "position": "Монтажник"},
-        # ]
-        
-        return JSONResponse({"success": True, "workers": workers})
-        
-    except Exception as e:
-        return JSONResponse({"success": False, "error": str(e)})
+    workers = await get_bitrix_list("workers", user)
+    
+    return ORJSONResponse({"success": True, "workers": workers})
 
 
 @router.get("/bitrix/accountants")
-async def api_get_bitrix_accountants(request: Request):
+async def api_get_bitrix_accountants(user: dict = Depends(require_auth)):
     """
     Get list of accountants from Bitrix24.
     
     NOTE: This is a stub endpoint. Bitrix24 API integration is not yet implemented.
     Returns empty list until integration is complete.
     """
-    try:
-        user = get_current_user(request)
-        if not user:
-            return JSONResponse({"success": False, "error": "Необходима авторизация"}, status_code=401)
-        
-        # STUB: Bitrix24 accountants list integration not implemented
-        # Implementation would filter by department (e.g., "Бухгалтерия")
-        
-        accountants = []
-        
-        return JSONResponse({"success": True, "accountants": accountants})
-        
-    except Exception as e:
-        return JSONResponse({"success": False, "error": str(e)})
+    accountants = await get_bitrix_list("accountants", user)
+    
+    return ORJSONResponse({"success": True, "accountants": accountants})
@@ -8,39 +8,71 @@ Refactored structure:
 - services/: Business logic (geocoding, calculation, excel_parser, excel_report)
 """
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Response
-from fastapi.responses import FileResponse, JSONResponse, RedirectResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Response, Depends, BackgroundTasks
+from fastapi.responses import FileResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.requests import Request
+from starlette.exceptions import HTTPException as StarletteHTTPException
 from contextlib import asynccontextmanager
+from anyio import to_thread
+import asyncio
 from urllib.parse import quote
 import pandas as pd
+import numpy as np
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill
 import httpx
 import json
 import os
 import re
+import secrets
 import zipfile
 from io import BytesIO
 from datetime import datetime
 from typing import Optional, Dict, List, Any
+from collections import Counter
+from functools import lru_cache
+from itertools import islice
 import pathlib
 
 # ============================================================================
 # CONFIGURATION (from config.py)
 # ============================================================================
-from config import DEFAULT_CONFIG, session_data, logger, DEBUG_MODE
+from config import DEFAULT_CONFIG, logger, DEBUG_MODE, EXCEL_ENGINE
+from upload_sessions import (
+    get_upload_session, save_upload_session, update_upload_session,
+    delete_upload_session, count_upload_sessions, close_upload_sessions,
+    get_session_records,
+)
+from json_response import ORJSONResponse
+
+# ============================================================================
+# REGEX PATTERNS (compiled once, used in per-row loops)
+# ============================================================================
+# Order code in 1C order text: "КАУТ-001143", "ИБУТ-000123", ...
+ORDER_CODE_RE = re.compile(r'((?:КАУТ|ИБУТ|ТДУТ|00УТ)-\d+)')
+# Period in report header: "16.11.2025 - 30.11.2025"
+PERIOD_RE = re.compile(r'(\d{2})\.(\d{2})\.(\d{4})\s*-\s*(\d{2})\.(\d{2})\.(\d{4})')
+# Order date in order text: "КАУТ-001904, 21.12.2025, ..."
+ORDER_DATE_RE = re.compile(r'(\d{2})\.(\d{2})\.(\d{4})')
+# Report header keywords for detect_file_type, found in one scan per cell
+DETECT_KEYWORDS_RE = re.compile(
+    r'(?P<revenue>выручка от услуг)|(?P<lte>меньше или равно)|(?P<gte>больше или равно)|(?P<period>период:)',
+    re.IGNORECASE
+)
 
 # ============================================================================
 # DATABASE IMPORTS
 # ============================================================================
 from database import (
     database, create_tables, connect_db, disconnect_db,
-    get_or_create_period, create_upload, save_order, save_calculation,
-    save_worker_total, save_change, get_previous_upload, compare_uploads,
-    get_orders_by_upload, get_all_periods, get_period_details,
+    get_or_create_period, create_upload, bulk_save_orders,
+    upload_transaction,
+    bulk_save_worker_totals, bulk_save_changes,
+    bulk_save_manual_edits, get_previous_upload, compare_uploads,
+    get_orders_by_upload, get_latest_upload_with_orders, get_all_periods, get_period_details,
+    get_latest_upload_totals, get_latest_worker_totals,
     get_upload_details, get_worker_orders, get_months_summary,
     create_or_update_user, log_action,
     add_duplicate_exclusion, remove_duplicate_exclusion, 
@@ -59,6 +91,8 @@ from auth import (
 # ============================================================================
 # PERMISSIONS IMPORTS
 # ============================================================================
+from permissions import invalidate_period_permissions
+
 # Note: Permission checks are done inline in endpoints via request.session
 # These imports are available for future use if needed:
 # from permissions import (
@@ -75,7 +109,9 @@ from utils import (
     # From utils/helpers.py
     format_order_short,
     format_order_for_workers,
+    format_amount,
     parse_percent,
+    parse_number_series,
     extract_address_from_order,
     clean_address_for_geocoding,
     extract_period,
@@ -83,6 +119,7 @@ from utils import (
     EXCLUDED_GROUPS,
     build_worker_name_map,
     normalize_worker_name,
+    base_worker_name,
     is_valid_worker_name,
 )
 
@@ -96,16 +133,19 @@ from services import (
     geocode_address_nominatim,
     get_distance_osrm,
     is_moscow_region,
-    calculate_fuel_cost,
+    calculate_fuel_costs,
     # From services/calculation.py
-    calculate_row,
+    calculate_rows,
     generate_alarms,
     # From services/excel_parser.py
+    excel_source,
     parse_excel_file,
     parse_both_excel_files,
     # From services/excel_report.py
     create_excel_report,
     create_worker_report,
+    create_report_pair,
+    create_worker_report_pair,
 )
 
 
@@ -113,22 +153,51 @@ from services import (
 # APPLICATION SETUP
 # ============================================================================
 
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "200"))
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan - startup and shutdown"""
     # Startup
+    # Threadpool used by Starlette for UploadFile/FileResponse/StaticFiles I/O
+    # (default is 40 threads, which queues requests under concurrent uploads/downloads)
+    to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
     create_tables()
     await connect_db()
     yield
     # Shutdown
     await disconnect_db()
+    await close_upload_sessions()
 
 app = FastAPI(
     title="Salary Calculator", 
     description="Расчёт зарплаты монтажников",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
+# ============================================================================
+# EXCEPTION HANDLERS
+# ============================================================================
+# Endpoints don't need their own try/except just to build an error envelope:
+# the handlers below return {"success": False, "error": ...} for every error.
+# "detail" is kept for pages that read FastAPI's default error format.
+
+@app.exception_handler(StarletteHTTPException)
+async def http_exception_handler(request: Request, exc: StarletteHTTPException):
+    return ORJSONResponse(
+        {"success": False, "error": exc.detail, "detail": exc.detail},
+        status_code=exc.status_code,
+        headers=getattr(exc, "headers", None),
+    )
+
+
+@app.exception_handler(Exception)
+async def unhandled_exception_handler(request: Request, exc: Exception):
+    logger.exception(f"❌ Unhandled error on {request.method} {request.url.path}: {exc}")
+    return ORJSONResponse({"success": False, "error": str(exc)}, status_code=500)
+
+
 # ============================================================================
 # API ROUTERS
 # ============================================================================
@@ -163,7 +232,7 @@ app.mount("/static", StaticFiles(directory="../frontend/static"), name="static")
 # The following functions are now imported from services/ and utils/:
 #
 # From utils/workers.py:
-#   - build_worker_name_map, normalize_worker_name, is_valid_worker_name, EXCLUDED_GROUPS
+#   - build_worker_name_map, normalize_worker_name, base_worker_name, is_valid_worker_name, EXCLUDED_GROUPS
 #
 # From utils/helpers.py:
 #   - format_order_short, format_order_for_workers, parse_percent
@@ -171,16 +240,16 @@ app.mount("/static", StaticFiles(directory="../frontend/static"), name="static")
 #
 # From services/geocoding.py:
 #   - geocode_address, geocode_address_yandex, geocode_address_nominatim
-#   - get_distance_osrm, is_moscow_region, calculate_fuel_cost
+#   - get_distance_osrm, is_moscow_region, calculate_fuel_costs
 #
 # From services/calculation.py:
-#   - calculate_row, generate_alarms
+#   - calculate_rows, generate_alarms
 #
 # From services/excel_parser.py:
 #   - parse_excel_file, parse_both_excel_files
 #
 # From services/excel_report.py:
-#   - create_excel_report, create_worker_report
+#   - create_excel_report, create_worker_report, create_report_pair, create_worker_report_pair
 # ============================================================================
 
 
@@ -332,22 +401,20 @@ async def auth_logout(request: Request):
 
 
 @app.get("/api/me")
-async def get_me(request: Request):
+async def get_me(user: Optional[dict] = Depends(get_current_user)):
     """Get current user info"""
-    user = get_current_user(request)
     if not user:
-        return JSONResponse({"authenticated": False})
+        return ORJSONResponse({"authenticated": False})
 
-    return JSONResponse({
+    return ORJSONResponse({
         "authenticated": True,
         "user": user
     })
 
 
 @app.get("/login")
-async def login_page(request: Request):
+async def login_page(request: Request, user: Optional[dict] = Depends(get_current_user)):
     """Show login page"""
-    user = get_current_user(request)
     if user:
         return RedirectResponse(url="/", status_code=302)
 
@@ -381,23 +448,21 @@ async def health_check():
     
     # Check session storage
     try:
-        status["checks"]["sessions"] = f"ok ({len(session_data)} active)"
+        status["checks"]["sessions"] = f"ok ({await count_upload_sessions()} active)"
     except Exception:
         status["checks"]["sessions"] = "error"
     
     # Return 503 if degraded
     if status["status"] != "ok":
-        return JSONResponse(status, status_code=503)
+        return ORJSONResponse(status, status_code=503)
     
-    return JSONResponse(status)
+    return ORJSONResponse(status)
 
 
 # ============== MAIN ROUTES ==============
 
 @app.get("/")
-async def index(request: Request):
-    user = get_current_user(request)
-
+async def index(request: Request, user: Optional[dict] = Depends(get_current_user)):
     # If auth is configured and user is not logged in, redirect to login
     if is_auth_configured() and not user:
         return RedirectResponse(url="/login", status_code=302)
@@ -420,39 +485,44 @@ async def detect_file_type(file: UploadFile = File(...)):
     Also extracts period name from "Период:" row.
     """
     try:
-        content = await file.read()
-        
-        # Parse Excel file
-        df = pd.read_excel(BytesIO(content), header=None)
+        # Parse only the header area - filter and period text are in the first
+        # 20 rows of column A (column B covers exports where A is merged/empty)
+        # Read straight from the spooled upload file, no extra bytes copy
+        df = pd.read_excel(excel_source(file.file), header=None, engine=EXCEL_ENGINE, nrows=20, usecols=[0, 1])
         
         file_type = "unknown"
         period_name = None
         
-        # Search through first 20 rows for filter info and period
-        for idx in range(min(20, len(df))):
-            for col_idx in range(min(10, len(df.columns))):
-                cell = df.iloc[idx, col_idx]
-                if pd.isna(cell):
-                    continue
-                cell_str = str(cell).strip()
-                
-                # Look for filter condition (Отбор row)
-                # The filter text contains "Выручка от услуг Меньше или равно" or "Больше или равно"
-                if "выручка от услуг" in cell_str.lower():
-                    if "меньше или равно" in cell_str.lower():
-                        file_type = "under"
-                    elif "больше или равно" in cell_str.lower():
-                        file_type = "over"
-                
-                # Look for period info
-                if "период:" in cell_str.lower():
-                    # Extract period like "16.11.2025 - 30.11.2025" and normalize to "16-30.11.25"
-                    match = re.search(r'(\d{2})\.(\d{2})\.(\d{4})\s*-\s*(\d{2})\.(\d{2})\.(\d{4})', cell_str)
-                    if match:
-                        d1, m1, y1, d2, m2, y2 = match.groups()
-                        period_name = f"{d1}-{d2}.{m1}.{y2[2:]}"
-        
-        return JSONResponse({
+        # Search header cells (row by row) for filter info and period
+        for cell in df.to_numpy().ravel():
+            if pd.isna(cell):
+                continue
+            cell_str = str(cell).strip()
+            found = {m.lastgroup for m in DETECT_KEYWORDS_RE.finditer(cell_str)}
+            if not found:
+                continue
+            
+            # Look for filter condition (Отбор row)
+            # The filter text contains "Выручка от услуг Меньше или равно" or "Больше или равно"
+            if "revenue" in found:
+                if "lte" in found:
+                    file_type = "under"
+                elif "gte" in found:
+                    file_type = "over"
+            
+            # Look for period info
+            if "period" in found:
+                # Extract period like "16.11.2025 - 30.11.2025" and normalize to "16-30.11.25"
+                match = PERIOD_RE.search(cell_str)
+                if match:
+                    d1, m1, y1, d2, m2, y2 = match.groups()
+                    period_name = f"{d1}-{d2}.{m1}.{y2[2:]}"
+            
+            # Both found - no need to scan the rest
+            if file_type != "unknown" and period_name is not None:
+                break
+
+        return ORJSONResponse({
             "success": True, 
             "type": file_type,
             "period": period_name,
@@ -460,13 +530,231 @@ async def detect_file_type(file: UploadFile = File(...)):
         })
         
     except Exception as e:
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "type": "unknown",
             "error": str(e)
         })
 
 
+def _parse_upload_files(content_under, content_over) -> tuple:
+    """Parse both 1C files (binary file objects) and the period header (blocking, run in threadpool).
+    Returns (combined, name_map, manager_comments, parse_warnings, period)
+    """
+    # Parse both files with automatic name normalization
+    combined, name_map, manager_comments, parse_warnings = parse_both_excel_files(content_under, content_over)
+    
+    # Period is in the report header (first 5 rows)
+    period_df = pd.read_excel(excel_source(content_under), header=None, engine=EXCEL_ENGINE, nrows=5)
+    period = extract_period(period_df)
+    
+    _add_order_fields(combined)
+    
+    return combined, name_map, manager_comments, parse_warnings, period
+
+
+def _add_order_fields(combined: pd.DataFrame):
+    """Add order_code and address (as saved to DB) columns to parsed rows, column-wise,
+    so preview/apply-review/first-upload don't re-extract them per row on save
+    """
+    if combined.empty:
+        return
+    order_texts = combined["order"].astype(str)
+    combined["order_code"] = order_texts.str.extract(ORDER_CODE_RE, expand=False).fillna("")
+    # Address: first line of the text after the first ", " (max 100 chars)
+    after_comma = order_texts.str.split(", ", n=1).str[1]
+    combined["address"] = after_comma.str.split("\n", n=1).str[0].str.slice(0, 100).fillna("")
+
+
+def _build_upload_orders(combined: pd.DataFrame) -> tuple:
+    """Build workers list and orders list from parsed rows
+    (blocking, run in threadpool). Returns (workers, orders)
+    """
+    # Transport check (revenue > 10k and percent between 20% and 40%), whole columns at once
+    revenue_services_num = pd.to_numeric(combined["revenue_services"], errors="coerce").fillna(0)
+    percent_num = parse_number_series(combined["percent"])
+    has_transport = (
+        (revenue_services_num > DEFAULT_CONFIG["transport_min_revenue"])
+        & percent_num.between(DEFAULT_CONFIG["transport_percent_min"], DEFAULT_CONFIG["transport_percent_max"])
+    )
+    
+    # Order rows: non-empty and not service rows (training, previous calculation)
+    is_order = (
+        combined["order"].astype(bool)
+        & ~combined["order"].astype(str).str.startswith(("ОБУЧЕНИЕ", "В прошлом"))
+    )
+    
+    # Single pass over rows: workers come from all rows, orders skip service rows
+    workers = set()
+    orders = []
+    for worker, order, is_client, transport, keep in zip(
+        combined["worker"].tolist(),
+        combined["order"].tolist(),
+        combined["is_client_payment"].tolist(),
+        has_transport.tolist(),
+        is_order.tolist(),
+    ):
+        if not isinstance(worker, str) or not worker:
+            continue
+        worker = worker.replace(" (оплата клиентом)", "")
+        workers.add(worker)
+        
+        if keep:
+            orders.append({
+                "worker": worker,
+                "order": order,
+                "order_short": format_order_short(order),
+                "is_client_payment": is_client,
+                "has_transport": transport
+            })
+    
+    workers = sorted(workers)
+    orders.sort(key=lambda x: x["worker"])
+    
+    return workers, orders
+
+
+def _worker_key_normalizer(name_map: dict):
+    """Memoized "normalized worker without client payment suffix" for one name_map.
+    Used for matching/sorting keys: a period has few workers but many rows.
+    """
+    @lru_cache(maxsize=None)
+    def normalize(worker: str) -> str:
+        return normalize_worker_name(worker, name_map).replace(" (оплата клиентом)", "")
+    return normalize
+
+
+def _sort_rows_by_worker(rows: List[dict], name_map: dict):
+    """Sort calculated rows in place by normalized worker (same order as preview).
+    list.sort computes each key once per row; the normalizer memoizes per worker.
+    """
+    normalize_worker = _worker_key_normalizer(name_map)
+    rows.sort(key=lambda x: normalize_worker(x.get("worker", "")))
+
+
+# Numeric fields of DB orders used in upload comparison
+# (DB values may be strings like '30,00 %' or None)
+OLD_ORDER_NUMERIC_FIELDS = [
+    "revenue_total", "revenue_services", "diagnostic", "specialist_fee",
+    "additional_expenses", "service_payment", "percent",
+    "total", "fuel_payment", "transport",
+]
+
+# Order fields copied from the previous version in review:
+# restoring a deleted order / reverting a modified one to old values
+REVIEW_RESTORE_FIELDS = (
+    "revenue_total", "revenue_services", "diagnostic", "diagnostic_payment",
+    "specialist_fee", "additional_expenses", "service_payment", "percent",
+)
+REVIEW_REVERT_FIELDS = (
+    "revenue_total", "revenue_services", "diagnostic", "specialist_fee",
+    "additional_expenses", "service_payment", "percent",
+)
+
+
+def _build_old_orders_map(old_orders: List[dict], name_map: dict) -> dict:
+    """Map (order_code, worker) -> order of the previous upload for comparison.
+    Extra rows are skipped. Worker names from DB are normalized with the current
+    name_map (once per distinct name) so keys match the new data.
+    Numeric fields are parsed to floats column-wise (invalid/empty -> 0.0).
+    """
+    if not old_orders:
+        return {}
+    
+    old_df = pd.DataFrame(old_orders)
+    keep = ~old_df["is_extra_row"].fillna(False).astype(bool)
+    old_df = old_df[keep]
+    workers = old_df["worker"].fillna("").astype(str)
+    order_codes = old_df["order_code"].fillna("")
+    
+    normalized = {
+        w: normalize_worker_name(w, name_map).replace(" (оплата клиентом)", "")
+        for w in workers.unique()
+    }
+    keys = zip(order_codes.tolist(), workers.map(normalized).tolist())
+    
+    numeric = {
+        field: parse_number_series(old_df[field]).tolist()
+        for field in OLD_ORDER_NUMERIC_FIELDS if field in old_df.columns
+    }
+    kept_orders = [o for o, k in zip(old_orders, keep.tolist()) if k]
+    values = [
+        {**o, **{field: column[i] for field, column in numeric.items()}}
+        for i, o in enumerate(kept_orders)
+    ]
+    return dict(zip(keys, values))
+
+
+def _review_record_key(record: dict, normalize_worker) -> str:
+    """Review selection key of a parsed row: <order_code>_<normalized worker>
+    (normalize_worker from _worker_key_normalizer)
+    """
+    order_code_match = ORDER_CODE_RE.search(str(record.get("order", "")))
+    order_code = order_code_match.group(0) if order_code_match else ""
+    return order_code + "_" + normalize_worker(str(record.get("worker", "")))
+
+
+def _build_new_orders_map(combined: pd.DataFrame, name_map: dict) -> dict:
+    """Map (order_code, worker) -> order fields of new upload for comparison
+    with the previous upload (blocking, run in threadpool)
+    """
+    # Prepare new file rows column-wise:
+    # skip worker total rows and rows without order code (totals or headers)
+    new_rows = combined[~combined["is_worker_total"].fillna(False).astype(bool)]
+    order_texts = new_rows["order"].astype(str)
+    order_codes = new_rows["order_code"]  # from _add_order_fields
+    has_order_code = order_codes != ""
+    new_rows = new_rows[has_order_code]
+    
+    # IMPORTANT: Use name_map for consistent normalization with old_map
+    # (each distinct worker name is normalized once)
+    raw_workers = new_rows["worker"].astype(str)
+    normalized = {
+        w: normalize_worker_name(w, name_map).replace(" (оплата клиентом)", "")
+        for w in raw_workers.unique()
+    }
+    
+    new_map = {}
+    for (order_code, order_text, worker, revenue_total, revenue_services, diagnostic,
+         specialist_fee, additional_expenses, service_payment, percent_raw) in zip(
+        order_codes[has_order_code].tolist(),
+        order_texts[has_order_code].tolist(),
+        raw_workers.map(normalized).tolist(),
+        parse_number_series(new_rows["revenue_total"]).tolist(),
+        parse_number_series(new_rows["revenue_services"]).tolist(),
+        parse_number_series(new_rows["diagnostic"]).tolist(),
+        parse_number_series(new_rows["specialist_fee"]).tolist(),
+        parse_number_series(new_rows["additional_expenses"]).tolist(),
+        parse_number_series(new_rows["service_payment"]).tolist(),
+        new_rows["percent"].tolist(),
+    ):
+        # Extract address from order text using proper function
+        address = extract_address_from_order(order_text)
+        if not address and ", " in order_text:
+            # Fallback: simple extraction
+            parts = order_text.split(", ", 1)
+            if len(parts) > 1:
+                address = parts[1].split("\n")[0][:80]
+        
+        key = (order_code, worker)
+        
+        new_map[key] = {
+            "order_code": order_code,
+            "order_full": order_text,
+            "address": address,
+            "worker": worker,
+            "revenue_total": revenue_total,
+            "revenue_services": revenue_services,
+            "diagnostic": diagnostic,
+            "specialist_fee": specialist_fee,
+            "additional_expenses": additional_expenses,
+            "service_payment": service_payment,
+            "percent": parse_percent(percent_raw),
+        }
+    
+    return new_map
+
+
 @app.post("/upload")
 async def upload_files(
     request: Request,
@@ -483,14 +771,11 @@ async def upload_files(
         if user and user.get("role") == "financier":
             raise HTTPException(status_code=403, detail="Финансист имеет доступ только для просмотра")
         
-        content_under = await file_under_10k.read()
-        content_over = await file_over_10k.read()
-        
-        # Parse both files with automatic name normalization
-        combined, name_map, manager_comments, parse_warnings = parse_both_excel_files(content_under, content_over)
-        
-        period_df = pd.read_excel(BytesIO(content_under), header=None)
-        period = extract_period(period_df)
+        # Excel parsing is CPU-bound - keep it off the event loop.
+        # Files are parsed straight from the spooled upload files (no full bytes copy in memory)
+        combined, name_map, manager_comments, parse_warnings, period = await to_thread.run_sync(
+            _parse_upload_files, file_under_10k.file, file_over_10k.file
+        )
         
         # Parse Yandex Fuel file if provided (required for second half periods)
         yandex_fuel_data = {}
@@ -503,63 +788,30 @@ async def upload_files(
             if content_yandex:
                 if is_second_half:
                     # Validate that Yandex file period matches upload period
-                    is_valid, error_msg = validate_yandex_fuel_period(content_yandex, period)
+                    is_valid, error_msg = await to_thread.run_sync(validate_yandex_fuel_period, content_yandex, period)
                     if not is_valid:
-                        return JSONResponse(
+                        return ORJSONResponse(
                             {"success": False, "detail": f"❌ Несоответствие периодов: {error_msg}"},
                             status_code=400
                         )
                     
-                    yandex_fuel_data = parse_yandex_fuel_file(content_yandex, name_map)
+                    yandex_fuel_data = await to_thread.run_sync(parse_yandex_fuel_file, content_yandex, name_map)
                     if DEBUG_MODE: logger.debug(f"⛽ Яндекс Заправки загружены: {len(yandex_fuel_data)} монтажников")
                 else:
                     logger.warning(f"⚠️ Яндекс Заправки: период {period} - первая половина месяца, файл игнорируется")
         elif is_second_half:
             # Yandex Fuel file is required for second half periods
-            return JSONResponse(
+            return ORJSONResponse(
                 {"success": False, "detail": "Для второй половины месяца необходимо загрузить файл Яндекс Заправок"},
                 status_code=400
             )
         
-        workers = list(set([w.replace(" (оплата клиентом)", "") 
-                           for w in combined["worker"].unique() if w and not pd.isna(w)]))
-        workers = sorted(workers)
+        workers, orders = await to_thread.run_sync(_build_upload_orders, combined)
         
-        orders = []
-        for _, row in combined.iterrows():
-            order = row.get("order", "")
-            worker = row.get("worker", "")
-            is_client = row.get("is_client_payment", False)
-            
-            # Get revenue_services and percent for transport check
-            revenue_services = row.get("revenue_services", 0)
-            revenue_services = float(revenue_services) if pd.notna(revenue_services) and revenue_services != "" else 0
-            
-            percent_str = str(row.get("percent", "0%")).replace("%", "").replace(",", ".").strip()
-            try:
-                percent = float(percent_str) if percent_str else 0
-            except (ValueError, TypeError):
-                percent = 0
-            
-            # Check if transport will be applied (revenue > 10k and percent between 20% and 40%)
-            percent_min = DEFAULT_CONFIG["transport_percent_min"]
-            percent_max = DEFAULT_CONFIG["transport_percent_max"]
-            has_transport = revenue_services > DEFAULT_CONFIG["transport_min_revenue"] and percent_min <= percent <= percent_max
-            
-            if order and not str(order).startswith(("ОБУЧЕНИЕ", "В прошлом")):
-                orders.append({
-                    "worker": worker.replace(" (оплата клиентом)", ""),
-                    "order": order,
-                    "order_short": format_order_short(order),
-                    "is_client_payment": is_client,
-                    "has_transport": has_transport
-                })
-        
-        orders.sort(key=lambda x: x["worker"])
-        
-        session_id = datetime.now().strftime("%Y%m%d%H%M%S")
-        session_data[session_id] = {
-            "combined": combined.to_dict("records"),
+        # Random id: wall-clock ids collide for uploads within the same second
+        session_id = secrets.token_urlsafe(12)
+        upload_session = {
+            "combined": combined,  # DataFrame, read via get_session_records()
             "period": period,
             "workers": workers,
             "name_map": name_map,  # Save for later use
@@ -578,441 +830,374 @@ async def upload_files(
         
         try:
             if database and database.is_connected:
-                from database import get_or_create_period, get_period_details, get_orders_by_upload
-                
                 # Check if this period exists
                 period_id = await get_or_create_period(period)
-                period_details = await get_period_details(period_id)
+                # A new period becomes the latest one
+                invalidate_period_permissions()
+                # Find latest upload with actual orders (skip empty uploads)
+                latest_upload, old_orders = await get_latest_upload_with_orders(period_id)
+                latest_upload_id = latest_upload["id"] if latest_upload else None
+                latest_upload_version = latest_upload["version"] if latest_upload else None
+                latest_upload_date = str(latest_upload.get("created_at", "")) if latest_upload else None
                 
-                if period_details and period_details.get("uploads"):
-                    uploads = period_details["uploads"]
-                    if len(uploads) > 0:
-                        # Find latest upload with actual orders (skip empty uploads)
-                        latest_upload_id = None
-                        latest_upload_version = None
-                        latest_upload_date = None
-                        old_orders = []
-                        
-                        for upload in uploads:
-                            upload_id_check = upload["id"]
-                            orders_check = await get_orders_by_upload(upload_id_check)
-                            if orders_check and len(orders_check) > 0:
-                                latest_upload_id = upload_id_check
-                                latest_upload_version = upload["version"]
-                                latest_upload_date = str(upload.get("created_at", ""))
-                                old_orders = orders_check
-                                if DEBUG_MODE: logger.debug(f"📊 Found version {latest_upload_version} with {len(old_orders)} orders")
-                                break
-                            else:
-                                logger.warning(f"⚠️ Skipping empty version {upload['version']}")
+                if latest_upload_id:
+                    if DEBUG_MODE: logger.debug(f"📊 Found version {latest_upload_version} with {len(old_orders)} orders")
+                else:
+                    if DEBUG_MODE: logger.debug(f"📊 No previous version with orders found")
+                
+                # Also get extra rows (manual additions) from previous upload
+                from database import get_upload_details
+                prev_upload_details = await get_upload_details(latest_upload_id) if latest_upload_id else None
+                extra_rows_from_prev = []
+                manual_edits_from_prev = []
+                
+                if prev_upload_details:
+                    # Get extra rows (is_extra_row=True)
+                    extra_rows_from_prev = [o for o in old_orders if o.get("is_extra_row", False)]
+                    
+                    if DEBUG_MODE:
+                        for o in extra_rows_from_prev:
+                            logger.debug(f"📋 Found extra_row: {o.get('order_code', '')} - {o.get('worker', '')}")
+                        logger.debug(f"📋 Total extra_rows found: {len(extra_rows_from_prev)} out of {len(old_orders)} orders")
                         
-                        if not latest_upload_id:
-                            if DEBUG_MODE: logger.debug(f"📊 No previous version with orders found")
+                        # Debug: show is_extra_row values
+                        extra_counts = Counter(str(o.get("is_extra_row")) for o in old_orders)
+                        logger.debug(f"📋 is_extra_row distribution: {dict(extra_counts)}")
+                    
+                    # Get manual edits
+                    manual_edits_from_prev = prev_upload_details.get("manual_edits", [])
+                
+                if old_orders:
+                    changes_summary["has_previous"] = True
+                    changes_summary["previous_version"] = latest_upload_version
+                    changes_summary["previous_date"] = latest_upload_date
+                    changes_summary["previous_upload_id"] = latest_upload_id
+                    
+                    # Build maps for comparison
+                    old_map = _build_old_orders_map(old_orders, name_map)
+                    
+                    if DEBUG_MODE: logger.debug(f"📊 Comparison: {len(old_map)} orders in DB")
+                    
+                    new_map = await to_thread.run_sync(_build_new_orders_map, combined, name_map)
+                    
+                    if DEBUG_MODE: logger.debug(f"📊 Comparison: {len(new_map)} orders in new files")
+                    
+                    # Classify keys once with set operations on the key views
+                    added_keys = new_map.keys() - old_map.keys()
+                    deleted_keys = old_map.keys() - new_map.keys()
+                    
+                    # Calculate fuel and transport for new orders BEFORE comparison
+                    # This ensures we compare apples to apples
+                    config = DEFAULT_CONFIG.copy()
+                    company_car_workers = config.get("company_car_workers", [])
+                    company_car_normalized = {normalize_worker_name(w) for w in company_car_workers}
+                    # Company car check once per distinct worker
+                    on_company_car = {
+                        w: normalize_worker_name(w) in company_car_normalized
+                        for w in {o["worker"] for o in new_map.values()}
+                    }
+                    
+                    # Fuel: one concurrent lookup per unique address (addresses repeat across orders)
+                    fuel_by_address = await calculate_fuel_costs(
+                        (o["address"] for o in new_map.values() if o["specialist_fee"] == 0 and o["address"]),
+                        config, 1
+                    )
+                    
+                    for key, order in new_map.items():
+                        # Calculate fuel
+                        fuel_payment = 0
+                        if order["specialist_fee"] == 0 and order["address"]:
+                            fuel_payment = fuel_by_address.get(order["address"], 0)
+                        order["fuel_payment"] = fuel_payment
                         
-                        # Also get extra rows (manual additions) from previous upload
-                        from database import get_upload_details
-                        prev_upload_details = await get_upload_details(latest_upload_id) if latest_upload_id else None
-                        extra_rows_from_prev = []
-                        manual_edits_from_prev = []
+                        # Calculate transport
+                        transport = 0
+                        is_on_company_car = on_company_car[order["worker"]]
+                        percent_min = config.get("transport_percent_min", 20)
+                        percent_max = config.get("transport_percent_max", 40)
+                        if order["revenue_services"] > config["transport_min_revenue"] and percent_min <= order["percent"] <= percent_max:
+                            if not is_on_company_car:
+                                transport = config["transport_amount"]
+                        order["transport"] = transport
                         
-                        if prev_upload_details:
-                            # Get extra rows (is_extra_row=True)
-                            for o in old_orders:
-                                is_extra = o.get("is_extra_row", False)
-                                if is_extra:
-                                    extra_rows_from_prev.append(o)
-                                    if DEBUG_MODE: logger.debug(f"📋 Found extra_row: {o.get('order_code', '')} - {o.get('worker', '')}")
-                            
-                            if DEBUG_MODE: logger.debug(f"📋 Total extra_rows found: {len(extra_rows_from_prev)} out of {len(old_orders)} orders")
+                        # Calculate total
+                        order["total"] = order["service_payment"] + fuel_payment + transport
+                    
+                    if DEBUG_MODE: logger.debug(f"📊 Calculated fuel/transport for {len(new_map)} new orders")
+                    
+                    # Find added - include all details
+                    for key, order in new_map.items():
+                        if key[0] and key in added_keys:  # Has order_code and not in old
+                            # Build details dict with non-zero values
+                            details = {}
+                            if order["revenue_total"] > 0:
+                                details["Выручка итого"] = format_amount(order['revenue_total'])
+                            if order["revenue_services"] != 0:
+                                details["Выручка от услуг"] = format_amount(order['revenue_services'])
+                            if order["diagnostic"] > 0:
+                                details["Диагностика"] = format_amount(order['diagnostic'])
+                            if order["specialist_fee"] > 0:
+                                details["Выезд специалиста"] = format_amount(order['specialist_fee'])
+                            if order["additional_expenses"] != 0:
+                                details["Доп. расходы"] = format_amount(order['additional_expenses'])
+                            if order["service_payment"] != 0:
+                                details["Оплата услуг"] = format_amount(order['service_payment'])
+                            if order["percent"] > 0:
+                                details["Процент"] = f"{order['percent']:.0f}%"
                             
-                            # Debug: show is_extra_row values
-                            extra_counts = {"True": 0, "False": 0, "None": 0}
-                            for o in old_orders:
-                                val = o.get("is_extra_row")
-                                if val is True:
-                                    extra_counts["True"] += 1
-                                elif val is False:
-                                    extra_counts["False"] += 1
-                                else:
-                                    extra_counts["None"] += 1
-                            if DEBUG_MODE: logger.debug(f"📋 is_extra_row distribution: {extra_counts}")
+                            changes_summary["added"].append({
+                                "order_code": order["order_code"],
+                                "worker": order["worker"],
+                                "address": order["address"],
+                                "details": details
+                            })
+                    
+                    # Find deleted - include address from old data
+                    # (old_map numeric fields are already parsed to floats)
+                    for key, order in old_map.items():
+                        if key[0] and key in deleted_keys:  # Has order_code and not in new
+                            # Build details from old order
+                            details = {}
+                            if order.get("revenue_total", 0.0) > 0:
+                                details["Выручка итого"] = format_amount(order.get('revenue_total', 0.0))
+                            if order.get("revenue_services", 0.0) != 0:
+                                details["Выручка от услуг"] = format_amount(order.get('revenue_services', 0.0))
+                            if order.get("service_payment", 0.0) != 0:
+                                details["Оплата услуг"] = format_amount(order.get('service_payment', 0.0))
+                            if order.get("percent", 0.0) > 0:
+                                details["Процент"] = f"{order.get('percent', 0.0):.0f}%"
                             
-                            # Get manual edits
-                            manual_edits_from_prev = prev_upload_details.get("manual_edits", [])
+                            changes_summary["deleted"].append({
+                                "order_code": order.get("order_code", ""),
+                                "worker": order.get("worker", ""),
+                                "address": order.get("address", ""),
+                                "details": details
+                            })
+                    
+                    # Log extra rows (they will be added to deleted later with full details)
+                    for extra_order in extra_rows_from_prev:
+                        # total comes directly from JOIN query now
+                        calc_total = extra_order.get("total", 0) or 0
+                        order_text = extra_order.get("order", "") or extra_order.get("order_full", "")
+                        if DEBUG_MODE: logger.debug(f"📋 Found extra row: {order_text[:30]}_{extra_order.get('worker', '')} total={calc_total}")
+                    
+                    # Find modified - compare all fields
+                    compare_fields = [
+                        ("revenue_total", "Выручка итого"),
+                        ("revenue_services", "Выручка от услуг"),
+                        ("diagnostic", "Диагностика"),
+                        ("specialist_fee", "Выезд специалиста"),
+                        ("additional_expenses", "Доп. расходы"),
+                        ("service_payment", "Оплата услуг"),
+                        ("percent", "Процент"),
+                    ]
+                    
+                    # Debug: sample keys and a known order compared between both maps.
+                    # Scans both maps, so only done in debug mode
+                    if DEBUG_MODE:
+                        # Debug: show some keys from both maps
+                        logger.debug(f"📊 Sample old_map keys: {list(islice(old_map, 5))}")
+                        logger.debug(f"📊 Sample new_map keys: {list(islice(new_map, 5))}")
+
+                        # Debug: find КАУТ-001143 specifically - compare SAME worker in both maps
+                        debug_order = "КАУТ-001143"
+                        old_keys_with_debug = [k for k in old_map if debug_order in k[0]]
+                        new_keys_with_debug = [k for k in new_map if debug_order in k[0]]
+                        logger.debug(f"🔍 {debug_order} in old_map: {old_keys_with_debug}")
+                        logger.debug(f"🔍 {debug_order} in new_map: {new_keys_with_debug}")
+
+                        # Compare EACH worker for this order between old and new
+                        for key in old_keys_with_debug:
+                            new_data = new_map.get(key)
+                            if new_data is not None:
+                                old_data = old_map[key]
+                                logger.debug(f"🔍 comparing {key}:")
+                                logger.debug(f"   OLD: rt={old_data.get('revenue_total')}, rs={old_data.get('revenue_services')}, sp={old_data.get('service_payment')}")
+                                logger.debug(f"   NEW: rt={new_data.get('revenue_total')}, rs={new_data.get('revenue_services')}, sp={new_data.get('service_payment')}")
+                                # Check differences
+                                for field in ['revenue_total', 'revenue_services', 'service_payment', 'diagnostic', 'specialist_fee']:
+                                    old_val = old_data.get(field, 0.0)
+                                    new_val = new_data[field]
+                                    if abs(old_val - new_val) > 0.01:
+                                        logger.debug(f"   ⚠️ DIFF {field}: {old_val} → {new_val}")
+                            else:
+                                logger.debug(f"🔍 {key} NOT in new_map - will be DELETED")
+
+                        # Debug: compare a sample order
+                        for key, new_o in islice(new_map.items(), 3):
+                            old_o = old_map.get(key)
+                            if old_o is not None:
+                                logger.debug(f"📊 Sample compare {key}:")
+                                logger.debug(f"   old revenue_total={old_o.get('revenue_total')} ({type(old_o.get('revenue_total')).__name__})")
+                                logger.debug(f"   new revenue_total={new_o.get('revenue_total')} ({type(new_o.get('revenue_total')).__name__})")
+                    
+                    # Orders present in both uploads, compared column-wise:
+                    # one float64 matrix per upload, one row per common key,
+                    # value fields first, then calculated fields
+                    # (one old_map probe per new order, no separate membership check)
+                    old_get = old_map.get
+                    common = [
+                        (key, old_order, new_order)
+                        for key, new_order in new_map.items()
+                        if key[0] and (old_order := old_get(key)) is not None
+                    ]
+                    value_fields = [f for f, _ in compare_fields]
+                    # Distinct names: service_payment is also a value field
+                    compare_columns = list(dict.fromkeys(
+                        value_fields + ["total", "fuel_payment", "transport", "service_payment"]
+                    ))
+                    old_matrix = pd.DataFrame.from_records(
+                        [old_order for _, old_order, _ in common], columns=compare_columns
+                    ).fillna(0.0).to_numpy(dtype=float)
+                    new_matrix = pd.DataFrame.from_records(
+                        [new_order for _, _, new_order in common], columns=compare_columns
+                    ).fillna(0.0).to_numpy(dtype=float)
+                    column = {name: j for j, name in enumerate(compare_columns)}
+                    
+                    old_values = old_matrix[:, :len(value_fields)]
+                    new_values = new_matrix[:, :len(value_fields)]
+                    field_diff = np.abs(old_values - new_values) > 0.01  # Compare with tolerance
+                    
+                    # IMPORTANT: Compare calculated totals (new has fuel/transport already calculated)
+                    # This detects manual edits made in UI
+                    old_total = old_matrix[:, column["total"]]
+                    old_fuel = old_matrix[:, column["fuel_payment"]]
+                    old_transport = old_matrix[:, column["transport"]]
+                    new_fuel = new_matrix[:, column["fuel_payment"]]
+                    new_transport = new_matrix[:, column["transport"]]
+                    
+                    # Calculate what total SHOULD be with old fuel/transport
+                    # This isolates manual edits from fuel calculation fluctuations
+                    expected_total_with_old_fuel = new_matrix[:, column["service_payment"]] + old_fuel + old_transport
+                    
+                    # Compare old_total with expected - if different, there was a REAL manual edit
+                    # (not just fuel API fluctuation)
+                    total_diff = np.abs(old_total - expected_total_with_old_fuel) > 0.01
+                    # Transport difference is a real change, not API fluctuation
+                    transport_diff = np.abs(old_transport - new_transport) > 0.01
+                    # Fuel only counts if it differs SIGNIFICANTLY (more than API fluctuation)
+                    fuel_diff = np.abs(old_fuel - new_fuel) > 250
+                    
+                    changed = field_diff.any(axis=1) | total_diff | transport_diff | fuel_diff
+                    
+                    # Calculated columns shown in changes: (name, diff mask, old, new, new value suffix)
+                    calc_checks = (
+                        ("Итого (ручное изменение)", total_diff, old_total, expected_total_with_old_fuel, " (пересчитано)"),
+                        ("Транспортные", transport_diff, old_transport, new_transport, ""),
+                        ("Бензин", fuel_diff, old_fuel, new_fuel, ""),
+                    )
+                    
+                    # Display name and formatter of each compared field (percent as "30%")
+                    field_formats = [
+                        (field_name, (lambda v: f"{v:.0f}%") if field_key == "percent" else format_amount)
+                        for field_key, field_name in compare_fields
+                    ]
+                    modified_append = changes_summary["modified"].append
+                    
+                    # Build human-readable changes only for modified orders,
+                    # visiting only the fields that differ
+                    for i in np.flatnonzero(changed):
+                        key, _, new_order = common[i]
                         
-                        if old_orders:
-                            changes_summary["has_previous"] = True
-                            changes_summary["previous_version"] = latest_upload_version
-                            changes_summary["previous_date"] = latest_upload_date
-                            changes_summary["previous_upload_id"] = latest_upload_id
-                            
-                            # Build maps for comparison
-                            # IMPORTANT: Normalize worker names from DB using current name_map
-                            # to ensure consistent keys between old and new data
-                            old_map = {}
-                            for o in old_orders:
-                                # Skip extra rows for normal comparison
-                                if o.get("is_extra_row", False):
-                                    continue
-                                # Normalize worker name from DB to match new file names
-                                worker_from_db = o.get("worker", "")
-                                worker_normalized = normalize_worker_name(worker_from_db, name_map).replace(" (оплата клиентом)", "")
-                                key = (o.get("order_code", ""), worker_normalized)
-                                old_map[key] = o
-                            
-                            if DEBUG_MODE: logger.debug(f"📊 Comparison: {len(old_map)} orders in DB")
-                            
-                            new_map = {}
-                            for _, row in combined.iterrows():
-                                # Skip worker total rows
-                                if row.get("is_worker_total", False):
-                                    continue
-                                    
-                                order_text = str(row.get("order", ""))
-                                order_code_match = re.search(r'(КАУТ|ИБУТ|ТДУТ|00УТ)-\d+', order_text)
-                                order_code = order_code_match.group(0) if order_code_match else ""
-                                
-                                # Skip rows without order code (they are totals or headers)
-                                if not order_code:
-                                    continue
-                                    
-                                # IMPORTANT: Use name_map for consistent normalization with old_map
-                                worker = normalize_worker_name(str(row.get("worker", "")), name_map).replace(" (оплата клиентом)", "")
-                                
-                                # Extract address from order text using proper function
-                                address = extract_address_from_order(order_text)
-                                if not address and ", " in order_text:
-                                    # Fallback: simple extraction
-                                    parts = order_text.split(", ", 1)
-                                    if len(parts) > 1:
-                                        address = parts[1].split("\n")[0][:80]
-                                
-                                key = (order_code, worker)
-                                
-                                # Collect all numeric fields - with safe parsing
-                                def safe_float(val):
-                                    if val is None or val == "" or pd.isna(val):
-                                        return 0.0
-                                    try:
-                                        if isinstance(val, str):
-                                            val = val.replace(" ", "").replace(",", ".").replace("%", "")
-                                        return float(val)
-                                    except (ValueError, TypeError):
-                                        return 0.0
-                                
-                                revenue_total = safe_float(row.get("revenue_total", 0))
-                                revenue_services = safe_float(row.get("revenue_services", 0))
-                                diagnostic = safe_float(row.get("diagnostic", 0))
-                                specialist_fee = safe_float(row.get("specialist_fee", 0))
-                                additional_expenses = safe_float(row.get("additional_expenses", 0))
-                                service_payment = safe_float(row.get("service_payment", 0))
-                                percent_val = parse_percent(row.get("percent", 0))
-                                
-                                new_map[key] = {
-                                    "order_code": order_code,
-                                    "order_full": order_text,
-                                    "address": address,
-                                    "worker": worker,
-                                    "revenue_total": revenue_total,
-                                    "revenue_services": revenue_services,
-                                    "diagnostic": diagnostic,
-                                    "specialist_fee": specialist_fee,
-                                    "additional_expenses": additional_expenses,
-                                    "service_payment": service_payment,
-                                    "percent": percent_val,
-                                }
-                            
-                            if DEBUG_MODE: logger.debug(f"📊 Comparison: {len(new_map)} orders in new files")
-                            
-                            # Calculate fuel and transport for new orders BEFORE comparison
-                            # This ensures we compare apples to apples
-                            config = DEFAULT_CONFIG.copy()
-                            company_car_workers = config.get("company_car_workers", [])
-                            company_car_normalized = [normalize_worker_name(w) for w in company_car_workers]
-                            
-                            for key, order in new_map.items():
-                                # Calculate fuel
-                                fuel_payment = 0
-                                if order["specialist_fee"] == 0 and order["address"]:
-                                    fuel_payment = await calculate_fuel_cost(order["address"], config, 1)
-                                order["fuel_payment"] = fuel_payment
-                                
-                                # Calculate transport
-                                transport = 0
-                                worker_normalized = normalize_worker_name(order["worker"])
-                                is_on_company_car = worker_normalized in company_car_normalized
-                                percent_min = config.get("transport_percent_min", 20)
-                                percent_max = config.get("transport_percent_max", 40)
-                                if order["revenue_services"] > config["transport_min_revenue"] and percent_min <= order["percent"] <= percent_max:
-                                    if not is_on_company_car:
-                                        transport = config["transport_amount"]
-                                order["transport"] = transport
-                                
-                                # Calculate total
-                                order["total"] = order["service_payment"] + fuel_payment + transport
-                            
-                            if DEBUG_MODE: logger.debug(f"📊 Calculated fuel/transport for {len(new_map)} new orders")
-                            
-                            # Find added - include all details
-                            for key, order in new_map.items():
-                                if key[0] and key not in old_map:  # Has order_code and not in old
-                                    # Build details dict with non-zero values
-                                    details = {}
-                                    if order["revenue_total"] > 0:
-                                        details["Выручка итого"] = f"{order['revenue_total']:,.0f}".replace(",", " ")
-                                    if order["revenue_services"] != 0:
-                                        details["Выручка от услуг"] = f"{order['revenue_services']:,.0f}".replace(",", " ")
-                                    if order["diagnostic"] > 0:
-                                        details["Диагностика"] = f"{order['diagnostic']:,.0f}".replace(",", " ")
-                                    if order["specialist_fee"] > 0:
-                                        details["Выезд специалиста"] = f"{order['specialist_fee']:,.0f}".replace(",", " ")
-                                    if order["additional_expenses"] != 0:
-                                        details["Доп. расходы"] = f"{order['additional_expenses']:,.0f}".replace(",", " ")
-                                    if order["service_payment"] != 0:
-                                        details["Оплата услуг"] = f"{order['service_payment']:,.0f}".replace(",", " ")
-                                    if order["percent"] > 0:
-                                        details["Процент"] = f"{order['percent']:.0f}%"
-                                    
-                                    changes_summary["added"].append({
-                                        "order_code": order["order_code"],
-                                        "worker": order["worker"],
-                                        "address": order["address"],
-                                        "details": details
-                                    })
-                            
-                            # Find deleted - include address from old data
-                            def safe_float_db(val):
-                                """Safely parse float from DB value that might be string like '30,00 %'"""
-                                if val is None or val == "":
-                                    return 0.0
-                                try:
-                                    if isinstance(val, (int, float)):
-                                        return float(val)
-                                    val_str = str(val).replace(" ", "").replace(",", ".").replace("%", "")
-                                    return float(val_str)
-                                except (ValueError, TypeError):
-                                    return 0.0
-                            
-                            for key, order in old_map.items():
-                                if key[0] and key not in new_map:  # Has order_code and not in new
-                                    # Build details from old order
-                                    details = {}
-                                    if safe_float_db(order.get("revenue_total", 0)) > 0:
-                                        details["Выручка итого"] = f"{safe_float_db(order.get('revenue_total', 0)):,.0f}".replace(",", " ")
-                                    if safe_float_db(order.get("revenue_services", 0)) != 0:
-                                        details["Выручка от услуг"] = f"{safe_float_db(order.get('revenue_services', 0)):,.0f}".replace(",", " ")
-                                    if safe_float_db(order.get("service_payment", 0)) != 0:
-                                        details["Оплата услуг"] = f"{safe_float_db(order.get('service_payment', 0)):,.0f}".replace(",", " ")
-                                    if safe_float_db(order.get("percent", 0)) > 0:
-                                        details["Процент"] = f"{safe_float_db(order.get('percent', 0)):.0f}%"
-                                    
-                                    changes_summary["deleted"].append({
-                                        "order_code": order.get("order_code", ""),
-                                        "worker": order.get("worker", ""),
-                                        "address": order.get("address", ""),
-                                        "details": details
-                                    })
-                            
-                            # Log extra rows (they will be added to deleted later with full details)
-                            for extra_order in extra_rows_from_prev:
-                                # total comes directly from JOIN query now
-                                calc_total = extra_order.get("total", 0) or 0
-                                order_text = extra_order.get("order", "") or extra_order.get("order_full", "")
-                                if DEBUG_MODE: logger.debug(f"📋 Found extra row: {order_text[:30]}_{extra_order.get('worker', '')} total={calc_total}")
-                            
-                            # Find modified - compare all fields
-                            compare_fields = [
-                                ("revenue_total", "Выручка итого"),
-                                ("revenue_services", "Выручка от услуг"),
-                                ("diagnostic", "Диагностика"),
-                                ("specialist_fee", "Выезд специалиста"),
-                                ("additional_expenses", "Доп. расходы"),
-                                ("service_payment", "Оплата услуг"),
-                                ("percent", "Процент"),
-                            ]
-                            
-                            # Debug: show some keys from both maps
-                            if DEBUG_MODE: logger.debug(f"📊 Sample old_map keys: {list(old_map.keys())[:5]}")
-                            if DEBUG_MODE: logger.debug(f"📊 Sample new_map keys: {list(new_map.keys())[:5]}")
-
-                            # Debug: find КАУТ-001143 specifically - compare SAME worker in both maps
-                            debug_order = "КАУТ-001143"
-                            old_keys_with_debug = [k for k in old_map.keys() if debug_order in k[0]]
-                            new_keys_with_debug = [k for k in new_map.keys() if debug_order in k[0]]
-                            if DEBUG_MODE: logger.debug(f"🔍 {debug_order} in old_map: {old_keys_with_debug}")
-                            if DEBUG_MODE: logger.debug(f"🔍 {debug_order} in new_map: {new_keys_with_debug}")
-
-                            # Compare EACH worker for this order between old and new
-                            for key in old_keys_with_debug:
-                                if key in new_map:
-                                    old_data = old_map[key]
-                                    new_data = new_map[key]
-                                    if DEBUG_MODE: logger.debug(f"🔍 comparing {key}:")
-                                    if DEBUG_MODE: logger.debug(f"   OLD: rt={old_data.get('revenue_total')}, rs={old_data.get('revenue_services')}, sp={old_data.get('service_payment')}")
-                                    if DEBUG_MODE: logger.debug(f"   NEW: rt={new_data.get('revenue_total')}, rs={new_data.get('revenue_services')}, sp={new_data.get('service_payment')}")
-                                    # Check differences
-                                    for field in ['revenue_total', 'revenue_services', 'service_payment', 'diagnostic', 'specialist_fee']:
-                                        old_val = safe_float_db(old_data.get(field, 0))
-                                        new_val = float(new_data.get(field, 0) or 0)
-                                        if abs(old_val - new_val) > 0.01:
-                                            if DEBUG_MODE: logger.debug(f"   ⚠️ DIFF {field}: {old_val} → {new_val}")
-                                else:
-                                    if DEBUG_MODE: logger.debug(f"🔍 {key} NOT in new_map - will be DELETED")
-
-                            # Debug: compare a sample order
-                            for key in list(new_map.keys())[:3]:
-                                if key in old_map:
-                                    old_o = old_map[key]
-                                    new_o = new_map[key]
-                                    if DEBUG_MODE: logger.debug(f"📊 Sample compare {key}:")
-                                    if DEBUG_MODE: logger.debug(f"   old revenue_total={old_o.get('revenue_total')} ({type(old_o.get('revenue_total')).__name__})")
-                                    if DEBUG_MODE: logger.debug(f"   new revenue_total={new_o.get('revenue_total')} ({type(new_o.get('revenue_total')).__name__})")
-                            
-                            for key in new_map:
-                                if key[0] and key in old_map:  # Both exist
-                                    old_order = old_map[key]
-                                    new_order = new_map[key]
-
-                                    field_changes = []
-                                    for field_key, field_name in compare_fields:
-                                        # old_order comes from DB - might have string values like '30,00 %'
-                                        old_val = safe_float_db(old_order.get(field_key, 0))
-                                        # new_order comes from parsed file - already numeric
-                                        new_val = float(new_order.get(field_key, 0) or 0)
-
-                                        if abs(old_val - new_val) > 0.01:  # Compare with tolerance
-                                            if field_key == "percent":
-                                                field_changes.append({
-                                                    "field": field_name,
-                                                    "old": f"{old_val:.0f}%",
-                                                    "new": f"{new_val:.0f}%"
-                                                })
-                                            else:
-                                                field_changes.append({
-                                                    "field": field_name,
-                                                    "old": f"{old_val:,.0f}".replace(",", " "),
-                                                    "new": f"{new_val:,.0f}".replace(",", " ")
-                                                })
-
-                                    # IMPORTANT: Compare calculated totals (new has fuel/transport already calculated)
-                                    # This detects manual edits made in UI
-                                    old_total = safe_float_db(old_order.get("total", 0))
-                                    old_fuel = safe_float_db(old_order.get("fuel_payment", 0))
-                                    old_transport = safe_float_db(old_order.get("transport", 0))
-                                    
-                                    # new_order now has calculated fuel/transport/total
-                                    new_total = float(new_order.get("total", 0) or 0)
-                                    new_fuel = float(new_order.get("fuel_payment", 0) or 0)
-                                    new_transport = float(new_order.get("transport", 0) or 0)
-
-                                    # Calculate what total SHOULD be with old fuel/transport
-                                    # This isolates manual edits from fuel calculation fluctuations
-                                    new_service_payment = float(new_order.get("service_payment", 0) or 0)
-                                    expected_total_with_old_fuel = new_service_payment + old_fuel + old_transport
-                                    
-                                    # Compare old_total with expected - if different, there was a REAL manual edit
-                                    # (not just fuel API fluctuation)
-                                    if abs(old_total - expected_total_with_old_fuel) > 0.01:
-                                        field_changes.append({
-                                            "field": "Итого (ручное изменение)",
-                                            "old": f"{old_total:,.0f}".replace(",", " "),
-                                            "new": f"{expected_total_with_old_fuel:,.0f}".replace(",", " ") + " (пересчитано)"
-                                        })
-                                        if DEBUG_MODE: logger.debug(f"📊 Manual edit detected: {key} - old_total={old_total}, expected={expected_total_with_old_fuel}")
-                                    
-                                    # Check if transport differs (this is a real change, not API fluctuation)
-                                    if abs(old_transport - new_transport) > 0.01:
-                                        field_changes.append({
-                                            "field": "Транспортные",
-                                            "old": f"{old_transport:,.0f}".replace(",", " "),
-                                            "new": f"{new_transport:,.0f}".replace(",", " ")
-                                        })
-                                        if DEBUG_MODE: logger.debug(f"📊 Transport differs: {key} - old={old_transport}, new={new_transport}")
-                                    
-                                    # Check if fuel differs SIGNIFICANTLY (more than API fluctuation)
-                                    if abs(old_fuel - new_fuel) > 250:
-                                        field_changes.append({
-                                            "field": "Бензин",
-                                            "old": f"{old_fuel:,.0f}".replace(",", " "),
-                                            "new": f"{new_fuel:,.0f}".replace(",", " ")
-                                        })
-                                        if DEBUG_MODE: logger.debug(f"📊 Fuel differs significantly: {key} - old={old_fuel}, new={new_fuel}")
-
-                                    if field_changes:
-                                        if DEBUG_MODE: logger.debug(f"📊 Modified found: {key} - {field_changes}")
-                                        changes_summary["modified"].append({
-                                            "order_code": new_order["order_code"],
-                                            "worker": new_order["worker"],
-                                            "address": new_order["address"],
-                                            "changes": field_changes
-                                        })
-                            
-                            if DEBUG_MODE: logger.debug(f"📊 Comparison result: {len(changes_summary['added'])} added, {len(changes_summary['deleted'])} deleted, {len(changes_summary['modified'])} modified")
-                            
-                            # Add extra rows (manual additions) from previous version to deleted list
-                            # These are rows that were manually added and won't be in new 1C files
-                            if DEBUG_MODE: logger.debug(f"📋 DEBUG: extra_rows_from_prev has {len(extra_rows_from_prev)} items before loop")
-                            changes_summary["extra_rows"] = []  # Store for later restoration
-                            for extra in extra_rows_from_prev:
-                                order_text = extra.get("order_full", "") or extra.get("order", "") or extra.get("order_code", "")
-                                worker = extra.get("worker", "")
-                                
-                                if DEBUG_MODE: logger.debug(f"📋 Extra row from DB: order_full='{extra.get('order_full', '')}', order='{extra.get('order', '')}', order_code='{extra.get('order_code', '')}' -> order_text='{order_text}'")
-                                
-                                # Get total directly from extra (from JOIN query)
-                                total = extra.get("total", 0) or 0
-                                
-                                changes_summary["extra_rows"].append({
-                                    "id": extra.get("id"),
-                                    "order_code": extra.get("order_code", "") or order_text[:50],
-                                    "order_full": order_text,
-                                    "worker": worker,
-                                    "address": extra.get("address", ""),
-                                    "total": total,
-                                    "type": "extra_row"
-                                })
-                                
-                                # Add to deleted list for UI
-                                changes_summary["deleted"].append({
-                                    "order_code": order_text[:50] if not extra.get("order_code") else extra.get("order_code"),
-                                    "worker": worker,
-                                    "address": extra.get("address", "") or order_text,
-                                    "details": {
-                                        "Итого": f"{total:,.0f}".replace(",", " ") if total else "—"
-                                    },
-                                    "type": "extra_row",
-                                    "original_id": extra.get("id")
-                                })
-                            
-                            # Also add manual_edits info for potential restoration
-                            changes_summary["manual_edits_prev"] = manual_edits_from_prev
-                            
-                            if DEBUG_MODE: logger.debug(f"📋 FINAL: changes_summary has {len(changes_summary['added'])} added, {len(changes_summary['deleted'])} deleted (including {len(changes_summary.get('extra_rows', []))} extra_rows)")
-                            
+                        field_changes = [
+                            {
+                                "field": field_formats[j][0],
+                                "old": field_formats[j][1](old_values[i, j]),
+                                "new": field_formats[j][1](new_values[i, j])
+                            }
+                            for j in np.flatnonzero(field_diff[i])
+                        ]
+                        field_changes.extend(
+                            {
+                                "field": field_name,
+                                "old": format_amount(old_col[i]),
+                                "new": format_amount(new_col[i]) + suffix
+                            }
+                            for field_name, diff, old_col, new_col, suffix in calc_checks if diff[i]
+                        )
+                        
+                        if DEBUG_MODE: logger.debug(f"📊 Modified found: {key} - {field_changes}")
+                        modified_append({
+                            "order_code": new_order["order_code"],
+                            "worker": new_order["worker"],
+                            "address": new_order["address"],
+                            "changes": field_changes
+                        })
+                    
+                    if DEBUG_MODE: logger.debug(f"📊 Comparison result: {len(changes_summary['added'])} added, {len(changes_summary['deleted'])} deleted, {len(changes_summary['modified'])} modified")
+                    
+                    # Add extra rows (manual additions) from previous version to deleted list
+                    # These are rows that were manually added and won't be in new 1C files
+                    if DEBUG_MODE: logger.debug(f"📋 DEBUG: extra_rows_from_prev has {len(extra_rows_from_prev)} items before loop")
+                    order_texts = [
+                        extra.get("order_full", "") or extra.get("order", "") or extra.get("order_code", "")
+                        for extra in extra_rows_from_prev
+                    ]
+                    if DEBUG_MODE:
+                        for extra, order_text in zip(extra_rows_from_prev, order_texts):
+                            logger.debug(f"📋 Extra row from DB: order_full='{extra.get('order_full', '')}', order='{extra.get('order', '')}', order_code='{extra.get('order_code', '')}' -> order_text='{order_text}'")
+                    
+                    # Store for later restoration
+                    # (total comes directly from extra, from JOIN query)
+                    changes_summary["extra_rows"] = [
+                        {
+                            "id": extra.get("id"),
+                            "order_code": extra.get("order_code", "") or order_text[:50],
+                            "order_full": order_text,
+                            "worker": extra.get("worker", ""),
+                            "address": extra.get("address", ""),
+                            "total": extra.get("total", 0) or 0,
+                            "type": "extra_row"
+                        }
+                        for extra, order_text in zip(extra_rows_from_prev, order_texts)
+                    ]
+                    
+                    # Add to deleted list for UI
+                    changes_summary["deleted"].extend(
+                        {
+                            "order_code": row["order_code"],
+                            "worker": row["worker"],
+                            "address": row["address"] or row["order_full"],
+                            "details": {
+                                "Итого": format_amount(row["total"]) if row["total"] else "—"
+                            },
+                            "type": "extra_row",
+                            "original_id": row["id"]
+                        }
+                        for row in changes_summary["extra_rows"]
+                    )
+                    
+                    # Also add manual_edits info for potential restoration
+                    changes_summary["manual_edits_prev"] = manual_edits_from_prev
+                    
+                    if DEBUG_MODE: logger.debug(f"📋 FINAL: changes_summary has {len(changes_summary['added'])} added, {len(changes_summary['deleted'])} deleted (including {len(changes_summary.get('extra_rows', []))} extra_rows)")
+                    
         except Exception as e:
             logger.warning(f"⚠️ Changes comparison error (non-critical): {e}")
             import traceback
             traceback.print_exc()
         
-        # Store changes_summary in session for review page
-        session_data[session_id]["changes_summary"] = changes_summary
+        # Store session (with changes_summary for review page)
+        upload_session["changes_summary"] = changes_summary
+        await save_upload_session(session_id, upload_session)
         
         # Check if there are changes to review
-        has_changes = (
-            changes_summary.get("has_previous", False) and (
-                len(changes_summary.get("added", [])) > 0 or
-                len(changes_summary.get("deleted", [])) > 0 or
-                len(changes_summary.get("modified", [])) > 0
+        # (empty lists are falsy; bool() keeps the response values true/false)
+        has_changes = bool(
+            changes_summary.get("has_previous") and (
+                changes_summary.get("added") or
+                changes_summary.get("deleted") or
+                changes_summary.get("modified")
             )
         )
         
         # Get manager comments and warnings from session
-        manager_comments = session_data[session_id].get("manager_comments", [])
-        parse_warnings = session_data[session_id].get("parse_warnings", [])
-        has_manager_comments = len(manager_comments) > 0
-        has_warnings = len(parse_warnings) > 0
+        manager_comments = upload_session.get("manager_comments", [])
+        parse_warnings = upload_session.get("parse_warnings", [])
+        has_manager_comments = bool(manager_comments)
+        has_warnings = bool(parse_warnings)
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "session_id": session_id,
             "period": period,
@@ -1044,15 +1229,14 @@ async def review_page(request: Request):
 async def get_review_data(session_id: str):
     """Get changes data for review page"""
     try:
-        if session_id not in session_data:
-            return JSONResponse({"success": False, "error": "Сессия истекла"})
-        
-        session = session_data[session_id]
+        session = await get_upload_session(session_id)
+        if session is None:
+            return ORJSONResponse({"success": False, "error": "Сессия истекла"})
         changes = session.get("changes_summary", {})
         manager_comments = session.get("manager_comments", [])
         parse_warnings = session.get("parse_warnings", [])
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "session_id": session_id,
             "period": session.get("period", ""),
@@ -1066,207 +1250,350 @@ async def get_review_data(session_id: str):
             "parse_warnings": parse_warnings
         })
     except Exception as e:
-        return JSONResponse({"success": False, "error": str(e)})
+        return ORJSONResponse({"success": False, "error": str(e)})
+
+
+# Month names by number, for Yandex fuel deduction labels
+MONTH_NAMES = {
+    "01": "Январь", "02": "Февраль", "03": "Март", "04": "Апрель",
+    "05": "Май", "06": "Июнь", "07": "Июль", "08": "Август",
+    "09": "Сентябрь", "10": "Октябрь", "11": "Ноябрь", "12": "Декабрь"
+}
+
+
+# Numeric fields of saved orders / calculations
+SAVE_ORDER_NUMERIC_FIELDS = (
+    "revenue_total", "revenue_services", "diagnostic", "diagnostic_payment",
+    "specialist_fee", "additional_expenses", "service_payment",
+)
+SAVE_CALC_NUMERIC_FIELDS = ("fuel_payment", "transport", "diagnostic_50", "total")
+
+
+def _change_rows(changes_dict: dict) -> list:
+    """Flatten compare_uploads result into rows for bulk_save_changes"""
+    rows = [
+        {"order_code": change.get("order_code"), "worker": change.get("worker"), "change_type": change_type}
+        for change_type in ("added", "deleted")
+        for change in changes_dict.get(change_type, [])
+    ]
+    rows.extend(
+        {
+            "order_code": change.get("order_code"),
+            "worker": change.get("worker"),
+            "change_type": "modified",
+            "field": field_change.get("field"),
+            "old_value": str(field_change.get("old", "")),
+            "new_value": str(field_change.get("new", "")),
+        }
+        for change in changes_dict.get("modified", [])
+        for field_change in change.get("changes", [])
+    )
+    return rows
+
+
+def _aggregate_worker_totals(totals: pd.DataFrame) -> List[dict]:
+    """Worker totals rows (worker_totals columns) from per-order frame
+    with worker, is_client, total, fuel, transport columns - one groupby pass.
+    Non-numeric totals add 0 and are not counted in company/client orders.
+    """
+    if totals.empty:
+        return []
+    totals = totals.assign(**{
+        column: pd.to_numeric(totals[column], errors="coerce")
+        for column in ("total", "fuel", "transport")
+    })
+    by_worker = totals.groupby("worker", sort=False)
+    orders_count = by_worker.size()  # workers in first appearance order
+    by_side = (
+        totals.groupby(["worker", "is_client"])["total"].agg(["sum", "count"])
+        .unstack(fill_value=0)
+        .reindex(index=orders_count.index, columns=pd.MultiIndex.from_product([["sum", "count"], [False, True]]), fill_value=0)
+    )
+    result = pd.DataFrame({
+        "company_amount": by_side[("sum", False)],
+        "client_amount": by_side[("sum", True)],
+        "orders_count": orders_count,
+        "company_orders_count": by_side[("count", False)],
+        "client_orders_count": by_side[("count", True)],
+        "fuel_total": by_worker["fuel"].sum(),
+        "transport_total": by_worker["transport"].sum(),
+    })
+    result["total_amount"] = result["company_amount"] + result["client_amount"]
+    return result.rename_axis("worker").reset_index().to_dict("records")
+
+
+async def _save_upload_changes(prev_upload_id: int, upload_id: int):
+    """Compare upload with the previous one and save the changes.
+    Runs as a background task after the response (changes are history only)
+    """
+    try:
+        changes_dict = await compare_uploads(prev_upload_id, upload_id)
+        await bulk_save_changes(upload_id, _change_rows(changes_dict))
+    except Exception as e:
+        logger.warning(f"⚠️ Saving upload changes failed (upload {upload_id}): {e}")
+
+
+async def _save_calculated_rows(upload_id: int, calculated_data: List[dict], config: dict, period: str):
+    """Save calculated rows of an upload: orders with calculations, worker totals
+    and Yandex fuel deductions (as manual edits, for history tracking).
+    Shared by apply-review and first-upload; call inside upload_transaction()
+    """
+    # Numeric fields coerced column-wise (empty/invalid -> 0.0)
+    frame = pd.DataFrame(calculated_data)
+    numeric = {
+        field: (pd.to_numeric(frame[field], errors="coerce").fillna(0.0).tolist()
+                if field in frame.columns else [0.0] * len(frame))
+        for field in SAVE_ORDER_NUMERIC_FIELDS + SAVE_CALC_NUMERIC_FIELDS
+    }
+    
+    # Order date from text (format: "КАУТ-001904, 21.12.2025, ..."), parsed column-wise
+    # (no date / invalid date -> None)
+    order_dates = [None] * len(frame)
+    if "order" in frame.columns:
+        date_parts = frame["order"].astype(str).str.extract(ORDER_DATE_RE)
+        parsed_dates = pd.to_datetime(date_parts[2] + date_parts[1] + date_parts[0], format="%Y%m%d", errors="coerce")
+        order_dates = [d.to_pydatetime() if pd.notna(d) else None for d in parsed_dates]
+    
+    # First pass: collect orders to save (totals are aggregated from them afterwards)
+    order_items = []  # (order_data, calc_data) to save in bulk
+
+    # Rows to save: with a worker and not worker total rows (totals are calculated from orders)
+    keep = pd.Series(False, index=frame.index)
+    if "worker" in frame.columns:
+        keep = frame["worker"].notna() & (frame["worker"] != "")
+    if "is_worker_total" in frame.columns:
+        keep &= ~frame["is_worker_total"].eq(True)
+    
+    for i in np.flatnonzero(keep.to_numpy()):
+        row = calculated_data[i]
+        worker = row["worker"]
+    
+        # Save individual order
+        order_text = str(row.get("order", ""))
+
+        # order_code / address come with the row: extracted at parse time (_add_order_fields)
+        # or kept from the previous upload (restored rows). Missing or empty: extract from order text
+        order_code = row.get("order_code")
+        if not order_code:
+            match = ORDER_CODE_RE.search(order_text)
+            order_code = match.group(0) if match else ""
+    
+        address = row.get("address", "")
+        if not address and ", " in order_text:
+            parts = order_text.split(", ", 1)
+            if len(parts) > 1:
+                address = parts[1].split("\n")[0][:100]
+    
+        base_worker = worker.replace(" (оплата клиентом)", "")
+        # Check is_client_payment from record first, then from worker name
+        is_client = row.get("is_client_payment", False) or "(оплата клиентом)" in worker
+        is_extra = row.get("is_extra_row", False)
+    
+        order_data = {
+            "worker": base_worker,
+            "order_code": order_code,
+            "order": order_text[:500],
+            "order_date": order_dates[i],
+            "address": address,
+            "is_client_payment": is_client,
+            "days_on_site": row.get("days_on_site", None),
+            "is_extra_row": is_extra,
+            **{field: numeric[field][i] for field in SAVE_ORDER_NUMERIC_FIELDS},
+            "percent": parse_percent(row.get("percent", 0)),
+            "manager_comment": row.get("manager_comment", None)
+        }
+    
+        # Calculation for this order
+        calc_data = {
+            "worker": base_worker,
+            **{field: numeric[field][i] for field in SAVE_CALC_NUMERIC_FIELDS},
+        }
+        order_items.append((order_data, calc_data))
+
+    # Orders and calculations in one bulk write
+    await bulk_save_orders(upload_id, order_items)
+
+    # Save worker totals (fuel/transport totals are not tracked here)
+    await bulk_save_worker_totals(upload_id, _aggregate_worker_totals(pd.DataFrame({
+        "worker": [order_data["worker"] for order_data, _ in order_items],
+        "is_client": [bool(order_data["is_client_payment"]) for order_data, _ in order_items],
+        "total": [calc_data["total"] for _, calc_data in order_items],
+        "fuel": 0.0,
+        "transport": 0.0,
+    })))
+
+    # Save Yandex fuel deductions as manual edits (for history tracking)
+    yandex_fuel = config.get("yandex_fuel", {})
+    if yandex_fuel:
+        # Determine month from period (e.g., "01-15.12.25" -> "Декабрь")
+        month_num = period.split(".")[-2] if "." in period else ""
+        order_code = f"Вычет Яндекс заправки ({MONTH_NAMES.get(month_num, '')})"
+        
+        await bulk_save_manual_edits(upload_id, [
+            {
+                "order_id": None,
+                "calculation_id": None,
+                "order_code": order_code,
+                "worker": worker,
+                "address": "",
+                "field_name": "YANDEX_FUEL",
+                "old_value": deduction,
+                "new_value": -deduction,
+                "period_status": "DRAFT",
+            }
+            for worker, deduction in yandex_fuel.items()
+            if deduction and deduction > 0
+        ])
+        if DEBUG_MODE: logger.debug(f"⛽ Saved Yandex fuel deductions for {len(yandex_fuel)} workers")
 
 
 @app.post("/api/apply-review")
-async def apply_review_changes(request: Request):
+async def apply_review_changes(request: Request, background_tasks: BackgroundTasks):
     """Apply selected changes and proceed with calculation"""
     try:
         data = await request.json()
         session_id = data.get("session_id")
         selections = data.get("selections", {})
         
-        if session_id not in session_data:
-            return JSONResponse({"success": False, "error": "Сессия истекла"})
-        
-        session = session_data[session_id]
-        combined_records = session.get("combined", [])
+        session = await get_upload_session(session_id)
+        if session is None:
+            return ORJSONResponse({"success": False, "error": "Сессия истекла"})
+        combined_records = get_session_records(session)
         changes = session.get("changes_summary", {})
         name_map = session.get("name_map", {})  # Get name_map for consistent normalization
         
-        # Convert combined back to list of dicts for modification
+        # Work on a copy of the rows list for modification
         modified_records = list(combined_records)
         
-        # Process deleted items that should be restored
-        deleted_to_restore = selections.get("deleted", [])
-        if deleted_to_restore and changes.get("has_previous"):
-            # We need to fetch the old orders from database
+        # Sets: membership is checked once per old order / record below
+        deleted_to_restore = frozenset(selections.get("deleted", []))
+        modified_to_revert = frozenset(selections.get("modified", []))
+        # selections.added contains keys to SKIP (not add)
+        added_to_skip = frozenset(selections.get("added", []))
+        # manager_comments is a dict: {order_key: true/false}
+        # where true = apply manager's payment, false = use standard calculation
+        manager_selections = selections.get("manager_comments", {})
+        manager_keys = frozenset(key for key, apply in manager_selections.items() if apply)
+        
+        # Fetch orders of the previous version once for both restore and revert
+        old_orders = []
+        if (deleted_to_restore or modified_to_revert) and changes.get("has_previous"):
             try:
-                from database import get_orders_by_upload, get_upload_details
                 period_id = await get_or_create_period(session["period"])
-                period_details = await get_period_details(period_id)
-                
-                if period_details and period_details.get("uploads"):
-                    # Find latest upload with actual orders (skip empty uploads)
-                    latest_upload_id = None
-                    old_orders = []
-                    for upload in period_details["uploads"]:
-                        upload_id_check = upload["id"]
-                        orders_check = await get_orders_by_upload(upload_id_check)
-                        if orders_check and len(orders_check) > 0:
-                            latest_upload_id = upload_id_check
-                            old_orders = orders_check
-                            if DEBUG_MODE: logger.debug(f"📋 Found previous version with {len(old_orders)} orders for restoration")
-                            break
+                invalidate_period_permissions()  # a new period becomes the latest one
+                _, old_orders = await get_latest_upload_with_orders(period_id)
+                if old_orders:
+                    if DEBUG_MODE: logger.debug(f"📋 Found previous version with {len(old_orders)} orders for restoration")
+                else:
+                    logger.warning(f"⚠️ No previous version with orders found for restoration")
+            except Exception as e:
+                logger.error(f"Error loading previous version orders: {e}")
+                import traceback
+                traceback.print_exc()
+        
+        # Process deleted items that should be restored
+        if deleted_to_restore and old_orders:
+            try:
+                for old_order in old_orders:
+                    order_code = old_order.get("order_code", "")
+                    order_full = old_order.get("order_full", "")
+                    worker = old_order.get("worker", "")
+                    is_extra = old_order.get("is_extra_row", False)
                     
-                    if not latest_upload_id or not old_orders:
-                        logger.warning(f"⚠️ No previous version with orders found for restoration")
+                    # For extra rows, use order_full as key if no order_code
+                    if is_extra and not order_code:
+                        key = (order_full[:50] if order_full else "EXTRA") + "_" + worker
                     else:
-                        # Get upload details for extra rows with calculations
-                        upload_details = await get_upload_details(latest_upload_id)
+                        key = order_code + "_" + worker
+                    
+                    if key in deleted_to_restore:
+                        # Get calculation data directly from old_order (from JOIN query)
+                        calc_total = old_order.get("total", 0) or 0
+                        calc_fuel = old_order.get("fuel_payment", 0) or 0
+                        calc_transport = old_order.get("transport", 0) or 0
                         
-                        for old_order in old_orders:
-                            order_code = old_order.get("order_code", "")
-                            order_full = old_order.get("order_full", "")
-                            worker = old_order.get("worker", "")
-                            is_extra = old_order.get("is_extra_row", False)
-                            
-                            # For extra rows, use order_full as key if no order_code
-                            if is_extra and not order_code:
-                                key = (order_full[:50] if order_full else "EXTRA") + "_" + worker
-                            else:
-                                key = order_code + "_" + worker
-                            
-                            if key in deleted_to_restore:
-                                # Get calculation data directly from old_order (from JOIN query)
-                                calc_total = old_order.get("total", 0) or 0
-                                calc_fuel = old_order.get("fuel_payment", 0) or 0
-                                calc_transport = old_order.get("transport", 0) or 0
-                                
-                                if DEBUG_MODE: logger.debug(f"📋 Restoring {key}: total={calc_total}, fuel={calc_fuel}, transport={calc_transport}")
-                                
-                                # Add this order back to combined records
-                                restored_record = {
-                                    "worker": worker,
-                                    "order": order_full or order_code,
-                                    "order_code": order_code,  # Preserve original order_code for extra rows
-                                    "address": old_order.get("address", ""),  # Preserve address
-                                    "revenue_total": old_order.get("revenue_total", 0),
-                                    "revenue_services": old_order.get("revenue_services", 0),
-                                    "diagnostic": old_order.get("diagnostic", 0),
-                                    "diagnostic_payment": old_order.get("diagnostic_payment", 0),
-                                    "specialist_fee": old_order.get("specialist_fee", 0),
-                                    "additional_expenses": old_order.get("additional_expenses", 0),
-                                    "service_payment": old_order.get("service_payment", 0),
-                                    "percent": old_order.get("percent", 0),
-                                    "is_client_payment": old_order.get("is_client_payment", False),
-                                    "is_restored": True,  # Mark as restored
-                                    "is_extra_row": is_extra,
-                                    # Preserve calculation values for extra rows
-                                    "fuel_payment": calc_fuel,
-                                    "transport": calc_transport,
-                                    "total": calc_total,
-                                }
-                                modified_records.append(restored_record)
-                                logger.info(f"✅ Restored: {key} (extra_row={is_extra}, total={calc_total})")
+                        if DEBUG_MODE: logger.debug(f"📋 Restoring {key}: total={calc_total}, fuel={calc_fuel}, transport={calc_transport}")
+                        
+                        # Add this order back to combined records
+                        restored_record = {field: old_order.get(field, 0) for field in REVIEW_RESTORE_FIELDS}
+                        restored_record.update(
+                            worker=worker,
+                            order=order_full or order_code,
+                            order_code=order_code,  # Preserve original order_code for extra rows
+                            address=old_order.get("address", ""),  # Preserve address
+                            is_client_payment=old_order.get("is_client_payment", False),
+                            is_restored=True,  # Mark as restored
+                            is_extra_row=is_extra,
+                            # Preserve calculation values for extra rows
+                            fuel_payment=calc_fuel,
+                            transport=calc_transport,
+                            total=calc_total,
+                        )
+                        modified_records.append(restored_record)
+                        if DEBUG_MODE: logger.debug(f"✅ Restored: {key} (extra_row={is_extra}, total={calc_total})")
             except Exception as e:
                 logger.error(f"Error restoring deleted orders: {e}")
                 import traceback
                 traceback.print_exc()
         
+        # Normalized "order_code_worker" key of each record, computed once
+        # for the revert / skip / manager comment passes below (only if any is needed)
+        normalize_worker = _worker_key_normalizer(name_map)
+        record_keys = []
+        if (modified_to_revert and old_orders) or added_to_skip or manager_keys:
+            record_keys = [_review_record_key(record, normalize_worker) for record in modified_records]
+        
         # Process modified items where user wants to keep old values
-        modified_to_revert = selections.get("modified", [])
-        if modified_to_revert and changes.get("has_previous"):
+        if modified_to_revert and old_orders:
             try:
-                from database import get_orders_by_upload
-                period_id = await get_or_create_period(session["period"])
-                period_details = await get_period_details(period_id)
+                # Normalize worker names for consistent key matching
+                old_orders_map = {
+                    o.get("order_code", "") + "_" + normalize_worker(o.get("worker", "")): o
+                    for o in old_orders
+                }
                 
-                if period_details and period_details.get("uploads"):
-                    # Find latest upload with actual orders
-                    latest_upload_id = None
-                    old_orders = []
-                    for upload in period_details["uploads"]:
-                        upload_id_check = upload["id"]
-                        orders_check = await get_orders_by_upload(upload_id_check)
-                        if orders_check and len(orders_check) > 0:
-                            latest_upload_id = upload_id_check
-                            old_orders = orders_check
-                            break
-                    
-                    if old_orders:
-                        old_orders_map = {}
-                        for o in old_orders:
-                            # Normalize worker name for consistent key matching
-                            worker_normalized = normalize_worker_name(o.get("worker", ""), name_map).replace(" (оплата клиентом)", "")
-                            old_orders_map[o.get("order_code", "") + "_" + worker_normalized] = o
-
-                        # Update records with old values
-                        for i, record in enumerate(modified_records):
-                            order_text = str(record.get("order", ""))
-                            order_code_match = re.search(r'(КАУТ|ИБУТ|ТДУТ|00УТ)-\d+', order_text)
-                            order_code = order_code_match.group(0) if order_code_match else ""
-                            # Normalize worker name for consistent key matching
-                            worker = normalize_worker_name(str(record.get("worker", "")), name_map).replace(" (оплата клиентом)", "")
-                            key = order_code + "_" + worker
-                            
-                            if key in modified_to_revert and key in old_orders_map:
-                                old = old_orders_map[key]
-                                # Revert numeric fields to old values
-                                modified_records[i]["revenue_total"] = old.get("revenue_total", 0)
-                                modified_records[i]["revenue_services"] = old.get("revenue_services", 0)
-                                modified_records[i]["diagnostic"] = old.get("diagnostic", 0)
-                                modified_records[i]["specialist_fee"] = old.get("specialist_fee", 0)
-                                modified_records[i]["additional_expenses"] = old.get("additional_expenses", 0)
-                                modified_records[i]["service_payment"] = old.get("service_payment", 0)
-                                modified_records[i]["percent"] = old.get("percent", 0)
-                                modified_records[i]["is_reverted"] = True
-
-                                # IMPORTANT: Also preserve calculation values (including manual edits)
-                                # This ensures "Вариант B" works - old version values are kept
-                                # Data comes directly from JOIN query now
-                                old_total = old.get("total", 0) or 0
-                                old_fuel = old.get("fuel_payment", 0) or 0
-                                old_transport = old.get("transport", 0) or 0
-                                if old_total or old_fuel or old_transport:
-                                    modified_records[i]["_old_calc_total"] = old_total
-                                    modified_records[i]["_old_calc_fuel"] = old_fuel
-                                    modified_records[i]["_old_calc_transport"] = old_transport
-                                    if DEBUG_MODE: logger.debug(f"📋 Preserving old calc for {key}: total={old_total}")
+                # Update records with old values
+                for i, key in enumerate(record_keys):
+                    if key in modified_to_revert and key in old_orders_map:
+                        old = old_orders_map[key]
+                        # Revert numeric fields to old values
+                        modified_records[i].update({field: old.get(field, 0) for field in REVIEW_REVERT_FIELDS})
+                        modified_records[i]["is_reverted"] = True
+
+                        # IMPORTANT: Also preserve calculation values (including manual edits)
+                        # This ensures "Вариант B" works - old version values are kept
+                        # Data comes directly from JOIN query now
+                        old_total = old.get("total", 0) or 0
+                        old_fuel = old.get("fuel_payment", 0) or 0
+                        old_transport = old.get("transport", 0) or 0
+                        if old_total or old_fuel or old_transport:
+                            modified_records[i]["_old_calc_total"] = old_total
+                            modified_records[i]["_old_calc_fuel"] = old_fuel
+                            modified_records[i]["_old_calc_transport"] = old_transport
+                            if DEBUG_MODE: logger.debug(f"📋 Preserving old calc for {key}: total={old_total}")
             except Exception as e:
                 logger.error(f"Error reverting modified orders: {e}")
         
-        # Process added items - selections.added contains keys to SKIP (not add)
-        added_to_skip = set(selections.get("added", []))
-        
+        # Process added items - skip the ones user didn't accept
         if added_to_skip:
             if DEBUG_MODE: logger.debug(f"📋 Skipping {len(added_to_skip)} added orders: {added_to_skip}")
             filtered_records = []
-            for record in modified_records:
-                order_text = str(record.get("order", ""))
-                order_code_match = re.search(r'(КАУТ|ИБУТ|ТДУТ|00УТ)-\d+', order_text)
-                order_code = order_code_match.group(0) if order_code_match else ""
-                # Normalize worker name for consistent key matching
-                worker = normalize_worker_name(str(record.get("worker", "")), name_map).replace(" (оплата клиентом)", "")
-                key = order_code + "_" + worker
-
+            filtered_keys = []
+            for record, key in zip(modified_records, record_keys):
                 if key not in added_to_skip:
                     filtered_records.append(record)
+                    filtered_keys.append(key)
                 else:
                     if DEBUG_MODE: logger.debug(f"   ⏭️ Skipping: {key}")
             modified_records = filtered_records
-        
-        # Update session with modified records
-        session["combined"] = modified_records
-        session["review_applied"] = True
-        session_data[session_id] = session
+            record_keys = filtered_keys
         
         # Process manager comment selections
-        # manager_comment_selections is a dict: {order_key: true/false}
-        # where true = apply manager's payment, false = use standard calculation
-        manager_selections = selections.get("manager_comments", {})
         applied_manager_comments = {}  # Track which orders have manager overrides
         
-        if manager_selections:
-            for record in modified_records:
-                order_text = str(record.get("order", ""))
-                order_code_match = re.search(r'(КАУТ|ИБУТ|ТДУТ|00УТ)-\d+', order_text)
-                order_code = order_code_match.group(0) if order_code_match else ""
-                worker = normalize_worker_name(str(record.get("worker", "")), name_map).replace(" (оплата клиентом)", "")
-                key = order_code + "_" + worker
-                
-                if key in manager_selections and manager_selections[key]:
+        if manager_keys:
+            for record, key in zip(modified_records, record_keys):
+                if key in manager_keys:
                     # Apply manager comment
                     parsed = record.get("manager_comment_parsed")
                     if parsed:
@@ -1299,6 +1626,12 @@ async def apply_review_changes(request: Request):
                             }
                             if DEBUG_MODE: logger.debug(f"📝 Applied manager comment for {key}: fixed {parsed['value']}₽")
         
+        # Update session with modified records (after manager overrides, so they
+        # are stored too when sessions live in Redis)
+        session["combined"] = modified_records
+        session["review_applied"] = True
+        await save_upload_session(session_id, session)
+        
         # Now proceed with calculation (similar to /calculate endpoint)
         # Use default config and calculate
         config = DEFAULT_CONFIG.copy()
@@ -1306,21 +1639,19 @@ async def apply_review_changes(request: Request):
         # Add Yandex Fuel data to config
         yandex_fuel = session.get("yandex_fuel", {})
         config["yandex_fuel"] = yandex_fuel
-        logger.info(f"💾 /api/apply-review: yandex_fuel from session: {list(yandex_fuel.keys()) if yandex_fuel else 'EMPTY'}")
+        if DEBUG_MODE: logger.debug(f"💾 /api/apply-review: yandex_fuel from session: {list(yandex_fuel.keys()) if yandex_fuel else 'EMPTY'}")
         
         name_map = session.get("name_map", {})
         
-        calculated_data = []
-        for row in modified_records:
-            calc_row = await calculate_row(row, config, {})
-
+        calculated_data = await calculate_rows(modified_records, config, {})
+        for row, calc_row in zip(modified_records, calculated_data):
             # For reverted records, restore the old calculation values (including manual edits)
             # This implements "Вариант B" - keeping old version values
             if row.get("is_reverted") and "_old_calc_total" in row:
                 calc_row["total"] = row["_old_calc_total"]
                 calc_row["fuel_payment"] = row.get("_old_calc_fuel", 0)
                 calc_row["transport"] = row.get("_old_calc_transport", 0)
-                logger.info(f"✅ Restored old calc values for {row.get('order', '')[:30]}: total={calc_row['total']}")
+                if DEBUG_MODE: logger.debug(f"✅ Restored old calc values for {row.get('order', '')[:30]}: total={calc_row['total']}")
 
             # For restored records (deleted items brought back), preserve their saved total/fuel/transport
             # This is critical for extra rows like "Переплата" which have no service_payment
@@ -1331,177 +1662,32 @@ async def apply_review_changes(request: Request):
                     calc_row["fuel_payment"] = row["fuel_payment"]
                 if row.get("transport", 0) != 0:
                     calc_row["transport"] = row["transport"]
-                logger.info(f"✅ Preserved restored row values for {row.get('order', '')[:40]}: total={calc_row['total']}")
-
-            calculated_data.append(calc_row)
+                if DEBUG_MODE: logger.debug(f"✅ Preserved restored row values for {row.get('order', '')[:40]}: total={calc_row['total']}")
         
-        calculated_data.sort(key=lambda x: normalize_worker_name(x.get("worker", ""), name_map).replace(" (оплата клиентом)", ""))
+        _sort_rows_by_worker(calculated_data, name_map)
         
         # Save to database
         period = session["period"]
-        period_id = await get_or_create_period(period)
-        upload_id = await create_upload(period_id, config)
+        # All writes of this upload in one transaction (single commit)
+        async with upload_transaction():
+            period_id = await get_or_create_period(period)
+            upload_id = await create_upload(period_id, config)
         
-        # First pass: save all orders and collect totals
-        worker_totals = {}
+            await _save_calculated_rows(upload_id, calculated_data, config, period)
         
-        for row in calculated_data:
-            worker = row.get("worker", "")
-            if not worker or pd.isna(worker):
-                continue
-            
-            is_worker_total = row.get("is_worker_total", False)
-            
-            # Skip worker total rows - we'll calculate totals from orders
-            if is_worker_total:
-                continue
-            
-            # Save individual order
-            order_text = str(row.get("order", ""))
-
-            # Use order_code from record if exists (for restored extra rows)
-            # Otherwise extract from order text
-            order_code = row.get("order_code", "")
-            if not order_code:
-                match = re.search(r'(КАУТ|ИБУТ|ТДУТ|00УТ)-\d+', order_text)
-                if match:
-                    order_code = match.group(0)
-
-
-            # Extract order date from text (format: "КАУТ-001904, 21.12.2025, ...")
-            order_date = None
-            date_match = re.search(r'(\d{2})\.(\d{2})\.(\d{4})', order_text)
-            if date_match:
-                try:
-                    day, month, year = date_match.groups()
-                    order_date = datetime(int(year), int(month), int(day))
-                except ValueError:
-                    pass  # Invalid date
-            # Use address from record if exists (for restored rows)
-            # Otherwise extract from order text
-            address = row.get("address", "")
-            if not address and ", " in order_text:
-                parts = order_text.split(", ", 1)
-                if len(parts) > 1:
-                    address = parts[1].split("\n")[0][:100]
-            
-            base_worker = worker.replace(" (оплата клиентом)", "")
-            # Check is_client_payment from record first, then from worker name
-            is_client = row.get("is_client_payment", False) or "(оплата клиентом)" in worker
-            is_extra = row.get("is_extra_row", False)
-            
-            order_data = {
-                "worker": base_worker,
-                "order_code": order_code,
-                "order": order_text[:500],
-                "order_date": order_date,
-                "address": address,
-                "is_client_payment": is_client,
-                "days_on_site": row.get("days_on_site", None),
-                "is_extra_row": is_extra,
-                "revenue_total": float(row.get("revenue_total", 0) or 0),
-                "revenue_services": float(row.get("revenue_services", 0) or 0),
-                "diagnostic": float(row.get("diagnostic", 0) or 0),
-                "diagnostic_payment": float(row.get("diagnostic_payment", 0) or 0),
-                "specialist_fee": float(row.get("specialist_fee", 0) or 0),
-                "additional_expenses": float(row.get("additional_expenses", 0) or 0),
-                "service_payment": float(row.get("service_payment", 0) or 0),
-                "percent": parse_percent(row.get("percent", 0)),
-                "manager_comment": row.get("manager_comment", None)
-            }
-            order_id = await save_order(upload_id, order_data)
-            
-            # Save calculation for this order
-            total_val = float(row.get("total", 0) or 0)
-            calc_data = {
-                "worker": base_worker,
-                "fuel_payment": float(row.get("fuel_payment", 0) or 0),
-                "transport": float(row.get("transport", 0) or 0),
-                "diagnostic_50": float(row.get("diagnostic_50", 0) or 0),
-                "total": total_val
-            }
-            await save_calculation(upload_id, order_id, calc_data)
-            
-            # Accumulate totals per worker
-            if base_worker not in worker_totals:
-                worker_totals[base_worker] = {"company": 0, "client": 0, "company_count": 0, "client_count": 0}
-
-            if is_client:
-                worker_totals[base_worker]["client"] += total_val
-                worker_totals[base_worker]["client_count"] += 1
-            else:
-                worker_totals[base_worker]["company"] += total_val
-                worker_totals[base_worker]["company_count"] += 1
-
-        # Save worker totals
-        for worker, totals in worker_totals.items():
-            await save_worker_total(
-                upload_id=upload_id,
-                worker=worker,
-                total=totals["company"] + totals["client"],
-                orders_count=totals["company_count"] + totals["client_count"],
-                fuel=0,
-                transport=0,
-                company_amount=totals["company"],
-                client_amount=totals["client"],
-                company_orders_count=totals["company_count"],
-                client_orders_count=totals["client_count"]
-            )
+            prev_upload_id = await get_previous_upload(period_id, upload_id)
         
-        # Save Yandex fuel deductions as manual edits (for history tracking)
-        yandex_fuel = config.get("yandex_fuel", {})
-        if yandex_fuel:
-            from database import save_manual_edit
-            for worker, deduction in yandex_fuel.items():
-                if deduction and deduction > 0:
-                    # Get period name for the order_code field
-                    period_name = session.get("period", "")
-                    # Determine month from period (e.g., "01-15.12.25" -> "Декабрь")
-                    month_names = {
-                        "01": "Январь", "02": "Февраль", "03": "Март", "04": "Апрель",
-                        "05": "Май", "06": "Июнь", "07": "Июль", "08": "Август",
-                        "09": "Сентябрь", "10": "Октябрь", "11": "Ноябрь", "12": "Декабрь"
-                    }
-                    month_num = period_name.split(".")[-2] if "." in period_name else ""
-                    month_name = month_names.get(month_num, "")
-                    
-                    await save_manual_edit(
-                        upload_id=upload_id,
-                        order_id=None,
-                        calculation_id=None,
-                        order_code=f"Вычет Яндекс заправки ({month_name})",
-                        worker=worker,
-                        address="",
-                        field_name="YANDEX_FUEL",
-                        old_value=deduction,
-                        new_value=-deduction,
-                        period_status="DRAFT"
-                    )
-                    if DEBUG_MODE: logger.debug(f"⛽ Saved Yandex fuel deduction for {worker}: -{deduction}₽")
+        # The period may be new and become the latest one
+        invalidate_period_permissions()
         
-        # Compare with previous upload and save changes
-        prev_upload_id = await get_previous_upload(period_id, upload_id)
+        # Compare with previous upload and save changes after the response
         if prev_upload_id:
-            changes_dict = await compare_uploads(prev_upload_id, upload_id)
-            # Process added orders
-            for change in changes_dict.get("added", []):
-                await save_change(upload_id, change.get("order_code"), change.get("worker"), "added")
-            # Process deleted orders
-            for change in changes_dict.get("deleted", []):
-                await save_change(upload_id, change.get("order_code"), change.get("worker"), "deleted")
-            # Process modified orders
-            for change in changes_dict.get("modified", []):
-                for field_change in change.get("changes", []):
-                    await save_change(
-                        upload_id, change.get("order_code"), change.get("worker"), 
-                        "modified", field_change.get("field"),
-                        str(field_change.get("old", "")), str(field_change.get("new", ""))
-                    )
+            background_tasks.add_task(_save_upload_changes, prev_upload_id, upload_id)
         
         # Cleanup session
-        del session_data[session_id]
+        await delete_upload_session(session_id)
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "period_id": period_id,
             "upload_id": upload_id
@@ -1510,7 +1696,7 @@ async def apply_review_changes(request: Request):
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return JSONResponse({"success": False, "error": str(e)})
+        return ORJSONResponse({"success": False, "error": str(e)})
 
 
 @app.post("/api/process-first-upload")
@@ -1520,173 +1706,39 @@ async def process_first_upload(request: Request):
         data = await request.json()
         session_id = data.get("session_id")
         
-        if session_id not in session_data:
-            return JSONResponse({"success": False, "error": "Сессия истекла"})
-        
-        session = session_data[session_id]
-        combined_records = session.get("combined", [])
+        session = await get_upload_session(session_id)
+        if session is None:
+            return ORJSONResponse({"success": False, "error": "Сессия истекла"})
+        combined_records = get_session_records(session)
         
         # Use default config and add yandex_fuel
         config = DEFAULT_CONFIG.copy()
         yandex_fuel = session.get("yandex_fuel", {})
         config["yandex_fuel"] = yandex_fuel
-        logger.info(f"💾 /api/process-first-upload: yandex_fuel from session: {list(yandex_fuel.keys()) if yandex_fuel else 'EMPTY'}")
+        if DEBUG_MODE: logger.debug(f"💾 /api/process-first-upload: yandex_fuel from session: {list(yandex_fuel.keys()) if yandex_fuel else 'EMPTY'}")
         
         name_map = session.get("name_map", {})
         
-        calculated_data = []
-        for row in combined_records:
-            calc_row = await calculate_row(row, config, {})
-            calculated_data.append(calc_row)
+        calculated_data = await calculate_rows(combined_records, config, {})
         
-        calculated_data.sort(key=lambda x: normalize_worker_name(x.get("worker", ""), name_map).replace(" (оплата клиентом)", ""))
+        _sort_rows_by_worker(calculated_data, name_map)
         
         # Save to database
         period = session["period"]
-        period_id = await get_or_create_period(period)
-        upload_id = await create_upload(period_id, config)
+        # All writes of this upload in one transaction (single commit)
+        async with upload_transaction():
+            period_id = await get_or_create_period(period)
+            upload_id = await create_upload(period_id, config)
         
-        # First pass: save all orders and collect totals
-        worker_totals = {}
+            await _save_calculated_rows(upload_id, calculated_data, config, period)
         
-        for row in calculated_data:
-            worker = row.get("worker", "")
-            if not worker or pd.isna(worker):
-                continue
-            
-            is_worker_total = row.get("is_worker_total", False)
-            
-            # Skip worker total rows - we'll calculate totals from orders
-            if is_worker_total:
-                continue
-            
-            # Save individual order
-            order_text = str(row.get("order", ""))
-
-            # Use order_code from record if exists (for restored extra rows)
-            # Otherwise extract from order text
-            order_code = row.get("order_code", "")
-            if not order_code:
-                match = re.search(r'(КАУТ|ИБУТ|ТДУТ|00УТ)-\d+', order_text)
-                if match:
-                    order_code = match.group(0)
-
-
-            # Extract order date from text (format: "КАУТ-001904, 21.12.2025, ...")
-            order_date = None
-            date_match = re.search(r'(\d{2})\.(\d{2})\.(\d{4})', order_text)
-            if date_match:
-                try:
-                    day, month, year = date_match.groups()
-                    order_date = datetime(int(year), int(month), int(day))
-                except ValueError:
-                    pass  # Invalid date
-            # Use address from record if exists (for restored rows)
-            # Otherwise extract from order text
-            address = row.get("address", "")
-            if not address and ", " in order_text:
-                parts = order_text.split(", ", 1)
-                if len(parts) > 1:
-                    address = parts[1].split("\n")[0][:100]
-            
-            base_worker = worker.replace(" (оплата клиентом)", "")
-            # Check is_client_payment from record first, then from worker name
-            is_client = row.get("is_client_payment", False) or "(оплата клиентом)" in worker
-            is_extra = row.get("is_extra_row", False)
-            
-            order_data = {
-                "worker": base_worker,
-                "order_code": order_code,
-                "order": order_text[:500],
-                "order_date": order_date,
-                "address": address,
-                "is_client_payment": is_client,
-                "days_on_site": row.get("days_on_site", None),
-                "is_extra_row": is_extra,
-                "revenue_total": float(row.get("revenue_total", 0) or 0),
-                "revenue_services": float(row.get("revenue_services", 0) or 0),
-                "diagnostic": float(row.get("diagnostic", 0) or 0),
-                "diagnostic_payment": float(row.get("diagnostic_payment", 0) or 0),
-                "specialist_fee": float(row.get("specialist_fee", 0) or 0),
-                "additional_expenses": float(row.get("additional_expenses", 0) or 0),
-                "service_payment": float(row.get("service_payment", 0) or 0),
-                "percent": parse_percent(row.get("percent", 0)),
-                "manager_comment": row.get("manager_comment", None)
-            }
-            order_id = await save_order(upload_id, order_data)
-            
-            # Save calculation for this order
-            total_val = float(row.get("total", 0) or 0)
-            calc_data = {
-                "worker": base_worker,
-                "fuel_payment": float(row.get("fuel_payment", 0) or 0),
-                "transport": float(row.get("transport", 0) or 0),
-                "diagnostic_50": float(row.get("diagnostic_50", 0) or 0),
-                "total": total_val
-            }
-            await save_calculation(upload_id, order_id, calc_data)
-            
-            # Accumulate totals per worker
-            if base_worker not in worker_totals:
-                worker_totals[base_worker] = {"company": 0, "client": 0, "company_count": 0, "client_count": 0}
-
-            if is_client:
-                worker_totals[base_worker]["client"] += total_val
-                worker_totals[base_worker]["client_count"] += 1
-            else:
-                worker_totals[base_worker]["company"] += total_val
-                worker_totals[base_worker]["company_count"] += 1
-
-        # Save worker totals
-        for worker, totals in worker_totals.items():
-            await save_worker_total(
-                upload_id=upload_id,
-                worker=worker,
-                total=totals["company"] + totals["client"],
-                orders_count=totals["company_count"] + totals["client_count"],
-                fuel=0,
-                transport=0,
-                company_amount=totals["company"],
-                client_amount=totals["client"],
-                company_orders_count=totals["company_count"],
-                client_orders_count=totals["client_count"]
-            )
-        
-        # Save Yandex fuel deductions as manual edits (for history tracking)
-        yandex_fuel = config.get("yandex_fuel", {})
-        if yandex_fuel:
-            from database import save_manual_edit
-            for worker, deduction in yandex_fuel.items():
-                if deduction and deduction > 0:
-                    # Get period name for the order_code field
-                    period_name = session.get("period", "")
-                    # Determine month from period (e.g., "01-15.12.25" -> "Декабрь")
-                    month_names = {
-                        "01": "Январь", "02": "Февраль", "03": "Март", "04": "Апрель",
-                        "05": "Май", "06": "Июнь", "07": "Июль", "08": "Август",
-                        "09": "Сентябрь", "10": "Октябрь", "11": "Ноябрь", "12": "Декабрь"
-                    }
-                    month_num = period_name.split(".")[-2] if "." in period_name else ""
-                    month_name = month_names.get(month_num, "")
-                    
-                    await save_manual_edit(
-                        upload_id=upload_id,
-                        order_id=None,
-                        calculation_id=None,
-                        order_code=f"Вычет Яндекс заправки ({month_name})",
-                        worker=worker,
-                        address="",
-                        field_name="YANDEX_FUEL",
-                        old_value=deduction,
-                        new_value=-deduction,
-                        period_status="DRAFT"
-                    )
-                    if DEBUG_MODE: logger.debug(f"⛽ Saved Yandex fuel deduction for {worker}: -{deduction}₽")
+        # The period may be new and become the latest one
+        invalidate_period_permissions()
         
         # Cleanup session
-        del session_data[session_id]
+        await delete_upload_session(session_id)
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "period_id": period_id,
             "upload_id": upload_id
@@ -1695,7 +1747,7 @@ async def process_first_upload(request: Request):
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return JSONResponse({"success": False, "error": str(e)})
+        return ORJSONResponse({"success": False, "error": str(e)})
 
 
 @app.post("/preview")
@@ -1707,10 +1759,9 @@ async def preview_calculation(
 ):
     """Preview calculation without saving to database"""
     try:
-        if session_id not in session_data:
+        session = await get_upload_session(session_id)
+        if session is None:
             raise HTTPException(status_code=400, detail="Session expired")
-        
-        session = session_data[session_id]
         config = json.loads(config_json)
         days_map = json.loads(days_json)
         extra_rows = json.loads(extra_rows_json)
@@ -1722,10 +1773,7 @@ async def preview_calculation(
         yandex_fuel = session.get("yandex_fuel", {})
         full_config["yandex_fuel"] = yandex_fuel
         
-        calculated_data = []
-        for row in session["combined"]:
-            calc_row = await calculate_row(row, full_config, days_map)
-            calculated_data.append(calc_row)
+        calculated_data = await calculate_rows(get_session_records(session), full_config, days_map)
         
         for worker, rows in extra_rows.items():
             for extra in rows:
@@ -1751,14 +1799,14 @@ async def preview_calculation(
                     "total": float(extra.get("amount", 0))
                 })
         
-        calculated_data.sort(key=lambda x: normalize_worker_name(x.get("worker", ""), name_map).replace(" (оплата клиентом)", ""))
+        _sort_rows_by_worker(calculated_data, name_map)
         
         # Generate unique IDs for each row for deletion
         preview_rows = []
         for idx, row in enumerate(calculated_data):
             order_code = ""
             order_text = row.get("order", "")
-            match = re.search(r'((?:КАУТ|ИБУТ|ТДУТ)-\d+)', order_text)
+            match = ORDER_CODE_RE.search(order_text)
             if match:
                 order_code = match.group(1)
             
@@ -1787,6 +1835,7 @@ async def preview_calculation(
         # Store calculated data in session for later finalization
         session["calculated_data"] = calculated_data
         session["config"] = full_config
+        await save_upload_session(session_id, session)
         
         # Group by worker for summary
         workers_summary = {}
@@ -1812,7 +1861,7 @@ async def preview_calculation(
         
         alarms = generate_alarms(calculated_data, full_config)
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "rows": preview_rows,
             "workers_summary": workers_summary,
@@ -1828,6 +1877,7 @@ async def preview_calculation(
 
 @app.post("/calculate")
 async def calculate_salaries(
+    background_tasks: BackgroundTasks,
     session_id: str = Form(...),
     config_json: str = Form(...),
     days_json: str = Form(...),
@@ -1836,10 +1886,9 @@ async def calculate_salaries(
 ):
     """Calculate all salaries and generate files"""
     try:
-        if session_id not in session_data:
+        session = await get_upload_session(session_id)
+        if session is None:
             raise HTTPException(status_code=400, detail="Session expired")
-        
-        session = session_data[session_id]
         deleted_rows_raw = json.loads(deleted_rows_json)
         deleted_rows = set(int(x) for x in deleted_rows_raw)
         
@@ -1877,10 +1926,7 @@ async def calculate_salaries(
             yandex_fuel = session.get("yandex_fuel", {})
             full_config["yandex_fuel"] = yandex_fuel
             
-            calculated_data = []
-            for idx, row in enumerate(session["combined"]):
-                calc_row = await calculate_row(row, full_config, days_map)
-                calculated_data.append(calc_row)
+            calculated_data = await calculate_rows(get_session_records(session), full_config, days_map)
             
             for worker, rows in extra_rows.items():
                 for extra in rows:
@@ -1907,7 +1953,7 @@ async def calculate_salaries(
             
             # Sort same as preview
             name_map = session.get("name_map", {})
-            calculated_data.sort(key=lambda x: normalize_worker_name(x.get("worker", ""), name_map).replace(" (оплата клиентом)", ""))
+            _sort_rows_by_worker(calculated_data, name_map)
             
             # Now filter deleted
             calculated_data = [row for idx, row in enumerate(calculated_data) if idx not in deleted_rows]
@@ -1917,198 +1963,129 @@ async def calculate_salaries(
         period = session["period"]
         workers = session["workers"]
         
-        # Archive 1: Full reports (for accounting)
-        zip_full = BytesIO()
-        with zipfile.ZipFile(zip_full, "w", zipfile.ZIP_DEFLATED) as zf:
-            main_report = create_excel_report(calculated_data, period, full_config, for_workers=False)
-            zf.writestr(f"Общий_отчет {period}.xlsx", main_report)
-            
-            for worker in workers:
-                worker_surname = worker.split()[0] if worker else "Unknown"
-                worker_report = create_worker_report(calculated_data, worker, period, full_config, for_workers=False)
-                zf.writestr(f"{worker_surname} {period}.xlsx", worker_report)
-        
-        zip_full.seek(0)
+        # Each workbook is built once: full version is serialized, then stripped for workers.
+        # openpyxl is CPU-bound, so reports are built in worker threads off the event loop.
+        main_full, main_workers = await to_thread.run_sync(create_report_pair, calculated_data, period, full_config)
+        worker_reports = await asyncio.gather(*(
+            to_thread.run_sync(create_worker_report_pair, calculated_data, worker, period, full_config)
+            for worker in workers
+        ))
         
+        # Archive 1: Full reports (for accounting)
         # Archive 2: Simplified reports (for workers - hidden columns)
-        zip_workers = BytesIO()
-        with zipfile.ZipFile(zip_workers, "w", zipfile.ZIP_DEFLATED) as zf:
-            main_report = create_excel_report(calculated_data, period, full_config, for_workers=True)
-            zf.writestr(f"Общий_отчет {period}.xlsx", main_report)
-            
-            for worker in workers:
-                worker_surname = worker.split()[0] if worker else "Unknown"
-                worker_report = create_worker_report(calculated_data, worker, period, full_config, for_workers=True)
-                zf.writestr(f"{worker_surname} {period}.xlsx", worker_report)
-        
-        zip_workers.seek(0)
-        
-        # Save both archives
+        # Written straight to /tmp; xlsx files are already deflated, so they are stored as is
         temp_path_full = f"/tmp/salary_report_{session_id}_full.zip"
         temp_path_workers = f"/tmp/salary_report_{session_id}_workers.zip"
         
-        with open(temp_path_full, "wb") as f:
-            f.write(zip_full.getvalue())
-        
-        with open(temp_path_workers, "wb") as f:
-            f.write(zip_workers.getvalue())
+        with zipfile.ZipFile(temp_path_full, "w", zipfile.ZIP_STORED) as zf_full, \
+                zipfile.ZipFile(temp_path_workers, "w", zipfile.ZIP_STORED) as zf_workers:
+            zf_full.writestr(f"Общий_отчет {period}.xlsx", main_full)
+            zf_workers.writestr(f"Общий_отчет {period}.xlsx", main_workers)
+            
+            for worker, (worker_full, worker_workers) in zip(workers, worker_reports):
+                worker_surname = worker.split()[0] if worker else "Unknown"
+                zf_full.writestr(f"{worker_surname} {period}.xlsx", worker_full)
+                zf_workers.writestr(f"{worker_surname} {period}.xlsx", worker_workers)
         
-        session_data[session_id]["alarms"] = alarms
+        await update_upload_session(session_id, alarms=alarms)
         
         # ===== SAVE TO DATABASE =====
         try:
             if database:
-                # Debug: check yandex_fuel before saving
-                yf = full_config.get("yandex_fuel", {})
-                logger.info(f"💾 /calculate: yandex_fuel in full_config: {list(yf.keys()) if yf else 'EMPTY'}")
+                # All writes of this upload in one transaction (single commit)
+                async with upload_transaction():
+                    # Debug: check yandex_fuel before saving
+                    if DEBUG_MODE:
+                        yf = full_config.get("yandex_fuel", {})
+                        logger.debug(f"💾 /calculate: yandex_fuel in full_config: {list(yf.keys()) if yf else 'EMPTY'}")
                 
-                # 1. Get or create period
-                period_id = await get_or_create_period(period)
+                    # 1. Get or create period
+                    period_id = await get_or_create_period(period)
                 
-                # 2. Create upload
-                upload_id = await create_upload(period_id, full_config)
+                    # 2. Create upload
+                    upload_id = await create_upload(period_id, full_config)
                 
-                # 3. Check for previous upload and compare
-                prev_upload_id = await get_previous_upload(period_id, 
-                    (await get_period_details(period_id))["uploads"][0]["version"] if (await get_period_details(period_id))["uploads"] else 1
-                )
+                    # 3. Check for previous upload and compare (upload before the new one, as in apply-review)
+                    prev_upload_id = await get_previous_upload(period_id, upload_id)
                 
-                # 4. Save orders and calculations - ONLY for valid workers
-                order_id_map = {}  # To map order to its DB id
-                for row in calculated_data:
-                    # Skip non-worker groups (Доставка, Помощник, etc.)
-                    worker = normalize_worker_name(row.get("worker", "").replace(" (оплата клиентом)", ""))
-                    if not is_valid_worker_name(worker):
-                        continue
-                    
-                    is_extra = row.get("is_extra_row", False)
+                    # 4. Save orders and calculations - ONLY for valid workers
+                    # (one pass: order/calculation pairs and worker totals columns)
+                    order_items = []  # (order_data, calc_data) to save in bulk
+                    totals_columns = {"worker": [], "is_client": [], "total": [], "fuel": [], "transport": []}
+                    for row in calculated_data:
+                        # Skip non-worker groups (Доставка, Помощник, etc.)
+                        worker = base_worker_name(row.get("worker", ""))
+                        if not is_valid_worker_name(worker):
+                            continue
                     
-                    # Extract order code from order text (for regular rows)
-                    order_text = row.get("order", "")
-                    order_code_match = re.search(r'(КАУТ|ИБУТ|ТДУТ|00УТ)-\d+', order_text)
-                    order_code = order_code_match.group(0) if order_code_match else ""
+                        is_extra = row.get("is_extra_row", False)
                     
-                    # For extra rows, use description as order text
-                    if is_extra:
-                        order_code = "ДОПЛАТА"  # Special code for extra rows
-                    
-                    # Save order
-                    order_data = {
-                        "worker": row.get("worker", ""),
-                        "order_code": order_code,
-                        "order": order_text,
-                        "address": extract_address_from_order(order_text) if not is_extra else order_text,
-                        "revenue_total": row.get("revenue_total", 0) if not is_extra else 0,
-                        "days_on_site": row.get("days_on_site", None),
-                        "revenue_services": row.get("revenue_services", 0) if not is_extra else 0,
-                        "diagnostic": row.get("diagnostic", 0) if not is_extra else 0,
-                        "diagnostic_payment": row.get("diagnostic_payment", 0) if not is_extra else 0,
-                        "specialist_fee": row.get("specialist_fee", 0) if not is_extra else 0,
-                        "additional_expenses": row.get("additional_expenses", 0) if not is_extra else 0,
-                        "service_payment": row.get("service_payment", 0) if not is_extra else 0,
-                        "percent": row.get("percent", "") if not is_extra else "",
-                        "is_client_payment": row.get("is_client_payment", False),
-                        "is_over_10k": row.get("is_over_10k", False),
-                        "is_extra_row": is_extra,
-                    }
-                    order_id = await save_order(upload_id, order_data)
-                    order_id_map[order_text] = order_id
-                    
-                    # Save calculation
-                    calc_data = {
-                        "worker": row.get("worker", ""),
-                        "fuel_payment": row.get("fuel_payment", 0) if not is_extra else 0,
-                        "transport": row.get("transport", 0) if not is_extra else 0,
-                        "diagnostic_50": row.get("diagnostic_50", 0) if not is_extra else 0,
-                        "total": row.get("total", 0),
-                    }
-                    await save_calculation(upload_id, order_id, calc_data)
-                
-                # 5. Calculate and save worker totals - ONLY for valid workers
-                worker_totals_dict = {}
-                for row in calculated_data:
-                    worker = normalize_worker_name(row.get("worker", "").replace(" (оплата клиентом)", ""))
+                        # Order code extracted at parse time (_add_order_fields), else from order text
+                        order_text = row.get("order", "")
+                        order_code = row.get("order_code")
+                        if not order_code:
+                            order_code_match = ORDER_CODE_RE.search(str(order_text))
+                            order_code = order_code_match.group(0) if order_code_match else ""
                     
-                    # Skip non-worker groups (Доставка, Помощник, etc.)
-                    if not is_valid_worker_name(worker):
-                        continue
+                        # For extra rows, use description as order text
+                        if is_extra:
+                            order_code = "ДОПЛАТА"  # Special code for extra rows
                     
-                    if worker not in worker_totals_dict:
-                        worker_totals_dict[worker] = {
-                            "total": 0,
-                            "company_total": 0,
-                            "client_total": 0,
-                            "count": 0,
-                            "company_count": 0,
-                            "client_count": 0,
-                            "fuel": 0,
-                            "transport": 0
+                        # Save order
+                        order_data = {
+                            "worker": row.get("worker", ""),
+                            "order_code": order_code,
+                            "order": order_text,
+                            "address": extract_address_from_order(order_text) if not is_extra else order_text,
+                            "revenue_total": row.get("revenue_total", 0) if not is_extra else 0,
+                            "days_on_site": row.get("days_on_site", None),
+                            "revenue_services": row.get("revenue_services", 0) if not is_extra else 0,
+                            "diagnostic": row.get("diagnostic", 0) if not is_extra else 0,
+                            "diagnostic_payment": row.get("diagnostic_payment", 0) if not is_extra else 0,
+                            "specialist_fee": row.get("specialist_fee", 0) if not is_extra else 0,
+                            "additional_expenses": row.get("additional_expenses", 0) if not is_extra else 0,
+                            "service_payment": row.get("service_payment", 0) if not is_extra else 0,
+                            "percent": row.get("percent", "") if not is_extra else "",
+                            "is_client_payment": row.get("is_client_payment", False),
+                            "is_over_10k": row.get("is_over_10k", False),
+                            "is_extra_row": is_extra,
                         }
                     
-                    total = row.get("total", 0)
-                    is_client = row.get("is_client_payment", False)
-                    
-                    if isinstance(total, (int, float)):
-                        worker_totals_dict[worker]["total"] += total
-                        if is_client:
-                            worker_totals_dict[worker]["client_total"] += total
-                            worker_totals_dict[worker]["client_count"] += 1
-                        else:
-                            worker_totals_dict[worker]["company_total"] += total
-                            worker_totals_dict[worker]["company_count"] += 1
-                    
-                    worker_totals_dict[worker]["count"] += 1
-                    
-                    fuel = row.get("fuel_payment", 0)
-                    if isinstance(fuel, (int, float)):
-                        worker_totals_dict[worker]["fuel"] += fuel
+                        # Calculation
+                        calc_data = {
+                            "worker": row.get("worker", ""),
+                            "fuel_payment": row.get("fuel_payment", 0) if not is_extra else 0,
+                            "transport": row.get("transport", 0) if not is_extra else 0,
+                            "diagnostic_50": row.get("diagnostic_50", 0) if not is_extra else 0,
+                            "total": row.get("total", 0),
+                        }
+                        order_items.append((order_data, calc_data))
                     
-                    transport = row.get("transport", 0)
-                    if isinstance(transport, (int, float)):
-                        worker_totals_dict[worker]["transport"] += transport
+                        totals_columns["worker"].append(worker)
+                        totals_columns["is_client"].append(bool(row.get("is_client_payment", False)))
+                        totals_columns["total"].append(row.get("total", 0))
+                        totals_columns["fuel"].append(row.get("fuel_payment", 0))
+                        totals_columns["transport"].append(row.get("transport", 0))
                 
-                for worker, totals in worker_totals_dict.items():
-                    await save_worker_total(
-                        upload_id, 
-                        worker, 
-                        totals["total"],
-                        totals["count"],
-                        totals["fuel"],
-                        totals["transport"],
-                        totals["company_total"],
-                        totals["client_total"],
-                        totals["company_count"],
-                        totals["client_count"]
-                    )
+                    # Orders and calculations in one bulk write
+                    await bulk_save_orders(upload_id, order_items)
                 
-                # 6. Compare with previous upload if exists
+                    # 5. Calculate and save worker totals - ONLY for valid workers
+                    await bulk_save_worker_totals(upload_id, _aggregate_worker_totals(pd.DataFrame(totals_columns)))
+                
+                # The period may be new and become the latest one
+                invalidate_period_permissions()
+                
+                # 6. Compare with previous upload if exists (after the response)
                 if prev_upload_id:
-                    changes_dict = await compare_uploads(prev_upload_id, upload_id)
-                    # Process added orders
-                    for change in changes_dict.get("added", []):
-                        await save_change(upload_id, change.get("order_code"), change.get("worker"), "added")
-                    # Process deleted orders
-                    for change in changes_dict.get("deleted", []):
-                        await save_change(upload_id, change.get("order_code"), change.get("worker"), "deleted")
-                    # Process modified orders
-                    for change in changes_dict.get("modified", []):
-                        for field_change in change.get("changes", []):
-                            await save_change(
-                                upload_id, 
-                                change.get("order_code"), 
-                                change.get("worker"), 
-                                "modified",
-                                field_change.get("field"),
-                                str(field_change.get("old", "")),
-                                str(field_change.get("new", ""))
-                            )
+                    background_tasks.add_task(_save_upload_changes, prev_upload_id, upload_id)
                 
                 logger.info(f"✅ Saved to database: period={period}, upload_id={upload_id}")
         except Exception as db_error:
             logger.warning(f"⚠️ Database save error (non-critical): {db_error}")
             # Don't fail the request if DB save fails
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "download_url_full": f"/download/{session_id}/full",
             "download_url_workers": f"/download/{session_id}/workers",
@@ -2133,7 +2110,8 @@ async def download_report(session_id: str, archive_type: str):
     if not os.path.exists(temp_path):
         raise HTTPException(status_code=404, detail="File not found")
     
-    period = session_data.get(session_id, {}).get("period", "report")
+    session = await get_upload_session(session_id)
+    period = (session or {}).get("period", "report")
     
     if archive_type == "full":
         filename = f"Зарплата_{period}.zip"
@@ -2166,27 +2144,16 @@ async def api_get_periods():
     """Get all periods grouped by month"""
     try:
         periods = await get_all_periods()
+        latest_totals = await get_latest_upload_totals()
         
         # Enrich periods with total_amount and latest_upload_id
         enriched_periods = []
         for p in periods:
-            period_details = await get_period_details(p["id"])
-            total_amount = 0
-            company_amount = 0
-            client_amount = 0
-            latest_upload_id = None
-            
-            if period_details and period_details.get("uploads"):
-                latest_upload = period_details["uploads"][0]
-                latest_upload_id = latest_upload["id"]
-                
-                upload_details = await get_upload_details(latest_upload_id)
-                if upload_details:
-                    worker_totals = upload_details.get("worker_totals", [])
-                    for wt in worker_totals:
-                        company_amount += wt.get("company_amount", 0) or 0
-                        client_amount += wt.get("client_amount", 0) or 0
-                    total_amount = company_amount + client_amount
+            latest = latest_totals.get(p["id"])
+            latest_upload_id = latest["upload_id"] if latest else None
+            company_amount = latest["company_amount"] if latest else 0
+            client_amount = latest["client_amount"] if latest else 0
+            total_amount = company_amount + client_amount
             
             # Convert datetime fields to strings for JSON serialization
             created_at = p.get("created_at")
@@ -2220,14 +2187,14 @@ async def api_get_periods():
                 }
             months[month_key]["periods"].append(p)
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "months": list(months.values())
         })
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return JSONResponse({"success": False, "error": str(e)})
+        return ORJSONResponse({"success": False, "error": str(e)})
 
 
 @app.get("/api/period/{period_id}")
@@ -2250,14 +2217,14 @@ async def api_get_period(period_id: int):
         
         serialized = serialize_datetime(details)
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "data": serialized
         })
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return JSONResponse({"success": False, "error": str(e)})
+        return ORJSONResponse({"success": False, "error": str(e)})
 
 
 @app.get("/api/upload/{upload_id}")
@@ -2280,14 +2247,14 @@ async def api_get_upload(upload_id: int):
         
         serialized = serialize_datetime(details)
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "data": serialized
         })
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return JSONResponse({"success": False, "error": str(e)})
+        return ORJSONResponse({"success": False, "error": str(e)})
 
 
 @app.get("/api/upload/{upload_id}/worker/{worker}")
@@ -2311,7 +2278,7 @@ async def api_get_worker_orders(upload_id: int, worker: str):
                 worker_total = wt
                 break
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "data": {
                 "worker": worker_decoded,
@@ -2322,7 +2289,7 @@ async def api_get_worker_orders(upload_id: int, worker: str):
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return JSONResponse({"success": False, "error": str(e)})
+        return ORJSONResponse({"success": False, "error": str(e)})
 
 
 @app.get("/api/worker-report/{upload_id}/{worker}")
@@ -2349,43 +2316,12 @@ async def api_worker_report(upload_id: int, worker: str):
             saved_config = json.loads(saved_config)
         report_config = {**DEFAULT_CONFIG, **saved_config}
         
-        # Get ALL orders for this upload (needed for proper report generation)
+        # ALL orders of workers with totals (needed for proper report generation),
+        # already loaded with calculations by get_upload_details
         worker_totals_list = upload_details.get("worker_totals", [])
         
-        all_orders = []
-        for wt in worker_totals_list:
-            worker_orders = await get_worker_orders(upload_id, wt["worker"])
-            all_orders.extend(worker_orders)
-            worker_orders_client = await get_worker_orders(upload_id, f"{wt['worker']} (оплата клиентом)")
-            all_orders.extend(worker_orders_client)
-        
         # Build calculated_data structure (same as archive generation)
-        calculated_data = []
-        for order in all_orders:
-            # Values from calculations table (already in order from JOIN)
-            row = {
-                "worker": order["worker"],
-                "order": order.get("order_full", "") or order.get("address", ""),
-                "order_code": order.get("order_code", ""),
-                "address": order.get("address", ""),
-                "revenue_total": order.get("revenue_total", 0),
-                "revenue_services": order.get("revenue_services", 0),
-                "diagnostic": order.get("diagnostic", 0),
-                "diagnostic_payment": order.get("diagnostic_payment", 0),
-                "specialist_fee": order.get("specialist_fee", 0),
-                "additional_expenses": order.get("additional_expenses", 0),
-                "service_payment": order.get("service_payment", 0),
-                "percent": order.get("percent", ""),
-                "is_client_payment": order.get("is_client_payment", False),
-                "is_over_10k": order.get("is_over_10k", False),
-                "is_extra_row": order.get("is_extra_row", False),
-                # Values from calculations table (already in order from JOIN)
-                "fuel_payment": order.get("fuel_payment", 0) or 0,
-                "transport": order.get("transport", 0) or 0,
-                "diagnostic_50": order.get("diagnostic_50", 0) or 0,
-                "total": order.get("total", 0) or 0,
-            }
-            calculated_data.append(row)
+        calculated_data = _report_rows_from_orders(upload_details, worker_totals_list)
         
         # Generate worker report using same function as archive
         report_bytes = create_worker_report(calculated_data, worker_decoded, period_name, report_config, for_workers=True)
@@ -2414,43 +2350,47 @@ async def api_months_summary():
     """Get summary by months for dashboard"""
     try:
         summary = await get_months_summary()
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "summary": summary
         })
     except Exception as e:
-        return JSONResponse({"success": False, "error": str(e)})
+        return ORJSONResponse({"success": False, "error": str(e)})
+
+
+async def _comparison_periods() -> tuple:
+    """Periods with worker totals of their latest upload (periods without uploads skipped).
+    Returns (periods_with_totals, all_workers)
+    """
+    periods = await get_all_periods()
+    latest_worker_totals = await get_latest_worker_totals()
+    
+    all_workers = set()
+    periods_with_totals = []
+    for period in periods:
+        worker_totals = latest_worker_totals.get(period["id"])
+        if worker_totals is None:
+            continue
+        all_workers.update(wt["worker"] for wt in worker_totals)
+        periods_with_totals.append({
+            "id": period["id"],
+            "name": period["name"],
+            "month": period["month"],
+            "worker_totals": worker_totals
+        })
+    return periods_with_totals, all_workers
 
 
 @app.get("/api/comparison")
 async def api_comparison():
     """Get comparison data for all periods and workers"""
     try:
-        periods = await get_all_periods()
-        
         # Get all unique workers and worker totals for each period
-        all_workers = set()
-        periods_with_totals = []
-        
-        for period in periods:
-            period_details = await get_period_details(period["id"])
-            if period_details and period_details.get("uploads"):
-                latest_upload = period_details["uploads"][0]
-                upload_details = await get_upload_details(latest_upload["id"])
-                
-                worker_totals = upload_details.get("worker_totals", [])
-                for wt in worker_totals:
-                    all_workers.add(wt["worker"])
-                
-                periods_with_totals.append({
-                    "id": period["id"],
-                    "name": period["name"],
-                    "month": period["month"],
-                    "worker_totals": worker_totals
-                })
+        periods_with_totals, all_workers = await _comparison_periods()
         
         # Group by months
         months_map = {}
+        month_workers = {}  # month -> {worker: entry in months_map worker_totals}
         for p in periods_with_totals:
             month = p["month"]
             if month not in months_map:
@@ -2458,24 +2398,27 @@ async def api_comparison():
                     "month": month,
                     "worker_totals": []
                 }
+                month_workers[month] = {}
             # Aggregate worker totals by month
             for wt in p["worker_totals"]:
-                existing = next((w for w in months_map[month]["worker_totals"] if w["worker"] == wt["worker"]), None)
+                existing = month_workers[month].get(wt["worker"])
                 if existing:
                     existing["total_amount"] = existing.get("total_amount", 0) + wt.get("total_amount", 0)
                     existing["company_amount"] = existing.get("company_amount", 0) + wt.get("company_amount", 0)
                     existing["client_amount"] = existing.get("client_amount", 0) + wt.get("client_amount", 0)
                 else:
-                    months_map[month]["worker_totals"].append({
+                    entry = {
                         "worker": wt["worker"],
                         "total_amount": wt.get("total_amount", 0),
                         "company_amount": wt.get("company_amount", 0),
                         "client_amount": wt.get("client_amount", 0)
-                    })
+                    }
+                    months_map[month]["worker_totals"].append(entry)
+                    month_workers[month][wt["worker"]] = entry
         
         months_list = sorted(months_map.values(), key=lambda x: x["month"], reverse=True)
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "data": {
                 "periods": periods_with_totals,
@@ -2486,7 +2429,7 @@ async def api_comparison():
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return JSONResponse({"success": False, "error": str(e)})
+        return ORJSONResponse({"success": False, "error": str(e)})
 
 
 @app.get("/api/comparison/export")
@@ -2494,28 +2437,7 @@ async def api_comparison_export():
     """Export comparison table to Excel"""
     try:
         # Get comparison data
-        periods = await get_all_periods()
-        
-        all_workers = set()
-        periods_with_totals = []
-        
-        for period in periods:
-            period_details = await get_period_details(period["id"])
-            if period_details and period_details.get("uploads"):
-                latest_upload = period_details["uploads"][0]
-                upload_details = await get_upload_details(latest_upload["id"])
-                
-                worker_totals = upload_details.get("worker_totals", [])
-                for wt in worker_totals:
-                    all_workers.add(wt["worker"])
-                
-                periods_with_totals.append({
-                    "id": period["id"],
-                    "name": period["name"],
-                    "month": period["month"],
-                    "worker_totals": worker_totals
-                })
-        
+        periods_with_totals, all_workers = await _comparison_periods()
         workers = sorted(list(all_workers))
         
         # Create Excel
@@ -2540,13 +2462,21 @@ async def api_comparison_export():
         ws.cell(row=1, column=total_col, value="Всего").fill = header_fill
         ws.cell(row=1, column=total_col).font = header_font
         
+        # Worker totals of each period by worker (first entry wins)
+        period_workers = []
+        for period in periods_with_totals:
+            by_worker = {}
+            for w in period["worker_totals"]:
+                by_worker.setdefault(w["worker"], w)
+            period_workers.append(by_worker)
+        
         # Data rows
         for row, worker in enumerate(workers, start=2):
             ws.cell(row=row, column=1, value=worker)
             worker_total = 0
             
-            for col, period in enumerate(periods_with_totals, start=2):
-                wt = next((w for w in period["worker_totals"] if w["worker"] == worker), None)
+            for col, by_worker in enumerate(period_workers, start=2):
+                wt = by_worker.get(worker)
                 value = wt.get("total_amount", 0) if wt else 0
                 worker_total += value
                 ws.cell(row=row, column=col, value=round(value))
@@ -2593,7 +2523,7 @@ async def api_comparison_export():
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return JSONResponse({"success": False, "error": str(e)})
+        return ORJSONResponse({"success": False, "error": str(e)})
 
 
 @app.get("/api/period/{period_id}/history")
@@ -2612,14 +2542,48 @@ async def get_period_history(period_id: int):
                     if isinstance(edit["created_at"], datetime):
                         edit["created_at"] = edit["created_at"].isoformat()
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "data": history
         })
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return JSONResponse({"success": False, "error": str(e)})
+        return ORJSONResponse({"success": False, "error": str(e)})
+
+
+def _report_rows_from_orders(upload_details: dict, worker_totals_list: List[dict]) -> List[dict]:
+    """Report rows (calculated_data structure) from DB orders of an upload
+    (get_upload_details: orders with calculations, ordered by worker), only workers with totals
+    """
+    workers = {wt["worker"] for wt in worker_totals_list}
+    rows = []
+    for order in upload_details.get("orders", []):
+        if (order["worker"] or "").replace(" (оплата клиентом)", "") not in workers:
+            continue
+        rows.append({
+            "worker": order["worker"],
+            "order": order.get("order_full", "") or order.get("address", ""),
+            "order_code": order.get("order_code", ""),
+            "address": order.get("address", ""),
+            "revenue_total": order.get("revenue_total", 0),
+            "revenue_services": order.get("revenue_services", 0),
+            "diagnostic": order.get("diagnostic", 0),
+            "diagnostic_payment": order.get("diagnostic_payment", 0),
+            "specialist_fee": order.get("specialist_fee", 0),
+            "additional_expenses": order.get("additional_expenses", 0),
+            "service_payment": order.get("service_payment", 0),
+            "percent": order.get("percent", ""),
+            "is_client_payment": order.get("is_client_payment", False),
+            "is_over_10k": order.get("is_over_10k", False),
+            "is_extra_row": order.get("is_extra_row", False),
+            # Values from calculations table (already in order from JOIN)
+            "fuel_payment": order.get("fuel_payment", 0) or 0,
+            "transport": order.get("transport", 0) or 0,
+            "diagnostic_50": order.get("diagnostic_50", 0) or 0,
+            "total": order.get("total", 0) or 0,
+        })
+    return rows
 
 
 @app.get("/api/period/{period_id}/download/{archive_type}")
@@ -2637,49 +2601,16 @@ async def download_period_archive(period_id: int, archive_type: str):
         worker_totals_list = upload_details.get("worker_totals", [])
         workers = [wt["worker"] for wt in worker_totals_list]
         
-        # Get all orders for this upload with FRESH calculation data
-        all_orders = []
-        for wt in worker_totals_list:
-            worker_orders = await get_worker_orders(latest_upload["id"], wt["worker"])
-            all_orders.extend(worker_orders)
-            # Also get client payment orders
-            worker_orders_client = await get_worker_orders(latest_upload["id"], f"{wt['worker']} (оплата клиентом)")
-            all_orders.extend(worker_orders_client)
-        
         # Reconstruct data structure from current DB values (calculations joined with orders!)
-        calculated_data = []
-        for order in all_orders:
-            # Note: fuel_payment, transport, etc. are already in order from JOIN
-            row = {
-                "worker": order["worker"],
-                "order": order.get("order_full", "") or order.get("address", ""),
-                "order_code": order.get("order_code", ""),
-                "address": order.get("address", ""),
-                "revenue_total": order.get("revenue_total", 0),
-                "revenue_services": order.get("revenue_services", 0),
-                "diagnostic": order.get("diagnostic", 0),
-                "diagnostic_payment": order.get("diagnostic_payment", 0),
-                "specialist_fee": order.get("specialist_fee", 0),
-                "additional_expenses": order.get("additional_expenses", 0),
-                "service_payment": order.get("service_payment", 0),
-                "percent": order.get("percent", ""),
-                "is_client_payment": order.get("is_client_payment", False),
-                "is_over_10k": order.get("is_over_10k", False),
-                "is_extra_row": order.get("is_extra_row", False),
-                # Values from calculations table (already in order from JOIN)
-                "fuel_payment": order.get("fuel_payment", 0) or 0,
-                "transport": order.get("transport", 0) or 0,
-                "diagnostic_50": order.get("diagnostic_50", 0) or 0,
-                "total": order.get("total", 0) or 0,
-            }
-            calculated_data.append(row)
+        calculated_data = _report_rows_from_orders(upload_details, worker_totals_list)
         
-        if DEBUG_MODE: logger.debug(f"📊 Generating archive from {len(calculated_data)} orders")
-        # Debug: show some totals
-        for wt in worker_totals_list[:3]:
-            worker_data = [r for r in calculated_data if r["worker"].replace(" (оплата клиентом)", "") == wt["worker"]]
-            calc_total = sum(r.get("total", 0) for r in worker_data)
-            if DEBUG_MODE: logger.debug(f"   {wt['worker']}: {len(worker_data)} orders, calc_total={calc_total}")
+        if DEBUG_MODE:
+            logger.debug(f"📊 Generating archive from {len(calculated_data)} orders")
+            # Debug: show some totals
+            for wt in worker_totals_list[:3]:
+                worker_data = [r for r in calculated_data if r["worker"].replace(" (оплата клиентом)", "") == wt["worker"]]
+                calc_total = sum(r.get("total", 0) for r in worker_data)
+                logger.debug(f"   {wt['worker']}: {len(worker_data)} orders, calc_total={calc_total}")
         
         period_name = period_details.get("name", f"period_{period_id}")
         for_workers = (archive_type == "workers")
@@ -2696,7 +2627,8 @@ async def download_period_archive(period_id: int, archive_type: str):
         
         # Generate FULL archive with all worker files (like step 4)
         zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        # xlsx files are already deflated, store them as is
+        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_STORED) as zf:
             # Main report
             main_report = create_excel_report(calculated_data, period_name, report_config, for_workers=for_workers)
             main_filename = f"Для_монтажников_{period_name.replace('.', '_')}.xlsx" if for_workers else f"Общий_отчет_{period_name.replace('.', '_')}.xlsx"
@@ -2793,7 +2725,7 @@ async def create_or_update_order_calculation(order_id: int, request: Request):
             calc_id = await save_calculation(upload_id, order_id, calc_data)
             logger.info(f"✅ Created calculation {calc_id} for order {order_id}")
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "calculation_id": calc_id
         })
@@ -2874,7 +2806,7 @@ async def update_calculation(calc_id: int, request: Request):
                     })
         
         if not update_values:
-            return JSONResponse({"success": True, "updated": {}, "message": "No changes"})
+            return ORJSONResponse({"success": True, "updated": {}, "message": "No changes"})
         
         # Update calculation
         query = update(calculations).where(calculations.c.id == calc_id).values(**update_values)
@@ -2988,7 +2920,7 @@ async def update_calculation(calc_id: int, request: Request):
         logger.info(f"✅ Updated calculation {calc_id}: {update_values}")
         logger.info(f"   Worker {base_worker}: company={company_amount}, client={client_amount}, total={total_amount}")
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "updated": update_values
         })
@@ -3155,7 +3087,7 @@ async def delete_order(order_id: int, request: Request):
         logger.info(f"🗑️ Deleted order {order_id} (worker: {base_worker}, deleted_total: {deleted_total})")
         logger.info(f"   Recalculated: company={company_amount}, client={client_amount}, total={total_amount}")
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "deleted_order_id": order_id,
             "deleted_total": deleted_total
@@ -3332,7 +3264,7 @@ async def add_order_row(upload_id: int, worker: str, request: Request):
         logger.info(f"📝 Saved manual edit for new row: {order_code or address}")
         
         # Return the new order data
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "order": {
                 "id": order_id,
@@ -3393,14 +3325,14 @@ async def update_order_info(order_id: int, request: Request):
                 update_values["order_full"] = order_text
         
         if not update_values:
-            return JSONResponse({"success": True, "message": "No changes"})
+            return ORJSONResponse({"success": True, "message": "No changes"})
         
         query = update(orders).where(orders.c.id == order_id).values(**update_values)
         await database.execute(query)
         
         logger.info(f"📝 Updated order {order_id}: {update_values}")
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "updated": update_values
         })
@@ -3467,7 +3399,7 @@ async def get_1c_order_info(order_code: str):
     
     # Check if 1C integration is enabled
     if not ONEС_CONFIG["enabled"]:
-        return JSONResponse({
+        return ORJSONResponse({
             "success": False,
             "error": "Интеграция с 1С не настроена",
             "hint": "Необходимо настроить HTTP-сервис в 1С и обновить конфигурацию"
@@ -3485,35 +3417,35 @@ async def get_1c_order_info(order_code: str):
             
             if response.status_code == 200:
                 data = response.json()
-                return JSONResponse(data)
+                return ORJSONResponse(data)
             elif response.status_code == 401:
-                return JSONResponse({
+                return ORJSONResponse({
                     "success": False,
                     "error": "Ошибка авторизации в 1С"
                 })
             elif response.status_code == 404:
-                return JSONResponse({
+                return ORJSONResponse({
                     "success": False,
                     "error": f"Заказ {order_code} не найден в 1С"
                 })
             else:
-                return JSONResponse({
+                return ORJSONResponse({
                     "success": False,
                     "error": f"Ошибка 1С: {response.status_code}"
                 })
                 
     except httpx.TimeoutException:
-        return JSONResponse({
+        return ORJSONResponse({
             "success": False,
             "error": "Превышено время ожидания ответа от 1С"
         })
     except httpx.ConnectError:
-        return JSONResponse({
+        return ORJSONResponse({
             "success": False,
             "error": "Не удалось подключиться к серверу 1С"
         })
     except Exception as e:
-        return JSONResponse({
+        return ORJSONResponse({
             "success": False,
             "error": f"Ошибка: {str(e)}"
         })
@@ -3522,7 +3454,7 @@ async def get_1c_order_info(order_code: str):
 @app.get("/api/1c/status")
 async def get_1c_status():
     """Check 1C integration status"""
-    return JSONResponse({
+    return ORJSONResponse({
         "enabled": ONEС_CONFIG["enabled"],
         "base_url": ONEС_CONFIG["base_url"] if ONEС_CONFIG["enabled"] else None,
         "message": "Интеграция с 1С активна" if ONEС_CONFIG["enabled"] else "Интеграция с 1С не настроена"
@@ -3610,7 +3542,7 @@ async def recalculate_worker_totals(upload_id: int, request: Request):
             
             if DEBUG_MODE: logger.debug(f"🔄 Recalculated {base_worker}: company={company_amount}, client={client_amount}, total={total_amount}")
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "recalculated_count": len(recalculated),
             "workers": recalculated
@@ -3700,7 +3632,7 @@ async def recalculate_all_totals():
             })
             logger.info(f"✅ Recalculated upload {upload_id}: {len(worker_sums)} workers")
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "recalculated_uploads": len(recalculated_uploads),
             "details": recalculated_uploads
@@ -3709,7 +3641,7 @@ async def recalculate_all_totals():
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return JSONResponse({"success": False, "error": str(e)})
+        return ORJSONResponse({"success": False, "error": str(e)})
 
 
 @app.get("/api/delete-upload/{upload_id}")
@@ -3726,12 +3658,12 @@ async def delete_upload(upload_id: int):
         await database.execute(text("DELETE FROM uploads WHERE id = :id").bindparams(id=upload_id))
         
         logger.info(f"✅ Deleted upload {upload_id}")
-        return JSONResponse({"success": True, "deleted_upload_id": upload_id})
+        return ORJSONResponse({"success": True, "deleted_upload_id": upload_id})
         
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return JSONResponse({"success": False, "error": str(e)})
+        return ORJSONResponse({"success": False, "error": str(e)})
 
 
 @app.get("/api/list-uploads/{period_id}")
@@ -3757,10 +3689,10 @@ async def list_uploads(period_id: int):
                 "orders_count": r["orders_count"]
             })
         
-        return JSONResponse({"success": True, "uploads": uploads})
+        return ORJSONResponse({"success": True, "uploads": uploads})
         
     except Exception as e:
-        return JSONResponse({"success": False, "error": str(e)})
+        return ORJSONResponse({"success": False, "error": str(e)})
 
 
 @app.delete("/api/period/{period_id}")
@@ -3849,9 +3781,12 @@ async def delete_period(period_id: int, request: Request):
                 delete(periods).where(periods.c.id == period_id)
             )
         
+        # Deleting a period can change which period is the latest
+        invalidate_period_permissions()
+        
         logger.info(f"🗑️ Period '{period_name}' (id={period_id}) deleted by {user.get('name', 'Unknown')}")
         
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "message": f"Период '{period_name}' удалён"
         })
@@ -3871,10 +3806,10 @@ async def search_orders(q: str = "", limit: int = 10):
     """Search orders by order_code, address, worker, or amount with fuzzy matching"""
     try:
         if not database or not database.is_connected:
-            return JSONResponse({"success": False, "error": "Database not connected"})
+            return ORJSONResponse({"success": False, "error": "Database not connected"})
         
         if not q or len(q) < 2:
-            return JSONResponse({"success": True, "results": []})
+            return ORJSONResponse({"success": True, "results": []})
         
         # Normalize query: replace ё with е for consistent matching
         q_normalized = q.replace('ё', 'е').replace('Ё', 'Е')
@@ -4038,12 +3973,12 @@ async def search_orders(q: str = "", limit: int = 10):
                 "upload_id": r["upload_id"]
             })
         
-        return JSONResponse({"success": True, "results": results, "query": q})
+        return ORJSONResponse({"success": True, "results": results, "query": q})
         
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return JSONResponse({"success": False, "error": str(e)})
+        return ORJSONResponse({"success": False, "error": str(e)})
 
 
 @app.get("/search")
@@ -4524,4 +4459,5 @@ async def list_exclusions(request: Request):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Same event loop / HTTP parser as in the Docker image
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools")
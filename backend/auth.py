@@ -4,8 +4,9 @@ Bitrix24 OAuth2 Authentication Module
 import os
 import httpx
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Optional
-from fastapi import Request, HTTPException
+from fastapi import Request, HTTPException, Depends
 from fastapi.responses import RedirectResponse
 from config import logger, DEBUG_MODE
 
@@ -30,8 +31,9 @@ logger.info(f"🔑 Role config: ADMIN_IDS={ADMIN_USER_IDS}, FINANCIER_IDS={FINAN
 SESSION_COOKIE = "mos_gsm_session"
 
 
+@lru_cache(maxsize=1)
 def get_auth_url() -> str:
-    """Generate Bitrix24 OAuth2 authorization URL"""
+    """Generate Bitrix24 OAuth2 authorization URL (static per process, built once)"""
     if not BITRIX_DOMAIN or not BITRIX_CLIENT_ID:
         return ""
 
@@ -206,8 +208,9 @@ def determine_role(bitrix_id: int) -> str:
     return "employee"
 
 
+@lru_cache(maxsize=1)
 def is_auth_configured() -> bool:
-    """Check if Bitrix24 auth is configured"""
+    """Check if Bitrix24 auth is configured (env is read at import, result cached)"""
     return bool(BITRIX_DOMAIN and BITRIX_CLIENT_ID and BITRIX_CLIENT_SECRET)
 
 
@@ -251,29 +254,43 @@ def delete_session(session_id: str):
 
 
 def get_current_user(request: Request) -> Optional[dict]:
-    """Get current user from session cookie"""
+    """
+    Get current user from session cookie.
+    In-memory lookup only (no I/O), safe to call from async endpoints.
+    The result is cached on request.state, so permission checks and
+    dependencies in the same request share one lookup.
+    Can be used as a dependency: user = Depends(get_current_user)
+    """
+    if hasattr(request.state, "current_user"):
+        return request.state.current_user
+
+    user = None
     session_id = request.cookies.get(SESSION_COOKIE)
-    if not session_id:
-        return None
-
-    session = get_session(session_id)
-    if not session:
-        return None
+    if session_id:
+        session = get_session(session_id)
+        if session:
+            user = session["user"]
 
-    return session["user"]
+    request.state.current_user = user
+    return user
 
 
 def require_auth(request: Request) -> dict:
-    """Require authentication, raise exception if not authenticated"""
+    """
+    Require authentication, raise exception if not authenticated.
+    Use as a dependency: user: dict = Depends(require_auth)
+    """
     user = get_current_user(request)
     if not user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
+        raise HTTPException(status_code=401, detail="Необходима авторизация")
     return user
 
 
-def require_admin(request: Request) -> dict:
-    """Require admin role"""
-    user = require_auth(request)
+def require_admin(user: dict = Depends(require_auth)) -> dict:
+    """
+    Require admin role.
+    Use as a dependency: user: dict = Depends(require_admin)
+    """
     if user.get("role") != "admin":
-        raise HTTPException(status_code=403, detail="Admin access required")
+        raise HTTPException(status_code=403, detail="Только для администратора")
     return user
@@ -5,6 +5,7 @@ Mos-GSM Salary Service
 
 import os
 import logging
+from collections import OrderedDict
 
 # ============================================================================
 # DEBUG MODE
@@ -56,6 +57,14 @@ if DEBUG_MODE:
 else:
     logger.info("🚀 Production mode - minimal logging")
 
+# ============================================================================
+# EXCEL READING
+# ============================================================================
+# Rust-based calamine reader (pandas >= 2.2 + python-calamine) is much faster
+# and lighter than openpyxl for reading. Set EXCEL_ENGINE=openpyxl to fall back.
+
+EXCEL_ENGINE = os.getenv("EXCEL_ENGINE", "calamine")
+
 # ============================================================================
 # DEFAULT CONFIGURATION
 # ============================================================================
@@ -86,13 +95,12 @@ if not DEFAULT_CONFIG["yandex_api_key"]:
 # SESSION STORAGE
 # ============================================================================
 # ⚠️  WARNING: This is in-memory storage. Sessions will be lost on server restart.
-# For production with multiple instances, consider using:
-#   - Redis (recommended)
-#   - Database-backed sessions
-#   - JWT tokens
+# Used only when REDIS_URL is not set (see upload_sessions.py); with Redis,
+# upload sessions are shared between workers and survive restarts.
 # On Railway with single instance, this is acceptable but sessions reset on deploy.
+# Bounded: session_id -> (expires_at, data) in write order, pruned by upload_sessions.
 
-session_data = {}
+session_data = OrderedDict()
 
 # Distance cache to avoid repeated API calls
 # Note: Also in-memory, resets on restart. Consider Redis for persistence.
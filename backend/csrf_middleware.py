@@ -11,7 +11,7 @@ from typing import Optional, Callable
 from functools import wraps
 
 from fastapi import Request, Response, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from json_response import ORJSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 
 
@@ -154,7 +154,7 @@ class CSRFMiddleware(BaseHTTPMiddleware):
             if not request_token or not validate_csrf_token(request_token):
                 # For API requests, return JSON error
                 if path.startswith("/api/") or request.headers.get("accept") == "application/json":
-                    return JSONResponse(
+                    return ORJSONResponse(
                         status_code=403,
                         content={
                             "success": False,
@@ -2,13 +2,15 @@
 Database module for PostgreSQL connection and models
 """
 import os
+import json
+from contextlib import nullcontext
 from datetime import datetime
 from config import logger, DEBUG_MODE
 from typing import Optional, List, Dict, Any
 from databases import Database
 from sqlalchemy import (
     MetaData, Table, Column, Integer, String, Float, DateTime, 
-    Text, Boolean, ForeignKey, create_engine, JSON, and_
+    Text, Boolean, ForeignKey, create_engine, JSON, and_, select, case, text, func
 )
 
 # Get database URL from environment
@@ -18,14 +20,32 @@ DATABASE_URL = os.getenv("DATABASE_URL", "")
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-# For async operations
+# Drop explicit driver (postgresql+asyncpg://, postgresql+psycopg2://):
+# DATABASE_URL is used as-is by psycopg2 for startup migrations
+if DATABASE_URL.startswith("postgresql+"):
+    DATABASE_URL = "postgresql://" + DATABASE_URL.split("://", 1)[1]
+
+# For async operations - all request-time queries go through asyncpg
+# (no sync driver / threadpool hop, no ORM session or identity map)
 if DATABASE_URL:
     ASYNC_DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
 else:
     ASYNC_DATABASE_URL = ""
 
+# Connection pool size (asyncpg pool behind `databases`)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "5"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "40"))
+# Prepared statements cached per connection (asyncpg default 100; 0 only behind
+# a transaction-mode pgbouncer, which can't keep prepared statements)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+
 # Database instance
-database = Database(ASYNC_DATABASE_URL) if ASYNC_DATABASE_URL else None
+database = Database(
+    ASYNC_DATABASE_URL,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+) if ASYNC_DATABASE_URL else None
 
 # Metadata
 metadata = MetaData()
@@ -38,6 +58,29 @@ class PeriodStatus:
     PAID = "paid"             # Оплачено - только admin может редактировать
 
 
+# Human-readable period statuses (resolved in SQL as status_label)
+PERIOD_STATUS_LABELS = {
+    PeriodStatus.DRAFT: "Черновик",
+    PeriodStatus.SENT: "Отправлено монтажникам",
+    PeriodStatus.PAID: "Оплачено",
+}
+
+# Human-readable audit actions.
+# Seeded into audit_action_labels table on startup; labels added later
+# directly in the table are picked up without a deploy.
+AUDIT_ACTION_LABELS = {
+    "upload_files": "Загрузил файлы",
+    "edit_calculation": "Изменил расчёт",
+    "delete_row": "Удалил строку",
+    "send_to_workers": "Отправил монтажникам",
+    "send_to_accountant": "Отправил бухгалтеру",
+    "unlock_period": "Разблокировал период",
+    "status_change_to_draft": "Статус: Черновик",
+    "status_change_to_sent": "Статус: Отправлено",
+    "status_change_to_paid": "Статус: Оплачено",
+}
+
+
 # ============== WORKER FILTERING ==============
 # Groups to exclude from salary calculation (not real workers)
 EXCLUDED_GROUPS = {
@@ -210,6 +253,14 @@ audit_log = Table(
     Column("created_at", DateTime, default=datetime.utcnow),
 )
 
+# Audit action labels (action -> текст для UI)
+audit_action_labels = Table(
+    "audit_action_labels",
+    metadata,
+    Column("action", String(50), primary_key=True),
+    Column("label", String(200), nullable=False),
+)
+
 # Sent notifications table (кому отправляли)
 sent_notifications = Table(
     "sent_notifications",
@@ -264,7 +315,7 @@ async def connect_db():
     """Connect to database"""
     if database:
         await database.connect()
-        logger.info("✅ Connected to PostgreSQL")
+        logger.info(f"✅ Connected to PostgreSQL (pool {DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE})")
 
 async def disconnect_db():
     """Disconnect from database"""
@@ -416,13 +467,25 @@ def create_tables():
                     conn.commit()
                 except Exception as e:
                     conn.rollback()
-                    logger.debug("Migration skipped (may already exist): {e}")
+                    logger.debug(f"Migration skipped (may already exist): {e}")
+            
+            # Seed audit action labels (keep labels edited in DB)
+            try:
+                cur.executemany(
+                    "INSERT INTO audit_action_labels (action, label) VALUES (%s, %s) "
+                    "ON CONFLICT (action) DO NOTHING",
+                    list(AUDIT_ACTION_LABELS.items())
+                )
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.warning(f"⚠️ Could not seed audit action labels: {e}")
             
             cur.close()
             conn.close()
             logger.info("✅ Migrations completed")
         except Exception as e:
-            logger.warning("⚠️ Migration error (non-critical): {e}")
+            logger.warning(f"⚠️ Migration error (non-critical): {e}")
 
 
 # ============== AUDIT LOG FUNCTIONS ==============
@@ -461,24 +524,46 @@ async def log_action(
     await database.execute(query)
 
 
-async def get_audit_log(period_id: int = None, limit: int = 100) -> List[dict]:
-    """Get audit log entries, optionally filtered by period"""
-    if not database or not database.is_connected:
-        return []
+# Audit log columns shown on the period page (no IP / user id / entity refs)
+AUDIT_LOG_SUMMARY_COLUMNS = ("id", "user_name", "user_role", "action", "details", "created_at", "period_status")
+
+
+def _audit_log_query(period_id: int = None, limit: int = 100, full: bool = False):
+    """Build audit log query (with action_label), optionally filtered by period.
+    full=False selects only AUDIT_LOG_SUMMARY_COLUMNS, full=True the whole row
+    """
+    action_label = func.coalesce(audit_action_labels.c.label, audit_log.c.action).label("action_label")
+    columns = [audit_log] if full else [audit_log.c[name] for name in AUDIT_LOG_SUMMARY_COLUMNS]
     
+    query = select(*columns, action_label).select_from(
+        audit_log.outerjoin(audit_action_labels, audit_action_labels.c.action == audit_log.c.action)
+    )
     if period_id:
-        query = audit_log.select().where(
-            audit_log.c.period_id == period_id
-        ).order_by(audit_log.c.created_at.desc()).limit(limit)
-    else:
-        query = audit_log.select().order_by(
-            audit_log.c.created_at.desc()
-        ).limit(limit)
+        query = query.where(audit_log.c.period_id == period_id)
+    return query.order_by(audit_log.c.created_at.desc()).limit(limit)
+
+
+async def get_audit_log(period_id: int = None, limit: int = 100, full: bool = False) -> List[dict]:
+    """Get audit log entries (with action_label), optionally filtered by period"""
+    if not database or not database.is_connected:
+        return []
     
-    rows = await database.fetch_all(query)
+    rows = await database.fetch_all(_audit_log_query(period_id, limit, full))
     return [dict(row._mapping) for row in rows]
 
 
+async def iter_audit_log(period_id: int = None, limit: int = 100, full: bool = False):
+    """
+    Iterate audit log entries one by one (server-side cursor).
+    Use for large exports instead of get_audit_log() to avoid loading all rows.
+    """
+    if not database or not database.is_connected:
+        return
+    
+    async for row in database.iterate(_audit_log_query(period_id, limit, full)):
+        yield dict(row._mapping)
+
+
 # ============== PERMISSION FUNCTIONS ==============
 
 def can_user_edit_period(user: dict, period_status: str, is_latest_period: bool) -> tuple:
@@ -697,18 +782,68 @@ def can_user_change_status(user: dict, from_status: str, to_status: str) -> tupl
 
 # ============== PERIOD STATUS FUNCTIONS ==============
 
+def _period_status_label():
+    """SQL expression: localized period status as status_label"""
+    return case(
+        PERIOD_STATUS_LABELS,
+        value=periods.c.status,
+        else_=periods.c.status,
+    ).label("status_label")
+
+
+def _latest_period_id_subquery():
+    """Scalar subquery: id of the latest period (same rule as is_latest_period)"""
+    return select(periods.c.id).order_by(periods.c.created_at.desc()).limit(1).scalar_subquery()
+
+
 async def get_period_status(period_id: int) -> Optional[dict]:
-    """Get period with status info"""
+    """
+    Get period with status info.
+    Also returns "is_latest" (same rule as is_latest_period) and
+    "status_label" so callers don't need extra round-trips or lookups.
+    """
     if not database or not database.is_connected:
         return None
     
-    query = periods.select().where(periods.c.id == period_id)
+    latest_id = _latest_period_id_subquery()
+    query = select(
+        periods,
+        (periods.c.id == latest_id).label("is_latest"),
+        _period_status_label(),
+    ).where(periods.c.id == period_id)
+    
     row = await database.fetch_one(query)
     if row:
-        return dict(row._mapping)
+        period = dict(row._mapping)
+        period["is_latest"] = bool(period.get("is_latest"))
+        return period
     return None
 
 
+async def get_periods_status_bulk(period_ids: List[int]) -> Dict[int, dict]:
+    """Get status info (with is_latest) for several periods in one query: {period_id: period}"""
+    if not database or not database.is_connected:
+        return {}
+    
+    if not period_ids:
+        return {}
+    
+    latest_id = _latest_period_id_subquery()
+    query = select(
+        periods,
+        (periods.c.id == latest_id).label("is_latest"),
+        _period_status_label(),
+    ).where(periods.c.id.in_(period_ids))
+    
+    rows = await database.fetch_all(query)
+    result = {}
+    for row in rows:
+        period = dict(row._mapping)
+        period["is_latest"] = bool(period.get("is_latest"))
+        result[period["id"]] = period
+    return result
+
+
 async def update_period_status(period_id: int, new_status: str, user: dict = None) -> bool:
     """Update period status"""
     if not database or not database.is_connected:
@@ -721,19 +856,38 @@ async def update_period_status(period_id: int, new_status: str, user: dict = Non
     elif new_status == PeriodStatus.PAID:
         update_data["paid_at"] = datetime.utcnow()
     
-    query = periods.update().where(periods.c.id == period_id).values(**update_data)
-    await database.execute(query)
-    
-    # Log the action
-    if user:
-        await log_action(
-            user=user,
-            action=f"status_change_to_{new_status}",
-            entity_type="period",
-            entity_id=period_id,
-            period_id=period_id,
-            details={"new_status": new_status}
+    if not user:
+        query = periods.update().where(periods.c.id == period_id).values(**update_data)
+        await database.execute(query)
+        return True
+    
+    # Update status and write the audit entry in one statement
+    set_clause = ", ".join(f"{column} = :{column}" for column in update_data)
+    query = text(f"""
+        WITH updated AS (
+            UPDATE periods SET {set_clause}
+            WHERE id = :period_id
+            RETURNING id, status
+        )
+        INSERT INTO audit_log (
+            user_id, user_name, user_role, action, entity_type, entity_id,
+            period_id, period_status, details, created_at
         )
+        SELECT
+            :user_id, :user_name, :user_role, :action, 'period', updated.id,
+            updated.id, updated.status, CAST(:details AS JSON), :created_at
+        FROM updated
+    """)
+    await database.execute(query, {
+        **update_data,
+        "period_id": period_id,
+        "user_id": user.get("id"),
+        "user_name": user.get("name"),
+        "user_role": user.get("role"),
+        "action": f"status_change_to_{new_status}",
+        "details": json.dumps({"new_status": new_status}),
+        "created_at": datetime.utcnow(),
+    })
     
     return True
 
@@ -796,7 +950,7 @@ async def create_upload(period_id: int, config: dict = None, user: dict = None)
     if config:
         yandex_fuel = config.get("yandex_fuel", {})
         if yandex_fuel:
-            if DEBUG_MODE: logger.debug("💾 Saving upload with yandex_fuel: {list(yandex_fuel.keys())}")
+            if DEBUG_MODE: logger.debug(f"💾 Saving upload with yandex_fuel: {list(yandex_fuel.keys())}")
     
     # Get next version number
     query = uploads.select().where(uploads.c.period_id == period_id).order_by(uploads.c.version.desc())
@@ -826,24 +980,33 @@ async def create_upload(period_id: int, config: dict = None, user: dict = None)
     return upload_id
 
 
-async def save_order(upload_id: int, order_data: dict) -> int:
-    """Save order data"""
-    if not database or not database.is_connected:
-        return None
+def upload_transaction():
+    """Transaction for all writes of one upload (orders, totals, edits, changes).
+    `databases` binds the connection to the current task, so the save_* calls
+    inside share it and commit once. No-op without database.
+    """
+    if not database:
+        return nullcontext()
+    return database.transaction()
+
+
+# Fields that exist in orders table (app rows use 'order' for order_full)
+ORDER_FIELDS = {
+    'worker', 'order_code', 'order_full', 'order_date', 'address',
+    'days_on_site', 'revenue_total', 'revenue_services', 'diagnostic', 'diagnostic_payment',
+    'specialist_fee', 'additional_expenses', 'service_payment', 'percent',
+    'is_client_payment', 'is_over_10k', 'is_extra_row', 'manager_comment'
+}
+
+
+def _prepare_order_data(order_data: dict) -> dict:
+    """Order fields from app row to orders table columns (order_data is not modified)"""
+    # Only include fields that exist in orders table
+    filtered_data = {k: v for k, v in order_data.items() if k in ORDER_FIELDS}
     
     # Map 'order' to 'order_full' (different names in app vs DB)
     if 'order' in order_data and 'order_full' not in order_data:
-        order_data['order_full'] = order_data.pop('order')
-    
-    # Only include fields that exist in orders table
-    allowed_fields = {
-        'worker', 'order_code', 'order_full', 'order_date', 'address',
-        'days_on_site', 'revenue_total', 'revenue_services', 'diagnostic', 'diagnostic_payment',
-        'specialist_fee', 'additional_expenses', 'service_payment', 'percent',
-        'is_client_payment', 'is_over_10k', 'is_extra_row', 'manager_comment'
-    }
-    
-    filtered_data = {k: v for k, v in order_data.items() if k in allowed_fields}
+        filtered_data['order_full'] = order_data['order']
     
     # Convert percent to string if it's a number (DB expects string like "30%")
     if 'percent' in filtered_data and filtered_data['percent'] is not None:
@@ -853,9 +1016,8 @@ async def save_order(upload_id: int, order_data: dict) -> int:
     
     # Convert days_on_site: NaN -> None, float -> int
     if 'days_on_site' in filtered_data:
-        import pandas as pd
         days_val = filtered_data['days_on_site']
-        if days_val is None or (isinstance(days_val, float) and pd.isna(days_val)):
+        if days_val is None or (isinstance(days_val, float) and days_val != days_val):  # NaN
             filtered_data['days_on_site'] = None
         elif days_val:
             try:
@@ -863,21 +1025,31 @@ async def save_order(upload_id: int, order_data: dict) -> int:
             except (ValueError, TypeError):
                 filtered_data['days_on_site'] = None
     
+    return filtered_data
+
+
+async def save_order(upload_id: int, order_data: dict) -> int:
+    """Save order data"""
+    if not database or not database.is_connected:
+        return None
+    
     query = orders.insert().values(
         upload_id=upload_id,
-        **filtered_data
+        **_prepare_order_data(order_data)
     )
     return await database.execute(query)
 
 
+# Fields that exist in calculations table
+CALCULATION_FIELDS = {'worker', 'fuel_payment', 'transport', 'diagnostic_50', 'total'}
+
+
 async def save_calculation(upload_id: int, order_id: int, calc_data: dict) -> int:
     """Save calculation result"""
     if not database or not database.is_connected:
         return None
     
-    # Only include fields that exist in calculations table
-    allowed_fields = {'worker', 'fuel_payment', 'transport', 'diagnostic_50', 'total'}
-    filtered_data = {k: v for k, v in calc_data.items() if k in allowed_fields}
+    filtered_data = {k: v for k, v in calc_data.items() if k in CALCULATION_FIELDS}
     
     query = calculations.insert().values(
         upload_id=upload_id,
@@ -887,6 +1059,86 @@ async def save_calculation(upload_id: int, order_id: int, calc_data: dict) -> in
     return await database.execute(query)
 
 
+def _copy_record_builder(columns: list):
+    """Function turning a values dict into a row tuple for COPY in columns order.
+    COPY bypasses SQLAlchemy, so column defaults (0 / False) and type coercion
+    are applied here; both are resolved once per table, not per row.
+    """
+    converters = []
+    for column in columns:
+        default = column.default.arg if column.default is not None and column.default.is_scalar else None
+        if isinstance(column.type, Boolean):
+            coerce = bool
+        elif isinstance(column.type, Float):
+            coerce = float
+        elif isinstance(column.type, Integer):
+            coerce = int
+        else:
+            coerce = None
+        converters.append((column.name, default, coerce))
+    
+    def build(values: dict) -> tuple:
+        record = []
+        for name, default, coerce in converters:
+            value = values.get(name)
+            if value is None or value != value:  # None / NaN
+                value = default
+            elif coerce is not None:
+                value = coerce(value)
+            record.append(value)
+        return tuple(record)
+    
+    return build
+
+
+async def bulk_save_orders(upload_id: int, items: List[tuple]) -> List[int]:
+    """Save orders with their calculations in bulk.
+    items: (order_data, calc_data) pairs, same dicts as for save_order/save_calculation.
+    Returns order ids in items order.
+    
+    Uses PostgreSQL COPY (asyncpg copy_records_to_table) instead of one INSERT
+    round-trip per order/calculation; order ids are reserved from the sequence
+    up front so calculations can reference them.
+    """
+    if not database or not database.is_connected or not items:
+        return []
+    
+    async with database.connection() as connection:
+        async with connection.transaction():
+            raw_connection = connection.raw_connection
+            id_rows = await raw_connection.fetch(
+                "SELECT nextval(pg_get_serial_sequence('orders', 'id')) FROM generate_series(1, $1)",
+                len(items)
+            )
+            order_ids = [row[0] for row in id_rows]
+            
+            order_columns = list(orders.columns)
+            # Calculation ids come from the column's serial default
+            calc_columns = [c for c in calculations.columns if c.name != "id"]
+            order_record = _copy_record_builder(order_columns)
+            calc_record = _copy_record_builder(calc_columns)
+            order_records = []
+            calculation_records = []
+            for order_id, (order_data, calc_data) in zip(order_ids, items):
+                order_values = _prepare_order_data(order_data)
+                order_values.update(id=order_id, upload_id=upload_id)
+                order_records.append(order_record(order_values))
+                
+                calc_values = {k: v for k, v in calc_data.items() if k in CALCULATION_FIELDS}
+                calc_values.update(upload_id=upload_id, order_id=order_id)
+                calculation_records.append(calc_record(calc_values))
+            
+            await raw_connection.copy_records_to_table(
+                "orders", records=order_records, columns=[c.name for c in order_columns]
+            )
+            await raw_connection.copy_records_to_table(
+                "calculations", records=calculation_records, columns=[c.name for c in calc_columns]
+            )
+    
+    if DEBUG_MODE: logger.debug(f"💾 Bulk saved {len(order_ids)} orders with calculations for upload {upload_id}")
+    return order_ids
+
+
 async def save_worker_total(upload_id: int, worker: str, 
                            total: float = 0, orders_count: int = 0,
                            fuel: float = 0, transport: float = 0,
@@ -912,6 +1164,27 @@ async def save_worker_total(upload_id: int, worker: str,
     return await database.execute(query)
 
 
+async def bulk_save_worker_totals(upload_id: int, rows: List[dict]) -> int:
+    """Save worker totals of an upload in one COPY.
+    rows: dicts keyed by worker_totals columns (worker, total_amount, orders_count, ...).
+    Returns number of saved rows.
+    """
+    if not database or not database.is_connected or not rows:
+        return 0
+    
+    total_columns = [c for c in worker_totals.columns if c.name != "id"]
+    total_record = _copy_record_builder(total_columns)
+    records = [total_record({**row, "upload_id": upload_id}) for row in rows]
+    
+    async with database.connection() as connection:
+        await connection.raw_connection.copy_records_to_table(
+            "worker_totals", records=records, columns=[c.name for c in total_columns]
+        )
+    
+    if DEBUG_MODE: logger.debug(f"💾 Bulk saved {len(records)} worker totals for upload {upload_id}")
+    return len(records)
+
+
 async def save_change(upload_id: int, order_code: str = None, worker: str = None, 
                       change_type: str = None, field: str = None,
                       old_value: str = None, new_value: str = None) -> int:
@@ -937,6 +1210,40 @@ async def save_change(upload_id: int, order_code: str = None, worker: str = None
     return await database.execute(query)
 
 
+async def bulk_save_changes(upload_id: int, rows: List[dict]) -> int:
+    """Save change records in one COPY.
+    rows: dicts with save_change arguments (order_code, worker, change_type, field, old_value, new_value).
+    Returns number of saved rows.
+    """
+    if not database or not database.is_connected or not rows:
+        return 0
+    
+    change_columns = [c for c in changes.columns if c.name != "id"]
+    change_record = _copy_record_builder(change_columns)
+    created_at = datetime.utcnow()
+    records = []
+    for row in rows:
+        values = {
+            'upload_id': upload_id,
+            'order_code': row.get('order_code'),
+            'worker': row.get('worker'),
+            'change_type': row.get('change_type'),
+            'field_name': row.get('field'),  # DB column is field_name, not field
+            'old_value': row.get('old_value'),
+            'new_value': row.get('new_value'),
+            'created_at': created_at,
+        }
+        records.append(change_record(values))
+    
+    async with database.connection() as connection:
+        await connection.raw_connection.copy_records_to_table(
+            "changes", records=records, columns=[c.name for c in change_columns]
+        )
+    
+    if DEBUG_MODE: logger.debug(f"💾 Bulk saved {len(records)} changes for upload {upload_id}")
+    return len(records)
+
+
 async def get_previous_upload(period_id: int, exclude_upload_id: int = None) -> Optional[int]:
     """Get the previous upload ID for a period, optionally excluding a specific upload"""
     if not database or not database.is_connected:
@@ -960,6 +1267,30 @@ async def get_previous_upload(period_id: int, exclude_upload_id: int = None) ->
     return None
 
 
+async def get_latest_upload_with_orders(period_id: int) -> tuple:
+    """Get the latest upload of a period that has orders (empty uploads are skipped)
+    and its orders with calculations. Returns (upload, orders) or (None, [])
+    """
+    if not database or not database.is_connected:
+        return None, []
+    
+    # Upload is picked in SQL: no orders round-trip per empty version
+    query = """
+        SELECT u.*
+        FROM uploads u
+        WHERE u.period_id = :period_id
+          AND EXISTS (SELECT 1 FROM orders o WHERE o.upload_id = u.id)
+        ORDER BY u.version DESC
+        LIMIT 1
+    """
+    row = await database.fetch_one(query, {"period_id": period_id})
+    if not row:
+        return None, []
+    
+    upload = dict(row._mapping)
+    return upload, await get_orders_by_upload(upload["id"])
+
+
 async def compare_uploads(old_upload_id: int, new_upload_id: int) -> dict:
     """Compare two uploads and return differences"""
     # Implementation kept from original
@@ -1021,6 +1352,60 @@ async def get_period_details(period_id: int) -> Optional[dict]:
     return period
 
 
+async def get_latest_upload_totals() -> Dict[int, dict]:
+    """Latest upload of every period with its company/client totals (sum of worker totals).
+    Returns {period_id: {"upload_id", "company_amount", "client_amount"}}; periods without uploads are missing
+    """
+    if not database or not database.is_connected:
+        return {}
+    
+    # One query for all periods instead of period details + full upload details per period
+    query = """
+        SELECT
+            lu.period_id,
+            lu.id AS upload_id,
+            COALESCE(SUM(wt.company_amount), 0) AS company_amount,
+            COALESCE(SUM(wt.client_amount), 0) AS client_amount
+        FROM (
+            SELECT DISTINCT ON (period_id) id, period_id
+            FROM uploads
+            ORDER BY period_id, version DESC
+        ) lu
+        LEFT JOIN worker_totals wt ON wt.upload_id = lu.id
+        GROUP BY lu.period_id, lu.id
+    """
+    rows = await database.fetch_all(query)
+    return {row._mapping["period_id"]: dict(row._mapping) for row in rows}
+
+
+async def get_latest_worker_totals() -> Dict[int, List[dict]]:
+    """Worker totals of the latest upload of every period (ordered by worker).
+    Returns {period_id: [worker_totals rows]}; periods without uploads are missing
+    """
+    if not database or not database.is_connected:
+        return {}
+    
+    query = """
+        SELECT lu.period_id AS latest_period_id, wt.*
+        FROM (
+            SELECT DISTINCT ON (period_id) id, period_id
+            FROM uploads
+            ORDER BY period_id, version DESC
+        ) lu
+        LEFT JOIN worker_totals wt ON wt.upload_id = lu.id
+        ORDER BY lu.period_id, wt.worker
+    """
+    rows = await database.fetch_all(query)
+    
+    totals = {}
+    for row in rows:
+        data = dict(row._mapping)
+        period_totals = totals.setdefault(data.pop("latest_period_id"), [])
+        if data["id"] is not None:  # latest upload without worker totals
+            period_totals.append(data)
+    return totals
+
+
 async def get_upload_details(upload_id: int) -> Optional[dict]:
     """Get upload with orders, calculations and manual edits"""
     if not database or not database.is_connected:
@@ -1303,6 +1688,38 @@ async def save_notification(
     return await database.execute(query)
 
 
+async def save_notifications_bulk(rows: List[dict]) -> int:
+    """
+    Save many notification records with a single multi-row INSERT.
+    Each row: period_id, worker, bitrix_user_id, notification_type, sent_by (file_url optional).
+    Returns number of inserted rows.
+    """
+    if not database or not database.is_connected:
+        return 0
+    
+    if not rows:
+        return 0
+    
+    now = datetime.utcnow()
+    values = [
+        {
+            "period_id": row["period_id"],
+            "worker": row["worker"],
+            "bitrix_user_id": row.get("bitrix_user_id"),
+            "notification_type": row.get("notification_type"),
+            "file_url": row.get("file_url"),
+            "sent_by": row.get("sent_by"),
+            "sent_at": now,
+            "status": "sent",
+        }
+        for row in rows
+    ]
+    
+    query = sent_notifications.insert().values(values)
+    await database.execute(query)
+    return len(values)
+
+
 async def get_period_notifications(period_id: int) -> List[dict]:
     """Get all notifications for a period"""
     if not database or not database.is_connected:
@@ -1351,6 +1768,28 @@ async def save_manual_edit(
     return await database.execute(query)
 
 
+async def bulk_save_manual_edits(upload_id: int, rows: List[dict]) -> int:
+    """Save manual edits of an upload in one COPY.
+    rows: dicts with save_manual_edit arguments (order_code, worker, field_name, old_value, ...).
+    Returns number of saved rows.
+    """
+    if not database or not database.is_connected or not rows:
+        return 0
+    
+    edit_columns = [c for c in manual_edits.columns if c.name != "id"]
+    edit_record = _copy_record_builder(edit_columns)
+    created_at = datetime.utcnow()
+    records = [edit_record({**row, "upload_id": upload_id, "created_at": created_at}) for row in rows]
+    
+    async with database.connection() as connection:
+        await connection.raw_connection.copy_records_to_table(
+            "manual_edits", records=records, columns=[c.name for c in edit_columns]
+        )
+    
+    if DEBUG_MODE: logger.debug(f"💾 Bulk saved {len(records)} manual edits for upload {upload_id}")
+    return len(records)
+
+
 async def save_version_change(
     upload_id: int,
     prev_upload_id: int,
@@ -1450,7 +1889,7 @@ async def get_duplicate_exclusions() -> List[dict]:
     for row in rows:
         item = dict(row._mapping)
         raw_order_ids = item.get("order_ids")
-        if DEBUG_MODE: logger.debug("🔍 DB RAW order_ids: {repr(raw_order_ids)}, type={type(raw_order_ids)}")
+        if DEBUG_MODE: logger.debug(f"🔍 DB RAW order_ids: {repr(raw_order_ids)}, type={type(raw_order_ids)}")
         
         # Handle different formats for backward compatibility
         if raw_order_ids is None:
@@ -1466,7 +1905,7 @@ async def get_duplicate_exclusions() -> List[dict]:
                 if isinstance(parsed, str):
                     parsed = json.loads(parsed)
                 item["order_ids"] = parsed if isinstance(parsed, list) else []
-                if DEBUG_MODE: logger.debug("🔍 DB PARSED order_ids: {item['order_ids']}")
+                if DEBUG_MODE: logger.debug(f"🔍 DB PARSED order_ids: {item['order_ids']}")
             except (json.JSONDecodeError, TypeError):
                 item["order_ids"] = []
         else:
@@ -0,0 +1,24 @@
+"""
+JSON responses rendered with orjson
+Mos-GSM Salary Service
+"""
+
+import orjson
+from fastapi.responses import JSONResponse
+
+# - datetimes are serialized natively (naive ones are treated as UTC, as stored in DB)
+# - int dict keys are allowed ({period_id: ...})
+# - numpy scalars/arrays from pandas code are serialized as plain numbers
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY
+
+
+def orjson_dumps(content) -> bytes:
+    """Serialize content with the app-wide orjson options"""
+    return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse that renders with orjson instead of stdlib json"""
+    
+    def render(self, content) -> bytes:
+        return orjson_dumps(content)
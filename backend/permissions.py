@@ -2,6 +2,8 @@
 Permission checking utilities for Salary Service
 """
 
+import time
+
 from fastapi import Request, HTTPException
 
 from database import (
@@ -14,11 +16,80 @@ from database import (
     can_user_send_to_accountant,
     can_user_unlock_period,
     can_user_change_status,
-    is_latest_period,
     get_period_status,
+    get_periods_status_bulk,
     log_action,
 )
-from auth import get_current_user
+from auth import get_current_user, SESSION_COOKIE
+
+
+# ============== PERMISSIONS CACHE ==============
+# Short-lived in-memory cache for get_user_permissions(), keyed by (session_id, period_id).
+# The period page polls permissions on every load, and each miss costs a
+# get_period_status() query.
+# NOTE: Only the UI summary is cached - check_*_permission() always hits the DB,
+# so a stale entry can at worst show a button that the backend will then reject.
+PERMISSIONS_CACHE_TTL = 30  # seconds
+PERMISSIONS_CACHE_MAX_SIZE = 10000
+
+_permissions_cache = {}
+
+
+def _get_cached_permissions(cache_key: tuple) -> dict:
+    """Return cached permissions if present and not expired"""
+    entry = _permissions_cache.get(cache_key)
+    if not entry:
+        return None
+    
+    expires_at, permissions = entry
+    if time.monotonic() > expires_at:
+        _permissions_cache.pop(cache_key, None)
+        return None
+    
+    return permissions
+
+
+def _store_cached_permissions(cache_key: tuple, permissions: dict):
+    """Store permissions in cache, dropping expired entries when cache is full"""
+    now = time.monotonic()
+    
+    if len(_permissions_cache) >= PERMISSIONS_CACHE_MAX_SIZE:
+        expired = [k for k, (expires_at, _) in _permissions_cache.items() if now > expires_at]
+        for k in expired:
+            del _permissions_cache[k]
+        # Still full - start over rather than track LRU order
+        if len(_permissions_cache) >= PERMISSIONS_CACHE_MAX_SIZE:
+            _permissions_cache.clear()
+    
+    _permissions_cache[cache_key] = (now + PERMISSIONS_CACHE_TTL, permissions)
+
+
+def invalidate_period_permissions(period_id: int = None):
+    """
+    Drop cached permissions for a period (or all periods if period_id is None).
+    Call after anything that changes period status or which period is the latest.
+    """
+    if period_id is None:
+        _permissions_cache.clear()
+        return
+    
+    for key in [k for k in _permissions_cache if k[1] == period_id]:
+        _permissions_cache.pop(key, None)
+
+
+async def get_period_cached(request: Request, period_id: int) -> dict:
+    """
+    get_period_status() memoized for the duration of one request.
+    Permission checks and the endpoint itself share a single query.
+    """
+    cache = getattr(request.state, "period_cache", None)
+    if cache is None:
+        cache = {}
+        request.state.period_cache = cache
+    
+    if period_id not in cache:
+        cache[period_id] = await get_period_status(period_id)
+    return cache[period_id]
 
 
 async def check_edit_permission(request: Request, period_id: int) -> dict:
@@ -31,12 +102,12 @@ async def check_edit_permission(request: Request, period_id: int) -> dict:
         raise HTTPException(status_code=401, detail="Необходима авторизация")
     
     # Get period status
-    period = await get_period_status(period_id)
+    period = await get_period_cached(request, period_id)
     if not period:
         raise HTTPException(status_code=404, detail="Период не найден")
     
     status = period.get("status", PeriodStatus.DRAFT)
-    is_latest = await is_latest_period(period_id)
+    is_latest = period["is_latest"]
     
     can_edit, reason = can_user_edit_period(user, status, is_latest)
     
@@ -62,12 +133,12 @@ async def check_upload_permission(request: Request, period_id: int = None) -> di
     
     if period_id:
         # Check existing period
-        period = await get_period_status(period_id)
+        period = await get_period_cached(request, period_id)
         if not period:
             raise HTTPException(status_code=404, detail="Период не найден")
         
         status = period.get("status", PeriodStatus.DRAFT)
-        is_latest = await is_latest_period(period_id)
+        is_latest = period["is_latest"]
         
         can_upload, reason = can_user_upload(user, status, is_latest)
         
@@ -90,12 +161,12 @@ async def check_delete_row_permission(request: Request, period_id: int) -> dict:
     if not user:
         raise HTTPException(status_code=401, detail="Необходима авторизация")
     
-    period = await get_period_status(period_id)
+    period = await get_period_cached(request, period_id)
     if not period:
         raise HTTPException(status_code=404, detail="Период не найден")
     
     status = period.get("status", PeriodStatus.DRAFT)
-    is_latest = await is_latest_period(period_id)
+    is_latest = period["is_latest"]
     
     can_delete, reason = can_user_delete_row(user, status, is_latest)
     
@@ -131,12 +202,12 @@ async def check_send_permission(request: Request, period_id: int) -> dict:
     if not user:
         raise HTTPException(status_code=401, detail="Необходима авторизация")
     
-    period = await get_period_status(period_id)
+    period = await get_period_cached(request, period_id)
     if not period:
         raise HTTPException(status_code=404, detail="Период не найден")
     
     status = period.get("status", PeriodStatus.DRAFT)
-    is_latest = await is_latest_period(period_id)
+    is_latest = period["is_latest"]
     
     can_send, reason = can_user_send_to_workers(user, status, is_latest)
     
@@ -155,12 +226,12 @@ async def check_send_to_accountant_permission(request: Request, period_id: int)
     if not user:
         raise HTTPException(status_code=401, detail="Необходима авторизация")
     
-    period = await get_period_status(period_id)
+    period = await get_period_cached(request, period_id)
     if not period:
         raise HTTPException(status_code=404, detail="Период не найден")
     
     status = period.get("status", PeriodStatus.DRAFT)
-    is_latest = await is_latest_period(period_id)
+    is_latest = period["is_latest"]
     
     can_send, reason = can_user_send_to_accountant(user, status, is_latest)
     
@@ -196,7 +267,7 @@ async def check_status_change_permission(request: Request, period_id: int, new_s
     if not user:
         raise HTTPException(status_code=401, detail="Необходима авторизация")
     
-    period = await get_period_status(period_id)
+    period = await get_period_cached(request, period_id)
     if not period:
         raise HTTPException(status_code=404, detail="Период не найден")
     
@@ -316,38 +387,70 @@ async def get_user_permissions(request: Request, period_id: int = None) -> dict:
     
     # Check period-specific permissions
     if period_id:
-        period = await get_period_status(period_id)
+        session_id = request.cookies.get(SESSION_COOKIE)
+        cache_key = (session_id, period_id)
+        cached = _get_cached_permissions(cache_key)
+        if cached is not None:
+            return dict(cached)
+        
+        period = await get_period_cached(request, period_id)
         if period:
-            status = period.get("status", PeriodStatus.DRAFT)
-            is_latest = await is_latest_period(period_id)
-            
-            permissions["period_status"] = status
-            permissions["period_status_label"] = {
-                PeriodStatus.DRAFT: "Черновик",
-                PeriodStatus.SENT: "Отправлено монтажникам",
-                PeriodStatus.PAID: "Оплачено",
-            }.get(status, status)
-            permissions["is_latest"] = is_latest
-            # Convert datetime to string for JSON serialization
-            sent_at = period.get("sent_at")
-            paid_at = period.get("paid_at")
-            permissions["sent_at"] = str(sent_at) if sent_at else None
-            permissions["paid_at"] = str(paid_at) if paid_at else None
-            
-            # Employee permissions for latest non-paid period
-            if not is_admin:
-                if status != PeriodStatus.PAID and is_latest:
-                    permissions["can_edit"] = True
-                    permissions["can_upload"] = True
-                    permissions["can_delete_row"] = True
-                    permissions["can_send_to_workers"] = True
-                    permissions["can_send_to_accountant"] = True
-                else:
-                    # Cannot do anything on old or paid periods
-                    permissions["can_edit"] = False
-                    permissions["can_upload"] = False
-                    permissions["can_delete_row"] = False
-                    permissions["can_send_to_workers"] = False
-                    permissions["can_send_to_accountant"] = False
+            _apply_period_permissions(permissions, period, is_admin)
+        
+        _store_cached_permissions(cache_key, permissions)
     
     return permissions
+
+
+def _apply_period_permissions(permissions: dict, period: dict, is_admin: bool):
+    """Add period info and period-specific rules to a permissions summary (in place)"""
+    status = period.get("status", PeriodStatus.DRAFT)
+    is_latest = period["is_latest"]
+    
+    permissions["period_status"] = status
+    permissions["period_status_label"] = period["status_label"]
+    permissions["is_latest"] = is_latest
+    # datetimes are serialized by ORJSONResponse
+    permissions["sent_at"] = period.get("sent_at")
+    permissions["paid_at"] = period.get("paid_at")
+    
+    # Employee permissions for latest non-paid period
+    if not is_admin:
+        if status != PeriodStatus.PAID and is_latest:
+            permissions["can_edit"] = True
+            permissions["can_upload"] = True
+            permissions["can_delete_row"] = True
+            permissions["can_send_to_workers"] = True
+            permissions["can_send_to_accountant"] = True
+        else:
+            # Cannot do anything on old or paid periods
+            permissions["can_edit"] = False
+            permissions["can_upload"] = False
+            permissions["can_delete_row"] = False
+            permissions["can_send_to_workers"] = False
+            permissions["can_send_to_accountant"] = False
+
+
+async def get_user_permissions_bulk(request: Request, period_ids: list) -> dict:
+    """
+    Get permission summaries for several periods at once.
+    Uses a single query for all periods instead of one request per period.
+    Returns {period_id: permissions}.
+    """
+    base = await get_user_permissions(request)
+    
+    # Unauthenticated / financier: period doesn't change anything
+    if not base.get("authenticated") or base.get("is_financier"):
+        return {period_id: dict(base) for period_id in period_ids}
+    
+    periods_by_id = await get_periods_status_bulk(period_ids)
+    
+    result = {}
+    for period_id in period_ids:
+        permissions = dict(base)
+        period = periods_by_id.get(period_id)
+        if period:
+            _apply_period_permissions(permissions, period, base["is_admin"])
+        result[period_id] = permissions
+    
+    return result
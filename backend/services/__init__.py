@@ -9,14 +9,17 @@ from .geocoding import (
     get_distance_osrm,
     is_moscow_region,
     calculate_fuel_cost,
+    calculate_fuel_costs,
 )
 
 from .calculation import (
     calculate_row,
+    calculate_rows,
     generate_alarms,
 )
 
 from .excel_parser import (
+    excel_source,
     parse_excel_file,
     parse_both_excel_files,
 )
@@ -24,6 +27,8 @@ from .excel_parser import (
 from .excel_report import (
     create_excel_report,
     create_worker_report,
+    create_report_pair,
+    create_worker_report_pair,
 )
 
 from .yandex_fuel_parser import (
@@ -40,15 +45,20 @@ __all__ = [
     'get_distance_osrm',
     'is_moscow_region',
     'calculate_fuel_cost',
+    'calculate_fuel_costs',
     # Calculation
     'calculate_row',
+    'calculate_rows',
     'generate_alarms',
     # Excel parser
+    'excel_source',
     'parse_excel_file',
     'parse_both_excel_files',
     # Excel report
     'create_excel_report',
     'create_worker_report',
+    'create_report_pair',
+    'create_worker_report_pair',
     # Yandex Fuel
     'parse_yandex_fuel_file',
     'detect_yandex_fuel_file',
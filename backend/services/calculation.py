@@ -2,12 +2,28 @@
 Salary calculation logic
 """
 
+import asyncio
 import pandas as pd
+from functools import lru_cache
 from typing import List, Dict
 
 from utils.helpers import extract_address_from_order, parse_percent
-from utils.workers import normalize_worker_name
-from .geocoding import calculate_fuel_cost
+from utils.workers import normalize_worker_name, base_worker_name
+from .geocoding import calculate_fuel_cost, FUEL_CONCURRENCY
+
+
+@lru_cache(maxsize=32)
+def _normalized_company_car_workers(workers: tuple) -> frozenset:
+    """Normalized names of workers on company car (same list for every row)"""
+    return frozenset(normalize_worker_name(w) for w in workers)
+
+
+def _to_float(value):
+    """Numeric cell value as float; None / NaN / "" count as 0"""
+    if value is None or value == "":
+        return 0
+    value = float(value)
+    return value if value == value else 0  # NaN != NaN
 
 
 async def calculate_row(row: dict, config: dict, days_map: dict) -> dict:
@@ -20,34 +36,23 @@ async def calculate_row(row: dict, config: dict, days_map: dict) -> dict:
     result["total"] = 0
     
     if row.get("is_worker_total") or "В прошлом расчете" in str(row.get("order", "")):
-        service_payment = float(row.get("service_payment", 0)) if pd.notna(row.get("service_payment")) and row.get("service_payment") != "" else 0
-        result["total"] = service_payment
+        result["total"] = _to_float(row.get("service_payment"))
         return result
     
     order = str(row.get("order", ""))
     address = extract_address_from_order(order)
     
-    specialist_fee = row.get("specialist_fee", 0)
-    specialist_fee = float(specialist_fee) if pd.notna(specialist_fee) and specialist_fee != "" else 0
-    
-    revenue_services = row.get("revenue_services", 0)
-    revenue_services = float(revenue_services) if pd.notna(revenue_services) and revenue_services != "" else 0
-    
+    specialist_fee = _to_float(row.get("specialist_fee"))
+    revenue_services = _to_float(row.get("revenue_services"))
     percent = parse_percent(row.get("percent", 0))
-    
-    service_payment = row.get("service_payment", 0)
-    service_payment = float(service_payment) if pd.notna(service_payment) and service_payment != "" else 0
-    
-    diagnostic = row.get("diagnostic", 0)
-    diagnostic = float(diagnostic) if pd.notna(diagnostic) and diagnostic != "" else 0
+    service_payment = _to_float(row.get("service_payment"))
+    diagnostic = _to_float(row.get("diagnostic"))
     
     # Get worker name for company car check
-    worker = row.get("worker", "").replace(" (оплата клиентом)", "")
-    worker_normalized = normalize_worker_name(worker)
+    worker_normalized = base_worker_name(row.get("worker", ""))
     
     # Get list of workers on company car (transport = 0)
-    company_car_workers = config.get("company_car_workers", [])
-    company_car_normalized = [normalize_worker_name(w) for w in company_car_workers]
+    company_car_normalized = _normalized_company_car_workers(tuple(config.get("company_car_workers", [])))
     is_on_company_car = worker_normalized in company_car_normalized
     
     # 1. Fuel payment - only if specialist_fee is empty and has real address in Moscow/MO
@@ -79,6 +84,19 @@ async def calculate_row(row: dict, config: dict, days_map: dict) -> dict:
     return result
 
 
+async def calculate_rows(rows, config: dict, days_map: dict) -> List[dict]:
+    """calculate_row for many rows concurrently (fuel lookups overlap).
+    Returns results in rows order
+    """
+    semaphore = asyncio.Semaphore(FUEL_CONCURRENCY)
+    
+    async def calculate(row):
+        async with semaphore:
+            return await calculate_row(row, config, days_map)
+    
+    return list(await asyncio.gather(*(calculate(row) for row in rows)))
+
+
 def generate_alarms(data: List[dict], config: dict) -> Dict[str, List[Dict]]:
     """Generate warning alarms for manual review - AFTER calculation, grouped by category"""
     alarms = {
@@ -141,9 +159,9 @@ def generate_alarms(data: List[dict], config: dict) -> Dict[str, List[Dict]]:
         percent = parse_percent(row.get("percent", 0))
         standard_percents = config.get("standard_percents", [30, 50, 100])
         if percent > 0 and round(percent, 0) not in standard_percents:
-            specialist_fee = float(row.get("specialist_fee", 0)) if pd.notna(row.get("specialist_fee")) and row.get("specialist_fee") != "" else 0
-            revenue_total = float(row.get("revenue_total", 0)) if pd.notna(row.get("revenue_total")) and row.get("revenue_total") != "" else 0
-            total = float(row.get("total", 0)) if pd.notna(row.get("total")) and row.get("total") != "" else 0
+            specialist_fee = _to_float(row.get("specialist_fee"))
+            revenue_total = _to_float(row.get("revenue_total"))
+            total = _to_float(row.get("total"))
             
             # Check if specialist_fee >= 50% of revenue_total
             should_skip = False
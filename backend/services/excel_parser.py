@@ -6,6 +6,8 @@ import pandas as pd
 import re
 from io import BytesIO
 
+from config import EXCEL_ENGINE
+
 from utils.workers import (
     build_worker_name_map,
     normalize_worker_name,
@@ -77,11 +79,22 @@ def parse_manager_comment(comment: str) -> dict:
     return result
 
 
-def parse_excel_file(file_bytes: bytes, is_over_10k: bool, name_map: dict = None) -> tuple:
+def excel_source(source):
+    """Prepare Excel input for pd.read_excel: bytes are wrapped in BytesIO,
+    file objects (e.g. UploadFile.file) are rewound and read in place without copying
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return BytesIO(source)
+    source.seek(0)
+    return source
+
+
+def parse_excel_file(file_bytes, is_over_10k: bool, name_map: dict = None) -> tuple:
     """Parse Excel file from 1C and extract data.
+    file_bytes may be bytes or a binary file object.
     Returns (DataFrame, set of worker names found, list of manager comments, list of warnings)
     """
-    df = pd.read_excel(BytesIO(file_bytes), header=None)
+    df = pd.read_excel(excel_source(file_bytes), header=None, engine=EXCEL_ENGINE)
     
     header_row = None
     for i in range(min(10, len(df))):
@@ -296,8 +309,8 @@ def parse_excel_file(file_bytes: bytes, is_over_10k: bool, name_map: dict = None
     return pd.DataFrame(records), all_worker_names, manager_comments, warnings
 
 
-def parse_both_excel_files(content_under: bytes, content_over: bytes) -> tuple:
-    """Parse both Excel files and return combined DataFrame with normalized worker names.
+def parse_both_excel_files(content_under, content_over) -> tuple:
+    """Parse both Excel files (bytes or binary file objects) and return combined DataFrame with normalized worker names.
     Returns (combined_df, name_map, manager_comments, warnings)
     """
     # First pass: collect all worker names from both files
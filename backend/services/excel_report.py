@@ -4,20 +4,22 @@ Excel report generation
 
 import pandas as pd
 from io import BytesIO
-from typing import List
+from itertools import islice
+from typing import List, Tuple
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 
 from config import logger, DEBUG_MODE
 from utils.helpers import format_order_for_workers
-from utils.workers import normalize_worker_name
+from utils.workers import normalize_worker_name, base_worker_name
 
+# Columns hidden in the workers version (revenue, expenses, percent, manager comment)
+WORKERS_HIDDEN_COLUMNS = ("B", "C", "G", "H", "I", "J")
 
-def create_excel_report(data: List[dict], period: str, config: dict, for_workers: bool = False) -> bytes:
-    """Create Excel report with proper formatting and formulas
-    
-    Args:
-        for_workers: If True, creates simplified version for workers with hidden columns
+
+def build_report_workbook(data: List[dict], period: str, config: dict) -> Tuple[Workbook, list]:
+    """Build full Excel report workbook with proper formatting and formulas.
+    Returns (workbook, order cells) - order cells are rewritten by strip_for_workers.
     """
     wb = Workbook()
     ws = wb.active
@@ -62,15 +64,6 @@ def create_excel_report(data: List[dict], period: str, config: dict, for_workers
     for col, width in column_widths.items():
         ws.column_dimensions[col].width = width
     
-    # Hide columns for workers version
-    if for_workers:
-        ws.column_dimensions['B'].hidden = True
-        ws.column_dimensions['C'].hidden = True
-        ws.column_dimensions['G'].hidden = True
-        ws.column_dimensions['H'].hidden = True
-        ws.column_dimensions['I'].hidden = True
-        ws.column_dimensions['J'].hidden = True  # Hide manager comment for workers
-    
     # Parameter rows (1-3)
     ws['A1'] = "Параметры:"
     ws['A1'].font = param_font
@@ -117,6 +110,7 @@ def create_excel_report(data: List[dict], period: str, config: dict, for_workers
             workers_data[worker]["regular"].append(record)
     
     current_row = 6
+    order_cells = []
     
     def to_int(val):
         """Convert value to integer, return empty string if invalid"""
@@ -158,11 +152,8 @@ def create_excel_report(data: List[dict], period: str, config: dict, for_workers
             if record.get("is_worker_total"):
                 continue
             
-            order_text = record.get("order", "")
-            if for_workers:
-                order_text = format_order_for_workers(order_text)
-            
-            cell = ws.cell(row=current_row, column=1, value=order_text)
+            cell = ws.cell(row=current_row, column=1, value=record.get("order", ""))
+            order_cells.append(cell)
             cell.font = data_font
             cell.alignment = alignment_wrap
             cell.border = thin_border
@@ -252,11 +243,8 @@ def create_excel_report(data: List[dict], period: str, config: dict, for_workers
                 if record.get("is_worker_total"):
                     continue
                 
-                order_text = record.get("order", "")
-                if for_workers:
-                    order_text = format_order_for_workers(order_text)
-                
-                cell = ws.cell(row=current_row, column=1, value=order_text)
+                cell = ws.cell(row=current_row, column=1, value=record.get("order", ""))
+                order_cells.append(cell)
                 cell.font = data_font
                 cell.alignment = alignment_wrap
                 cell.border = thin_border
@@ -321,7 +309,7 @@ def create_excel_report(data: List[dict], period: str, config: dict, for_workers
         # Debug: if we have yandex_fuel data but didn't find this worker
         if yandex_fuel_dict and not yandex_fuel_deduction:
             if DEBUG_MODE:
-                logger.debug(f"⚠️ Yandex fuel: worker '{worker}' (normalized: '{worker_normalized}') not found in keys: {list(yandex_fuel_dict.keys())[:5]}")
+                logger.debug(f"⚠️ Yandex fuel: worker '{worker}' (normalized: '{worker_normalized}') not found in keys: {list(islice(yandex_fuel_dict, 5))}")
         
         if regular_end >= regular_start:
             if client_name_row:
@@ -357,14 +345,57 @@ def create_excel_report(data: List[dict], period: str, config: dict, for_workers
         
         current_row += 1
     
+    return wb, order_cells
+
+
+def workbook_bytes(wb: Workbook) -> bytes:
+    """Serialize workbook to xlsx bytes"""
     output = BytesIO()
     wb.save(output)
-    output.seek(0)
     return output.getvalue()
 
 
+def strip_for_workers(wb: Workbook, order_cells: list) -> bytes:
+    """Turn full report workbook into the workers version (in place) and serialize it:
+    hides WORKERS_HIDDEN_COLUMNS and shortens order texts
+    """
+    ws = wb.active
+    for col in WORKERS_HIDDEN_COLUMNS:
+        ws.column_dimensions[col].hidden = True
+    for cell in order_cells:
+        cell.value = format_order_for_workers(cell.value)
+    return workbook_bytes(wb)
+
+
+def create_excel_report(data: List[dict], period: str, config: dict, for_workers: bool = False) -> bytes:
+    """Create Excel report with proper formatting and formulas
+    
+    Args:
+        for_workers: If True, creates simplified version for workers with hidden columns
+    """
+    wb, order_cells = build_report_workbook(data, period, config)
+    if for_workers:
+        return strip_for_workers(wb, order_cells)
+    return workbook_bytes(wb)
+
+
+def create_report_pair(data: List[dict], period: str, config: dict) -> Tuple[bytes, bytes]:
+    """Full and workers versions of the report, built from one workbook"""
+    wb, order_cells = build_report_workbook(data, period, config)
+    full_report = workbook_bytes(wb)
+    return full_report, strip_for_workers(wb, order_cells)
+
+
+def _worker_rows(data: List[dict], worker: str) -> List[dict]:
+    worker_normalized = base_worker_name(worker)
+    return [r for r in data if base_worker_name(r.get("worker", "")) == worker_normalized]
+
+
 def create_worker_report(data: List[dict], worker: str, period: str, config: dict, for_workers: bool = False) -> bytes:
     """Create individual worker Excel report"""
-    worker_normalized = normalize_worker_name(worker.replace(" (оплата клиентом)", ""))
-    worker_data = [r for r in data if normalize_worker_name(r.get("worker", "").replace(" (оплата клиентом)", "")) == worker_normalized]
-    return create_excel_report(worker_data, period, config, for_workers=for_workers)
+    return create_excel_report(_worker_rows(data, worker), period, config, for_workers=for_workers)
+
+
+def create_worker_report_pair(data: List[dict], worker: str, period: str, config: dict) -> Tuple[bytes, bytes]:
+    """Full and workers versions of individual worker report"""
+    return create_report_pair(_worker_rows(data, worker), period, config)
@@ -10,6 +10,12 @@ import pandas as pd
 
 from config import distance_cache
 
+# Max concurrent fuel cost lookups (geocoder + router requests) per batch
+FUEL_CONCURRENCY = 8
+
+# Nominatim usage policy allows ~1 request/second - serialize fallback requests
+_nominatim_lock = asyncio.Lock()
+
 
 async def geocode_address_yandex(address: str, api_key: str) -> tuple:
     """Get coordinates from Yandex Geocoder API"""
@@ -46,7 +52,8 @@ async def geocode_address_yandex(address: str, api_key: str) -> tuple:
 async def geocode_address_nominatim(address: str) -> tuple:
     """Get coordinates from Nominatim (OpenStreetMap) - free"""
     try:
-        await asyncio.sleep(1)  # Rate limiting
+        async with _nominatim_lock:
+            await asyncio.sleep(1)  # Rate limiting
         async with httpx.AsyncClient() as client:
             url = "https://nominatim.openstreetmap.org/search"
             params = {
@@ -95,6 +102,11 @@ async def geocode_address(address: str, api_key: str) -> tuple:
 
 async def get_distance_osrm(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """Get driving distance in km using OSRM (free), with fallback to straight-line distance"""
+    # Only OSRM results are cached - fallback distance is retried next time
+    cache_key = f"route_{lat1:.6f},{lon1:.6f};{lat2:.6f},{lon2:.6f}"
+    if cache_key in distance_cache:
+        return distance_cache[cache_key]
+    
     try:
         async with httpx.AsyncClient() as client:
             url = f"http://router.project-osrm.org/route/v1/driving/{lon1},{lat1};{lon2},{lat2}"
@@ -104,6 +116,7 @@ async def get_distance_osrm(lat1: float, lon1: float, lat2: float, lon2: float)
 
             if data.get("code") == "Ok" and data.get("routes"):
                 distance_meters = data["routes"][0]["distance"]
+                distance_cache[cache_key] = distance_meters / 1000
                 return distance_meters / 1000
             else:
                 print(f"  ⚠️ OSRM error: {data.get('code', 'unknown')} - {data.get('message', '')}")
@@ -215,3 +228,24 @@ async def calculate_fuel_cost(address: str, config: dict, days: int = 1) -> int:
     result = min(cost, config["fuel_max"])
     print(f"⛽ Бензин: {address[:40]}... -> {distance:.1f} км -> {result} руб")
     return result
+
+
+async def calculate_fuel_costs(addresses, config: dict, days: int = 1) -> dict:
+    """Calculate fuel cost for many addresses concurrently, each unique address once.
+    Returns {address: cost}
+    """
+    unique_addresses = list(dict.fromkeys(a for a in addresses if a))
+    if not unique_addresses:
+        return {}
+    
+    # Geocode base address once before fanning out
+    await geocode_address(config["base_address"], config["yandex_api_key"])
+    
+    semaphore = asyncio.Semaphore(FUEL_CONCURRENCY)
+    
+    async def fuel_for(address):
+        async with semaphore:
+            return await calculate_fuel_cost(address, config, days)
+    
+    costs = await asyncio.gather(*(fuel_for(a) for a in unique_addresses))
+    return dict(zip(unique_addresses, costs))
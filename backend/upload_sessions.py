@@ -0,0 +1,149 @@
+"""
+Upload session storage
+Holds parsed upload data between /upload, /review, /calculate and /save calls.
+
+With REDIS_URL set, sessions live in Redis (shared between uvicorn workers,
+expire after UPLOAD_SESSION_TTL). Redis payloads are pickled and signed with
+HMAC-SHA256 (UPLOAD_SESSION_SECRET); a payload with a bad signature is treated
+as a missing session and never unpickled. Without Redis, the in-process session_data
+dict from config is used, with the same TTL and at most UPLOAD_SESSION_MAX
+sessions (oldest written are dropped first).
+"""
+
+import hashlib
+import hmac
+import os
+import pickle
+import secrets
+import time
+from typing import List, Optional
+
+import pandas as pd
+
+from config import session_data, logger, DEBUG_MODE
+
+REDIS_URL = os.getenv("REDIS_URL", "")
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", "86400"))  # 24 hours
+UPLOAD_SESSION_MAX = int(os.getenv("UPLOAD_SESSION_MAX", "256"))  # in-memory sessions (without Redis)
+KEY_PREFIX = "upload:v2:"  # v2: signed payloads (unsigned "upload:" keys are never read)
+SIGNATURE_SIZE = hashlib.sha256().digest_size
+
+# Must be the same for all workers sharing the Redis instance
+UPLOAD_SESSION_SECRET = os.getenv("UPLOAD_SESSION_SECRET", "")
+
+redis_client = None
+if REDIS_URL:
+    import redis.asyncio as redis
+    redis_client = redis.from_url(REDIS_URL)
+    logger.info("🗄️ Upload sessions: Redis")
+    if not UPLOAD_SESSION_SECRET:
+        UPLOAD_SESSION_SECRET = secrets.token_hex(32)
+        logger.warning("⚠️ UPLOAD_SESSION_SECRET not set: using random key, upload sessions are not shared between workers")
+_secret_key = UPLOAD_SESSION_SECRET.encode()
+
+
+def _sign(data: bytes) -> bytes:
+    return hmac.new(_secret_key, data, hashlib.sha256).digest()
+
+
+def _dump_session(data: dict) -> bytes:
+    """Pickle session data, prefixed with its HMAC signature"""
+    payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    return _sign(payload) + payload
+
+
+def _load_session(raw: bytes) -> Optional[dict]:
+    """Unpickle session data only if its signature matches (None otherwise)"""
+    signature, payload = raw[:SIGNATURE_SIZE], raw[SIGNATURE_SIZE:]
+    if not hmac.compare_digest(signature, _sign(payload)):
+        logger.warning("⚠️ Upload session with invalid signature ignored")
+        return None
+    return pickle.loads(payload)
+
+
+def _prune_local_sessions():
+    """Drop expired and over-limit in-memory sessions.
+    Entries are kept in write order with the same TTL, so the oldest are at the front.
+    """
+    now = time.monotonic()
+    while session_data:
+        session_id, (expires_at, _) = next(iter(session_data.items()))
+        if expires_at > now and len(session_data) <= UPLOAD_SESSION_MAX:
+            break
+        del session_data[session_id]
+        if DEBUG_MODE: logger.debug(f"🗄️ Dropped upload session {session_id}")
+
+
+async def get_upload_session(session_id: str) -> Optional[dict]:
+    """Get upload session data by ID (None if missing or expired)"""
+    if not session_id:
+        return None
+    if redis_client is None:
+        entry = session_data.get(session_id)
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if expires_at <= time.monotonic():
+            session_data.pop(session_id, None)
+            return None
+        return data
+    raw = await redis_client.get(KEY_PREFIX + session_id)
+    # Pickle keeps pandas/numpy values intact; the signature is checked before loading
+    return _load_session(raw) if raw is not None else None
+
+
+async def save_upload_session(session_id: str, data: dict):
+    """Create or replace upload session data"""
+    if redis_client is None:
+        session_data[session_id] = (time.monotonic() + UPLOAD_SESSION_TTL, data)
+        session_data.move_to_end(session_id)
+        _prune_local_sessions()
+        return
+    payload = _dump_session(data)
+    await redis_client.set(KEY_PREFIX + session_id, payload, ex=UPLOAD_SESSION_TTL)
+    if DEBUG_MODE: logger.debug(f"🗄️ Saved upload session {session_id} ({len(payload)} bytes)")
+
+
+async def update_upload_session(session_id: str, **fields):
+    """Set some fields of an existing upload session"""
+    data = await get_upload_session(session_id)
+    if data is None:
+        return
+    data.update(fields)
+    await save_upload_session(session_id, data)
+
+
+async def delete_upload_session(session_id: str):
+    """Remove upload session data"""
+    if redis_client is None:
+        session_data.pop(session_id, None)
+        return
+    await redis_client.delete(KEY_PREFIX + session_id)
+
+
+async def count_upload_sessions() -> int:
+    """Number of active upload sessions (for health check)"""
+    if redis_client is None:
+        _prune_local_sessions()
+        return len(session_data)
+    count = 0
+    async for _ in redis_client.scan_iter(match=KEY_PREFIX + "*"):
+        count += 1
+    return count
+
+
+def get_session_records(session: dict) -> List[dict]:
+    """Parsed rows of an upload session as a list of dicts.
+    Fresh uploads keep rows as a DataFrame (columnar, far smaller than records
+    in memory/Redis); after review the modified rows are stored as records.
+    """
+    combined = session.get("combined", [])
+    if isinstance(combined, pd.DataFrame):
+        return combined.to_dict("records")
+    return combined
+
+
+async def close_upload_sessions():
+    """Close Redis connection pool on shutdown"""
+    if redis_client is not None:
+        await redis_client.aclose()
@@ -5,7 +5,9 @@ Utility functions for Salary Service
 from .helpers import (
     format_order_short,
     format_order_for_workers,
+    format_amount,
     parse_percent,
+    parse_number_series,
     extract_address_from_order,
     clean_address_for_geocoding,
     extract_period,
@@ -16,6 +18,7 @@ from .workers import (
     MANAGERS,
     build_worker_name_map,
     normalize_worker_name,
+    base_worker_name,
     is_valid_worker_name,
     is_manager,
 )
@@ -23,7 +26,9 @@ from .workers import (
 __all__ = [
     'format_order_short',
     'format_order_for_workers', 
+    'format_amount',
     'parse_percent',
+    'parse_number_series',
     'extract_address_from_order',
     'clean_address_for_geocoding',
     'extract_period',
@@ -31,6 +36,7 @@ __all__ = [
     'MANAGERS',
     'build_worker_name_map',
     'normalize_worker_name',
+    'base_worker_name',
     'is_valid_worker_name',
     'is_manager',
 ]
@@ -6,6 +6,54 @@ import re
 import pandas as pd
 from io import BytesIO
 
+# ============================================================================
+# REGEX PATTERNS (compiled once - these helpers run for every order row)
+# ============================================================================
+# "КАУТ-001658 от 05.11.2025 23:59:59, адрес" -> code, date, rest
+ORDER_TEXT_RE = re.compile(r'((?:КАУТ|ИБУТ|ТДУТ)-\d+)\s+от\s+(\d{2}\.\d{2}\.\d{4})\s+\d{1,2}:\d{2}:\d{2},?\s*(.*)')
+ORDER_TEXT_WITH_PREFIX_RE = re.compile(r'(?:Заказ клиента\s+)?((?:КАУТ|ИБУТ|ТДУТ)-\d+)\s+от\s+(\d{2}\.\d{2}\.\d{4})\s+\d{1,2}:\d{2}:\d{2},?\s*(.*)')
+ORDER_PREFIX_RE = re.compile(r'^Заказ клиента\s+')
+ORDER_FROM_RE = re.compile(r'\s+от\s+')
+TIME_RE = re.compile(r'\d{1,2}:\d{2}:\d{2},?\s*')
+ESCAPED_NEWLINE_TAIL_RE = re.compile(r'\\n.*')
+PIPE_TAIL_RE = re.compile(r'\|.*')
+EMPTY_PIPES_RE = re.compile(r'\s*\|\s*\|\s*')
+TRAILING_PIPE_RE = re.compile(r'\s*\|\s*$')
+PERCENT_RE = re.compile(r'(\d+(?:[.,]\d+)?)\s*%')
+NUMBER_RE = re.compile(r'(\d+(?:[.,]\d+)?)')
+PERIOD_RE = re.compile(r'(\d{2})\.(\d{2})\.(\d{4})\s*-\s*(\d{2})\.(\d{2})\.(\d{4})')
+
+# Address after order date/time: full datetime, short time, date only
+ADDRESS_AFTER_DATETIME_RES = [
+    re.compile(r'\d{2}\.\d{2}\.\d{4}\s+\d{1,2}:\d{2}:\d{2},\s*(.+)', re.DOTALL),
+    re.compile(r'\d:\d{2}:\d{2},\s*(.+)', re.DOTALL),
+    re.compile(r'\d{2}\.\d{2}\.\d{4},\s*(.+)', re.DOTALL),
+]
+# Manager comment lines - these are NOT addresses
+ADDRESS_MANAGER_LINE_RE = re.compile(r'^(?:оплата монтажник|зарплата\s+\d|оплатить\s+\d)', re.IGNORECASE)
+# Comment lines (second line) - these are NOT part of address
+ADDRESS_COMMENT_LINE_RE = re.compile(r'^(?:помощник|физ\s*лицо|\(гараж\)|\(этаж|В монтажный|стяжк)', re.IGNORECASE)
+
+# clean_address_for_geocoding, applied in order
+ADDRESS_PREFIX_RES = [
+    re.compile(r'^OZON\s+'),
+    re.compile(r'^DDX\s*-?\s*'),
+]
+ADDRESS_MANAGER_COMMENT_RES = [re.compile(p, re.IGNORECASE) for p in (
+    r'^Оплата монтажнику\s*\d*%?\s*,?\s*',  # At start
+    r',?\s*Оплата монтажнику\s*\d*%?\s*$',  # At end
+    r'^оплатить\s+\d+\s*,?\s*',  # "оплатить 7000"
+    r'^зарплата\s+\d+.*?,?\s*',  # "зарплата 3500 (ПС Тимофеев)"
+)]
+ADDRESS_GARBAGE_RES = [re.compile(p, re.IGNORECASE) for p in (
+    r',?\s*зарплата\s+монтажник.*$',
+    r',?\s*диагностика\s+.*$',
+    r',?\s*тест\s+делаем.*$',
+    r'\s+диагностика\s+\w+$',
+    r'\s*\(эатж.*\)$',  # typo "эатж" = "этаж"
+    r'\s*\(этаж.*\)$',
+)]
+
 
 def format_order_short(order_text: str) -> str:
     """Format order text for display: remove 'Заказ клиента' and time, keep code, date and address"""
@@ -20,18 +68,18 @@ def format_order_short(order_text: str) -> str:
     
     # Pattern: "Заказ клиента КАУТ-001658 от 05.11.2025 23:59:59, адрес"
     # Result: "КАУТ-001658 от 05.11.2025, адрес"
-    match = re.search(r'((?:КАУТ|ИБУТ|ТДУТ)-\d+)\s+от\s+(\d{2}\.\d{2}\.\d{4})\s+\d{1,2}:\d{2}:\d{2},?\s*(.*)', text)
+    match = ORDER_TEXT_RE.search(text)
     if match:
         code = match.group(1)
         date = match.group(2)
         address = match.group(3).strip()
         # Clean address from \n and other artifacts
-        address = re.sub(r'\\n.*', '', address)
-        address = re.sub(r'\|.*', '', address)
+        address = ESCAPED_NEWLINE_TAIL_RE.sub('', address)
+        address = PIPE_TAIL_RE.sub('', address)
         return f"{code} от {date}, {address}".strip(', ')
     
     # Fallback: just remove "Заказ клиента" prefix
-    text = re.sub(r'^Заказ клиента\s+', '', text)
+    text = ORDER_PREFIX_RE.sub('', text)
     return text
 
 
@@ -49,15 +97,15 @@ def format_order_for_workers(order_text: str) -> str:
     # NEW FORMAT: "Заказ клиента ТДУТ-000072 от 24.12.2025 14:43:44, Смоленская д.7 | Клипсы"
     # Pattern: code, date, time, then address/comment after comma
     # Result: "ТДУТ-000072, 24.12.2025, Смоленская д.7 | Клипсы"
-    match = re.search(r'(?:Заказ клиента\s+)?((?:КАУТ|ИБУТ|ТДУТ)-\d+)\s+от\s+(\d{2}\.\d{2}\.\d{4})\s+\d{1,2}:\d{2}:\d{2},?\s*(.*)', text)
+    match = ORDER_TEXT_WITH_PREFIX_RE.search(text)
     if match:
         code = match.group(1)
         date = match.group(2)
         address_and_comment = match.group(3).strip()
         
         # Clean up: remove extra pipes/spaces, limit length
-        address_and_comment = re.sub(r'\s*\|\s*\|\s*', ' | ', address_and_comment)  # Remove empty pipes
-        address_and_comment = re.sub(r'\s*\|\s*$', '', address_and_comment)  # Remove trailing pipe
+        address_and_comment = EMPTY_PIPES_RE.sub(' | ', address_and_comment)  # Remove empty pipes
+        address_and_comment = TRAILING_PIPE_RE.sub('', address_and_comment)  # Remove trailing pipe
         address_and_comment = address_and_comment.strip(' |,')
         
         if address_and_comment:
@@ -66,24 +114,41 @@ def format_order_for_workers(order_text: str) -> str:
     
     # OLD FORMAT: "Заказ клиента КАУТ-001658 от 05.11.2025 23:59:59, адрес в одной строке"
     # (same pattern but address is in same column, not separate)
-    match = re.search(r'((?:КАУТ|ИБУТ|ТДУТ)-\d+)\s+от\s+(\d{2}\.\d{2}\.\d{4})\s+\d{1,2}:\d{2}:\d{2},?\s*(.*)', text)
+    match = ORDER_TEXT_RE.search(text)
     if match:
         code = match.group(1)
         date = match.group(2)
         address_and_comment = match.group(3).strip()
         # Clean from \n and other artifacts
-        address_and_comment = re.sub(r'\\n.*', '', address_and_comment)
-        address_and_comment = re.sub(r'\|.*', '', address_and_comment)
+        address_and_comment = ESCAPED_NEWLINE_TAIL_RE.sub('', address_and_comment)
+        address_and_comment = PIPE_TAIL_RE.sub('', address_and_comment)
         return f"{code}, {date}, {address_and_comment}".strip(', ')
     
     # Fallback: just remove "Заказ клиента" and time
-    text = re.sub(r'^Заказ клиента\s+', '', text)
-    text = re.sub(r'\s+от\s+', ', ', text)
+    text = ORDER_PREFIX_RE.sub('', text)
+    text = ORDER_FROM_RE.sub(', ', text)
     # Remove time if present
-    text = re.sub(r'\d{1,2}:\d{2}:\d{2},?\s*', '', text)
+    text = TIME_RE.sub('', text)
     return text.strip(', ')
 
 
+def format_amount(value: float) -> str:
+    """Format amount rounded to rubles with space thousands separator: 1234567.8 -> '1 234 568'"""
+    # C-level grouping + single-char replace; faster than digit grouping in Python
+    return format(value, ",.0f").replace(",", " ")
+
+
+def parse_number_series(series: pd.Series) -> pd.Series:
+    """Parse a column of numbers like 1234.5, '1 234,50', '30,00 %' to floats (invalid/empty -> 0.0)"""
+    cleaned = (
+        series.astype(str)
+        .str.replace(" ", "", regex=False)
+        .str.replace(",", ".", regex=False)
+        .str.replace("%", "", regex=False)
+    )
+    return pd.to_numeric(cleaned, errors="coerce").fillna(0.0)
+
+
 def parse_percent(value) -> float:
     """Parse percent value from string like '30,00 %', '40%', or 'Оплата монтажнику 40%'"""
     if pd.isna(value):
@@ -94,8 +159,7 @@ def parse_percent(value) -> float:
     text = str(value)
     
     # First try to extract number followed by % (handles "Оплата монтажнику 40%")
-    import re
-    match = re.search(r'(\d+(?:[.,]\d+)?)\s*%', text)
+    match = PERCENT_RE.search(text)
     if match:
         try:
             return float(match.group(1).replace(',', '.'))
@@ -108,7 +172,7 @@ def parse_percent(value) -> float:
         return float(text)
     except:
         # Last resort: extract any number from string
-        match = re.search(r'(\d+(?:[.,]\d+)?)', str(value))
+        match = NUMBER_RE.search(str(value))
         if match:
             try:
                 return float(match.group(1).replace(',', '.'))
@@ -130,28 +194,11 @@ def extract_address_from_order(order_text: str) -> str:
         if pattern in text:
             return ""
     
-    # Manager comment patterns - these are NOT addresses
-    manager_patterns = [
-        r'^оплата монтажник',
-        r'^зарплата\s+\d',
-        r'^оплатить\s+\d',
-    ]
-    
-    # Comment patterns (second line) - these are NOT part of address, skip them
-    comment_patterns = [
-        r'^помощник',
-        r'^физ\s*лицо',
-        r'^\(гараж\)',
-        r'^\(этаж',
-        r'^В монтажный',
-        r'^стяжк',
-    ]
-    
     def is_manager_comment(line):
-        return any(re.match(p, line.strip(), re.IGNORECASE) for p in manager_patterns)
+        return ADDRESS_MANAGER_LINE_RE.match(line.strip()) is not None
     
     def is_comment_line(line):
-        return any(re.match(p, line.strip(), re.IGNORECASE) for p in comment_patterns)
+        return ADDRESS_COMMENT_LINE_RE.match(line.strip()) is not None
     
     def process_address_lines(lines):
         """Process lines after datetime, return clean address with all parts"""
@@ -179,26 +226,15 @@ def extract_address_from_order(order_text: str) -> str:
         addr = clean_address_for_geocoding(addr)
         return addr.strip()
     
-    # Pattern 1: Full datetime format "27.10.2025 0:00:00, address"
-    match = re.search(r'\d{2}\.\d{2}\.\d{4}\s+\d{1,2}:\d{2}:\d{2},\s*(.+)', text, re.DOTALL)
-    if match:
-        addr_part = match.group(1).strip()
-        lines = addr_part.split('\n')
-        return process_address_lines(lines)
-    
-    # Pattern 2: Short time format "0:00:00, address"
-    match = re.search(r'\d:\d{2}:\d{2},\s*(.+)', text, re.DOTALL)
-    if match:
-        addr_part = match.group(1).strip()
-        lines = addr_part.split('\n')
-        return process_address_lines(lines)
-    
-    # Pattern 3: Date only format "27.10.2025, address" (no time)
-    match = re.search(r'\d{2}\.\d{2}\.\d{4},\s*(.+)', text, re.DOTALL)
-    if match:
-        addr_part = match.group(1).strip()
-        lines = addr_part.split('\n')
-        return process_address_lines(lines)
+    # Patterns in priority order:
+    # full datetime "27.10.2025 0:00:00, address", short time "0:00:00, address",
+    # date only "27.10.2025, address" (no time)
+    for pattern in ADDRESS_AFTER_DATETIME_RES:
+        match = pattern.search(text)
+        if match:
+            addr_part = match.group(1).strip()
+            lines = addr_part.split('\n')
+            return process_address_lines(lines)
     
     return ""
 
@@ -209,30 +245,16 @@ def clean_address_for_geocoding(addr: str) -> str:
         return ""
     
     # Remove OZON/DDX prefixes - they prevent geocoding
-    addr = re.sub(r'^OZON\s+', '', addr)
-    addr = re.sub(r'^DDX\s*-?\s*', '', addr)
+    for pattern in ADDRESS_PREFIX_RES:
+        addr = pattern.sub('', addr)
     
     # Remove manager comments that got mixed into address
-    manager_patterns = [
-        r'^Оплата монтажнику\s*\d*%?\s*,?\s*',  # At start
-        r',?\s*Оплата монтажнику\s*\d*%?\s*$',  # At end
-        r'^оплатить\s+\d+\s*,?\s*',  # "оплатить 7000"
-        r'^зарплата\s+\d+.*?,?\s*',  # "зарплата 3500 (ПС Тимофеев)"
-    ]
-    for pattern in manager_patterns:
-        addr = re.sub(pattern, '', addr, flags=re.IGNORECASE)
+    for pattern in ADDRESS_MANAGER_COMMENT_RES:
+        addr = pattern.sub('', addr)
     
     # Remove garbage suffixes (comments after address)
-    garbage_patterns = [
-        r',?\s*зарплата\s+монтажник.*$',
-        r',?\s*диагностика\s+.*$', 
-        r',?\s*тест\s+делаем.*$',
-        r'\s+диагностика\s+\w+$',
-        r'\s*\(эатж.*\)$',  # typo "эатж" = "этаж"
-        r'\s*\(этаж.*\)$',
-    ]
-    for pattern in garbage_patterns:
-        addr = re.sub(pattern, '', addr, flags=re.IGNORECASE)
+    for pattern in ADDRESS_GARBAGE_RES:
+        addr = pattern.sub('', addr)
     
     return addr.strip()
 
@@ -243,7 +265,7 @@ def extract_period(df: pd.DataFrame) -> str:
         for col in df.columns:
             val = df.iloc[i][col]
             if pd.notna(val) and 'Период:' in str(val):
-                match = re.search(r'(\d{2})\.(\d{2})\.(\d{4})\s*-\s*(\d{2})\.(\d{2})\.(\d{4})', str(val))
+                match = PERIOD_RE.search(str(val))
                 if match:
                     d1, m1, y1, d2, m2, y2 = match.groups()
                     return f"{d1}-{d2}.{m1}.{y2[2:]}"
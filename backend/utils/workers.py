@@ -2,6 +2,8 @@
 Worker name normalization and validation functions
 """
 
+from functools import lru_cache
+
 
 # Groups to exclude from salary calculation (not real workers)
 EXCLUDED_GROUPS = {
@@ -91,6 +93,18 @@ def normalize_worker_name(name: str, name_map: dict = None) -> str:
     return normalized
 
 
+def base_worker_name(name: str) -> str:
+    """Normalized worker name without "(оплата клиентом)" suffix (no name map)"""
+    return _base_worker_name(name) if name else name
+
+
+@lru_cache(maxsize=1024)
+def _base_worker_name(name: str) -> str:
+    # Memoized: a period has few distinct workers but many rows
+    return normalize_worker_name(name.replace(" (оплата клиентом)", ""))
+
+
+@lru_cache(maxsize=1024)
 def is_valid_worker_name(name: str) -> bool:
     """Check if name looks like a real person name (ФИО)
     